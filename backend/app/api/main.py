@@ -1,6 +1,15 @@
 from fastapi import APIRouter
 
-from app.api.routes import chats, login, messages, private, users, utils, websocket
+from app.api.routes import (
+    chats,
+    events,
+    login,
+    messages,
+    private,
+    users,
+    utils,
+    websocket,
+)
 from app.core.config import settings
 
 api_router = APIRouter()
@@ -10,6 +19,7 @@ api_router.include_router(utils.router)
 api_router.include_router(chats.router)
 api_router.include_router(messages.router)
 api_router.include_router(websocket.router)
+api_router.include_router(events.router)
 
 
 if settings.ENVIRONMENT == "local":
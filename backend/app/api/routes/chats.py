@@ -1,22 +1,24 @@
+from datetime import datetime
 from typing import Any
 
-from fastapi import APIRouter, HTTPException
-from sqlmodel import select
+from fastapi import APIRouter, BackgroundTasks, HTTPException
 
-from app import crud
-from app.api.deps import CurrentUser, SessionDep
+from app import crud, crud_async
+from app.api.deps import AsyncSessionDep, CurrentUser, SessionDep
+from app.core.chat_updates import notify_members_changed
+from app.core.read_receipts import read_receipts
 from app.models import (
     Chat,
     ChatAddMembers,
     ChatCreate,
-    ChatMember,
     ChatMemberPublic,
-    ChatMessage,
     ChatMessagePublic,
     ChatMessagesPublic,
     ChatPublic,
     ChatsPublic,
+    ChatUnreadPublic,
     Message,
+    UnreadSummaryPublic,
     User,
     UserPublic,
 )
@@ -24,80 +26,142 @@ from app.models import (
 router = APIRouter(prefix="/chats", tags=["chats"])
 
 
-def _format_chat_public(chat: Chat, current_user_id: int, session: SessionDep) -> ChatPublic:
-    """Форматирует чат для API ответа"""
-    # Получаем участников
-    members_stmt = select(ChatMember).where(ChatMember.chat_id == chat.id)
-    members = list(session.exec(members_stmt).all())
-    
-    # Для приватного чата определяем собеседника
-    chat_name = chat.name
-    if chat.chat_type == "private" and not chat_name:
-        for member in members:
-            if member.user_id != current_user_id:
-                user = session.get(User, member.user_id)
-                if user:
-                    chat_name = user.full_name or user.email
-    
-    # Получаем последнее сообщение
-    last_msg_stmt = (
-        select(ChatMessage)
-        .where(ChatMessage.chat_id == chat.id)
-        .order_by(ChatMessage.created_at.desc())
-        .limit(1)
+def _format_chats_public(
+    chats: list[Chat], current_user_id: int, session: SessionDep
+) -> list[ChatPublic]:
+    """Форматирует чаты для API ответа.
+
+    Участники и пользователи всех чатов загружаются пачкой - число запросов
+    не зависит от числа чатов. Последнее сообщение берется из сводки чата.
+    """
+    chat_ids = [chat.id for chat in chats]
+    members_by_chat = crud.get_members_of_chats(session=session, chat_ids=chat_ids)
+    users = crud.get_users_by_ids(
+        session=session,
+        user_ids={
+            member.user_id for members in members_by_chat.values() for member in members
+        }
+        | {
+            chat.last_message_sender_id for chat in chats if chat.last_message_sender_id
+        },
+    )
+    # Счетчики с поправкой на еще не записанные отметки о прочтении - одним запросом
+    unread_after_reads = crud.count_unread_after_reads(
+        session=session,
+        reads={
+            (chat_id, current_user_id): read_at
+            for chat_id, read_at in read_receipts.pending_for_user(
+                current_user_id
+            ).items()
+            if chat_id in members_by_chat
+        },
     )
-    last_message = session.exec(last_msg_stmt).first()
-    
-    # Форматируем участников
-    members_public = []
-    for member in members:
-        user = session.get(User, member.user_id)
-        if user:
-            members_public.append(
-                ChatMemberPublic(
-                    id=member.id,
-                    user_id=member.user_id,
-                    user=UserPublic.model_validate(user),
-                    joined_at=member.joined_at,
-                    last_read_at=member.last_read_at,
+
+    result = []
+    for chat in chats:
+        members = members_by_chat.get(chat.id, [])
+
+        # Для приватного чата определяем собеседника
+        chat_name = chat.name
+        if chat.chat_type == "private" and not chat_name:
+            for member in members:
+                if member.user_id != current_user_id:
+                    user = users.get(member.user_id)
+                    if user:
+                        chat_name = user.full_name or user.email
+
+        # Форматируем участников
+        members_public = []
+        for member in members:
+            user = users.get(member.user_id)
+            if user:
+                members_public.append(
+                    ChatMemberPublic(
+                        id=member.id,
+                        user_id=member.user_id,
+                        user=UserPublic.model_validate(user),
+                        joined_at=member.joined_at,
+                        # Позиция из буфера (своя или услышанная от других
+                        # воркеров по шине) новее записанной в базу
+                        last_read_at=read_receipts.last_read(chat.id, member.user_id)
+                        or member.last_read_at,
+                    )
                 )
-            )
-    
-    return ChatPublic(
-        id=chat.id,
-        chat_type=chat.chat_type,
-        name=chat_name,
-        created_at=chat.created_at,
-        updated_at=chat.updated_at,
-        members=members_public,
-        last_message=(
-            ChatMessagePublic(
-                id=last_message.id,
-                chat_id=last_message.chat_id,
-                sender_id=last_message.sender_id,
-                sender=UserPublic.model_validate(session.get(User, last_message.sender_id)) if session.get(User, last_message.sender_id) else None,
-                content=last_message.content,
-                created_at=last_message.created_at,
-                edited_at=last_message.edited_at,
-            )
-            if last_message
+
+        sender = (
+            users.get(chat.last_message_sender_id)
+            if chat.last_message_sender_id
             else None
-        ),
-    )
+        )
+        unread_count = 0
+        for member in members:
+            if member.user_id == current_user_id:
+                unread_count = min(
+                    member.unread_count,
+                    unread_after_reads.get(
+                        (chat.id, member.user_id), member.unread_count
+                    ),
+                )
+        result.append(
+            ChatPublic(
+                id=chat.id,
+                chat_type=chat.chat_type,
+                name=chat_name,
+                created_at=chat.created_at,
+                updated_at=chat.updated_at,
+                members=members_public,
+                last_message=(
+                    ChatMessagePublic(
+                        id=chat.last_message_id,
+                        chat_id=chat.id,
+                        sender_id=chat.last_message_sender_id,
+                        sender=UserPublic.model_validate(sender) if sender else None,
+                        content=chat.last_message_preview,
+                        created_at=chat.last_message_at,
+                    )
+                    if chat.last_message_id is not None
+                    else None
+                ),
+                message_count=chat.message_count,
+                unread_count=unread_count,
+            )
+        )
+    return result
+
+
+def _format_chat_public(
+    chat: Chat, current_user_id: int, session: SessionDep
+) -> ChatPublic:
+    """Форматирует чат для API ответа"""
+    return _format_chats_public([chat], current_user_id, session)[0]
 
 
 @router.get("/", response_model=ChatsPublic)
 def get_chats(session: SessionDep, current_user: CurrentUser) -> Any:
     """Получить все чаты текущего пользователя"""
     chats = crud.get_user_chats(session=session, user_id=current_user.id)
-    
-    chats_public = []
-    for chat in chats:
-        chats_public.append(_format_chat_public(chat, current_user.id, session))
-    
+    chats_public = _format_chats_public(chats, current_user.id, session)
     return ChatsPublic(data=chats_public, count=len(chats_public))
 
 
+@router.get("/unread-summary", response_model=UnreadSummaryPublic)
+def get_unread_summary(session: SessionDep, current_user: CurrentUser) -> Any:
+    """Непрочитанные по чатам и их сумма - по строке участника на чат"""
+    counts = crud.get_unread_summary(
+        session=session,
+        user_id=current_user.id,
+        read_overrides=read_receipts.pending_for_user(current_user.id),
+    )
+    chats = [
+        ChatUnreadPublic(chat_id=chat_id, unread_count=count)
+        for chat_id, count in sorted(counts.items())
+        if count
+    ]
+    return UnreadSummaryPublic(
+        total=sum(chat.unread_count for chat in chats), chats=chats
+    )
+
+
 @router.get("/{chat_id}", response_model=ChatPublic)
 def get_chat(chat_id: int, session: SessionDep, current_user: CurrentUser) -> Any:
     """Получить конкретный чат"""
@@ -109,7 +173,12 @@ def get_chat(chat_id: int, session: SessionDep, current_user: CurrentUser) -> An
 
 
 @router.post("/private/{user_id}", response_model=ChatPublic)
-def create_or_get_private_chat(user_id: int, session: SessionDep, current_user: CurrentUser) -> Any:
+def create_or_get_private_chat(
+    user_id: int,
+    session: SessionDep,
+    current_user: CurrentUser,
+    background_tasks: BackgroundTasks,
+) -> Any:
     """Создать или получить приватный чат с пользователем"""
     if user_id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot create chat with yourself")
@@ -124,13 +193,19 @@ def create_or_get_private_chat(user_id: int, session: SessionDep, current_user:
         user1_id=current_user.id,
         user2_id=user_id,
     )
+    background_tasks.add_task(
+        notify_members_changed, chat.id, [current_user.id, user_id]
+    )
     
     return _format_chat_public(chat, current_user.id, session)
 
 
 @router.post("/group", response_model=ChatPublic)
 def create_group_chat(
-    chat_in: ChatCreate, session: SessionDep, current_user: CurrentUser
+    chat_in: ChatCreate,
+    session: SessionDep,
+    current_user: CurrentUser,
+    background_tasks: BackgroundTasks,
 ) -> Any:
     """Создать групповой чат"""
     if chat_in.chat_type != "group":
@@ -154,6 +229,9 @@ def create_group_chat(
         name=chat_in.name,
         member_ids=chat_in.member_ids,
     )
+    background_tasks.add_task(
+        notify_members_changed, chat.id, [current_user.id, *chat_in.member_ids]
+    )
     
     return _format_chat_public(chat, current_user.id, session)
 
@@ -164,6 +242,7 @@ def add_members_to_group(
     members_in: ChatAddMembers,
     session: SessionDep,
     current_user: CurrentUser,
+    background_tasks: BackgroundTasks,
 ) -> Any:
     """Добавить участников в групповой чат"""
     chat = crud.get_chat(session=session, chat_id=chat_id, user_id=current_user.id)
@@ -188,18 +267,26 @@ def add_members_to_group(
     
     if not updated_chat:
         raise HTTPException(status_code=403, detail="You don't have permission to add members to this chat")
+    background_tasks.add_task(
+        notify_members_changed, chat_id, members_in.member_ids
+    )
     
     return _format_chat_public(updated_chat, current_user.id, session)
 
 
 @router.post("/{chat_id}/read", response_model=Message)
-def mark_chat_read(chat_id: int, session: SessionDep, current_user: CurrentUser) -> Any:
+async def mark_chat_read(
+    chat_id: int, session: AsyncSessionDep, current_user: CurrentUser
+) -> Any:
     """Отметить чат как прочитанный"""
-    chat = crud.get_chat(session=session, chat_id=chat_id, user_id=current_user.id)
-    if not chat:
+    member = await crud_async.get_member(
+        session=session, chat_id=chat_id, user_id=current_user.id
+    )
+    if not member:
         raise HTTPException(status_code=404, detail="Chat not found")
-    
-    crud.mark_chat_as_read(session=session, chat_id=chat_id, user_id=current_user.id)
+
+    # Запись в базу и рассылка отметки идут пачками (app/core/read_receipts.py)
+    read_receipts.mark(chat_id, current_user.id)
     return Message(message="Chat marked as read")
 
 
@@ -210,19 +297,52 @@ def get_messages(
     current_user: CurrentUser,
     skip: int = 0,
     limit: int = 50,
+    before_id: int | None = None,
+    after_id: int | None = None,
+    around_id: int | None = None,
+    around_at: datetime | None = None,
 ) -> Any:
-    """Получить сообщения чата"""
+    """Получить сообщения чата.
+
+    Листание истории - курсором: before_id (id самого старого загруженного
+    сообщения) дает предыдущую страницу, after_id - следующую. Страница
+    ищется по индексу на любой глубине и не сдвигается от новых сообщений.
+
+    around_id открывает окно из limit сообщений вокруг сообщения (переход
+    из поиска), around_at - вокруг момента времени: с last_read_at
+    участника окно начинается перед первым непрочитанным.
+    """
+    cursors = [before_id, after_id, around_id, around_at]
+    if sum(cursor is not None for cursor in cursors) > 1:
+        raise HTTPException(
+            status_code=400,
+            detail="Use only one of before_id, after_id, around_id, around_at",
+        )
     chat = crud.get_chat(session=session, chat_id=chat_id, user_id=current_user.id)
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
     
-    messages = crud.get_chat_messages(
-        session=session,
-        chat_id=chat_id,
-        user_id=current_user.id,
-        skip=skip,
-        limit=limit,
-    )
+    if around_id is not None or around_at is not None:
+        messages = crud.get_messages_around(
+            session=session,
+            chat_id=chat_id,
+            user_id=current_user.id,
+            limit=limit,
+            around_id=around_id,
+            around_at=around_at,
+        )
+        if messages is None:
+            raise HTTPException(status_code=404, detail="Message not found")
+    else:
+        messages = crud.get_chat_messages(
+            session=session,
+            chat_id=chat_id,
+            user_id=current_user.id,
+            skip=skip,
+            limit=limit,
+            before_id=before_id,
+            after_id=after_id,
+        )
     
     messages_public = []
     for msg in messages:
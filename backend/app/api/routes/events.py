@@ -0,0 +1,107 @@
+from collections.abc import AsyncIterator
+
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+
+from app.core.config import settings
+from app.core.db import run_db
+from app.core.realtime import POLICY_VIOLATION_CLOSE_CODE, Frame, manager
+from app.core.replay import (
+    get_chat_ids,
+    get_user_from_token,
+    parse_last_ids,
+    replay_missed,
+)
+from app.core.sse import SSEConnection, retry_after_ms
+from app.models import User
+
+router = APIRouter(tags=["events"])
+
+
+async def _authenticate(request: Request, token: str | None) -> User:
+    """Токен из query параметра (EventSource не умеет заголовки) или Authorization"""
+    if token is None:
+        scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer":
+            token = credentials
+    user = await get_user_from_token(token) if token else None
+    if user is None or not user.is_active:
+        raise HTTPException(status_code=403, detail="Could not validate credentials")
+    return user
+
+
+def _admit(user_id: int) -> None:
+    rejection = manager.check_admission(user_id)
+    if rejection is None:
+        return
+    code, reason = rejection
+    if code == POLICY_VIOLATION_CLOSE_CODE:
+        raise HTTPException(status_code=429, detail=reason)
+    retry = retry_after_ms(reason) or 1000
+    raise HTTPException(
+        status_code=503,
+        detail="Service unavailable",
+        headers={"Retry-After": str(-(-retry // 1000))},
+    )
+
+
+@router.get("/events")
+async def stream_events(
+    request: Request,
+    token: str | None = None,
+    only_chat_ids: list[int] | None = Query(default=None, alias="chat_id"),
+    last_ids: str | None = None,
+    last_event_id: str | None = Header(default=None),
+) -> StreamingResponse:
+    """Поток событий чатов пользователя в формате Server-Sent Events.
+
+    Для клиентов, которым нужно только читать: тот же конвейер и те же
+    события, что у /ws. Параметр chat_id ограничивает поток чатами из
+    списка. Пропущенное досылается по заголовку Last-Event-ID или по
+    параметру last_ids того же формата, что у /ws.
+    """
+    user = await _authenticate(request, token)
+    _admit(user.id)
+
+    chat_ids = await run_db(get_chat_ids, user.id)
+    if only_chat_ids is not None:
+        chat_ids = [chat_id for chat_id in chat_ids if chat_id in only_chat_ids]
+    resume_ids = parse_last_ids(last_event_id or last_ids)
+
+    connection = SSEConnection(
+        user.id,
+        on_close=manager.disconnect,
+        last_ids={
+            chat_id: resume_ids[chat_id]
+            for chat_id in chat_ids
+            if chat_id in resume_ids
+        },
+        queue_size=settings.REALTIME_SEND_QUEUE_SIZE,
+        policy=settings.REALTIME_SLOW_CONSUMER_POLICY,
+        # Без фильтра поток, как /ws, подписывается и на новые чаты
+        all_chats=only_chat_ids is None,
+    )
+    # Откладываем живые события до реплея (без await между register и hold)
+    manager.register(connection, chat_ids)
+    for chat_id in connection.last_ids:
+        connection.hold(chat_id)
+    connection.enqueue(
+        Frame.from_event(
+            {"type": "subscribed", "chat_ids": sorted(connection.chat_ids)}
+        )
+    )
+
+    async def body() -> AsyncIterator[str]:
+        try:
+            for chat_id, last_id in list(connection.last_ids.items()):
+                await replay_missed(connection, chat_id, last_id)
+            async for chunk in connection.stream():
+                yield chunk
+        finally:
+            manager.disconnect(connection)
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -4,16 +4,18 @@ from typing import Any
 
 from fastapi import APIRouter, HTTPException
 
-from app import crud
-from app.api.deps import CurrentUser, SessionDep
-from app.api.routes.websocket import manager
+from app import crud_async
+from app.api.deps import AsyncSessionDep, CurrentUser
+from app.core.chat_updates import notify_new_message
+from app.core.metrics import Trace, current_trace, metrics
+from app.core.realtime import manager
+from app.core.typing_indicators import typing_indicators
 from app.models import (
     ChatMessage,
     ChatMessageCreate,
     ChatMessagePublic,
     ChatMessageUpdate,
     Message,
-    User,
     UserPublic,
 )
 
@@ -21,46 +23,58 @@ router = APIRouter(prefix="/messages", tags=["messages"])
 logger = logging.getLogger(__name__)
 
 
-async def broadcast_message_to_chat(message_public: ChatMessagePublic, chat_id: int):
-    """Транслировать сообщение всем участникам чата через WebSocket"""
-    # Используем mode='json' для правильной сериализации datetime
-    message_dict = message_public.model_dump(mode='json')
-    logger.info(f"Broadcasting message {message_dict.get('id')} to chat {chat_id}")
+async def broadcast_event_to_chat(event: dict[str, Any], chat_id: int):
+    """Транслировать событие всем участникам чата через WebSocket"""
+    # Модели сериализуются один раз внутри broadcast_to_chat
     try:
-        await manager.broadcast_to_chat(
-            {
-                "type": "new_message",
-                "message": message_dict,
-            },
-            chat_id,
-        )
-        logger.info(f"Message broadcasted successfully")
+        await manager.broadcast_to_chat(event, chat_id)
     except Exception as e:
-        logger.error(f"Error broadcasting message: {e}")
+        logger.error(f"Error broadcasting {event['type']} to chat {chat_id}: {e}")
+
+
+async def broadcast_message_to_chat(message_public: ChatMessagePublic, chat_id: int):
+    """Транслировать сообщение всем участникам чата через WebSocket"""
+    logger.info(f"Broadcasting message {message_public.id} to chat {chat_id}")
+    await broadcast_event_to_chat(
+        {
+            "type": "new_message",
+            "message": message_public,
+        },
+        chat_id,
+    )
+    # Превью и счетчики непрочитанных в списках чатов участников
+    await notify_new_message(message_public)
 
 
 @router.post("/{chat_id}", response_model=ChatMessagePublic)
 async def create_message(
     chat_id: int,
     message_in: ChatMessageCreate,
-    session: SessionDep,
+    session: AsyncSessionDep,
     current_user: CurrentUser,
 ) -> Any:
     """Создать сообщение в чате"""
-    # Проверяем, что пользователь является участником чата
-    chat = crud.get_chat(session=session, chat_id=chat_id, user_id=current_user.id)
-    if not chat:
-        raise HTTPException(status_code=404, detail="Chat not found")
-    
+    # Трейс с самого начала обработки: в него попадают db_commit и рассылка,
+    # задача рассылки наследует его вместе с контекстом
+    token = current_trace.set(Trace("rest_message"))
     try:
-        message = crud.create_message(
-            session=session,
-            chat_id=chat_id,
-            sender_id=current_user.id,
-            content=message_in.content,
+        # async маршрут - работаем с базой через асинхронный CRUD, не блокируя event loop
+        # Проверяем, что пользователь является участником чата
+        chat = await crud_async.get_chat(
+            session=session, chat_id=chat_id, user_id=current_user.id
         )
+        if not chat:
+            raise HTTPException(status_code=404, detail="Chat not found")
+
+        with metrics.stage("db_commit"):
+            message = await crud_async.create_message(
+                session=session,
+                chat_id=chat_id,
+                sender_id=current_user.id,
+                content=message_in.content,
+            )
         
-        sender = session.get(User, message.sender_id)
+        sender = await crud_async.get_user(session=session, user_id=message.sender_id)
         message_public = ChatMessagePublic(
             id=message.id,
             chat_id=message.chat_id,
@@ -71,23 +85,26 @@ async def create_message(
             edited_at=message.edited_at,
         )
         
+        typing_indicators.stopped_typing(chat_id, current_user.id)
         # Транслируем сообщение всем участникам чата через WebSocket (не ждем завершения)
         asyncio.create_task(broadcast_message_to_chat(message_public, chat_id))
         
         return message_public
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        current_trace.reset(token)
 
 
 @router.put("/{message_id}", response_model=ChatMessagePublic)
-def update_message(
+async def update_message(
     message_id: int,
     message_in: ChatMessageUpdate,
-    session: SessionDep,
+    session: AsyncSessionDep,
     current_user: CurrentUser,
 ) -> Any:
     """Обновить сообщение"""
-    message = crud.update_message(
+    message = await crud_async.update_message(
         session=session,
         message_id=message_id,
         sender_id=current_user.id,
@@ -97,7 +114,21 @@ def update_message(
     if not message:
         raise HTTPException(status_code=404, detail="Message not found or you don't have permission")
     
-    sender = session.get(User, message.sender_id)
+    # Клиентам достаточно новых полей, остальное у них уже есть
+    asyncio.create_task(
+        broadcast_event_to_chat(
+            {
+                "type": "message_edited",
+                "id": message.id,
+                "chat_id": message.chat_id,
+                "content": message.content,
+                "edited_at": message.edited_at,
+            },
+            message.chat_id,
+        )
+    )
+
+    sender = await crud_async.get_user(session=session, user_id=message.sender_id)
     return ChatMessagePublic(
         id=message.id,
         chat_id=message.chat_id,
@@ -110,16 +141,21 @@ def update_message(
 
 
 @router.delete("/{message_id}", response_model=Message)
-def delete_message(
-    message_id: int, session: SessionDep, current_user: CurrentUser
+async def delete_message(
+    message_id: int, session: AsyncSessionDep, current_user: CurrentUser
 ) -> Any:
     """Удалить сообщение"""
-    success = crud.delete_message(
+    message = await crud_async.delete_message(
         session=session, message_id=message_id, user_id=current_user.id
     )
     
-    if not success:
+    if not message:
         raise HTTPException(status_code=404, detail="Message not found or you don't have permission")
     
+    asyncio.create_task(
+        broadcast_event_to_chat(
+            {"type": "message_deleted", "id": message_id, "chat_id": message.chat_id},
+            message.chat_id,
+        )
+    )
     return Message(message="Message deleted successfully")
-
@@ -1,7 +1,7 @@
 import uuid
 from typing import Any
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlmodel import func, select
 
 from app import crud
@@ -9,16 +9,20 @@ from app.api.deps import (
     CurrentUser,
     SessionDep,
     get_current_active_superuser,
+    get_current_user,
 )
 from app.core.config import settings
+from app.core.presence import presence
 from app.core.security import get_password_hash, verify_password
 from app.models import (
     Message,
     UpdatePassword,
     User,
     UserCreate,
+    UserPresence,
     UserPublic,
     UserRegister,
+    UsersPresence,
     UsersPublic,
     UserUpdate,
     UserUpdateMe,
@@ -42,6 +46,29 @@ def search_users(
     return UsersPublic(data=users, count=len(users))
 
 
+@router.get(
+    "/presence",
+    dependencies=[Depends(get_current_user)],
+    response_model=UsersPresence,
+)
+def read_users_presence(
+    session: SessionDep, user_ids: list[int] = Query(max_length=500)
+) -> Any:
+    """Онлайн-статус и время последнего визита пользователей"""
+    users = session.exec(select(User).where(User.id.in_(user_ids))).all()
+    online = presence.online_users()
+    return UsersPresence(
+        data=[
+            UserPresence(
+                user_id=user.id,
+                online=user.id in online,
+                last_seen_at=presence.last_seen(user.id) or user.last_seen_at,
+            )
+            for user in users
+        ]
+    )
+
+
 @router.get(
     "/",
     dependencies=[Depends(get_current_active_superuser)],
@@ -1,7 +1,13 @@
+import os
+import resource
+from typing import Any
+
 from fastapi import APIRouter, Depends
 from pydantic.networks import EmailStr
 
 from app.api.deps import get_current_active_superuser
+from app.core.metrics import metrics
+from app.core.realtime import manager
 from app.models import Message
 from app.utils import generate_test_email, send_email
 
@@ -26,6 +32,42 @@ def test_email(email_to: EmailStr) -> Message:
     return Message(message="Test email sent")
 
 
+@router.get(
+    "/realtime-stats/",
+    dependencies=[Depends(get_current_active_superuser)],
+)
+async def realtime_stats() -> dict[str, int]:
+    """
+    WebSocket connection gauges of the worker that served the request.
+
+    Runs on the event loop thread: the manager state must not be read from
+    the threadpool while the loop is changing it.
+    """
+    return {
+        **manager.stats(),
+        "pid": os.getpid(),
+        # Peak resident memory of the worker process (KiB on Linux)
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+@router.get(
+    "/realtime-metrics/",
+    dependencies=[Depends(get_current_active_superuser)],
+)
+async def realtime_metrics(reset: bool = False) -> dict[str, Any]:
+    """
+    Per-stage latency histograms and sampled message traces of the worker
+    that served the request. Pass reset=true to start a new window.
+
+    Like realtime_stats, runs on the event loop thread that records them.
+    """
+    snapshot = {"pid": os.getpid(), **metrics.snapshot()}
+    if reset:
+        metrics.reset()
+    return snapshot
+
+
 @router.get("/health-check/")
 async def health_check() -> bool:
     return True
@@ -1,165 +1,315 @@
-import json
-from typing import Dict, Set
+import asyncio
+import logging
+import time
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from sqlmodel import Session
 
 from app import crud
-from app.core.security import decode_access_token
-from app.core.db import engine
-from app.models import ChatMessage, ChatMessagePublic, User, UserPublic
+from app.core.chat_updates import notify_new_message
+from app.core.config import settings
+from app.core.db import engine, run_db
+from app.core.metrics import Trace, current_trace, metrics
+from app.core.protocol import (
+    InvalidFrame,
+    MessageFrame,
+    PingFrame,
+    PongFrame,
+    SubscribeFrame,
+    TypingFrame,
+    UnsubscribeFrame,
+    decode_client_frame,
+    negotiate_protocol,
+)
+from app.core.realtime import (
+    INTERNAL_ERROR_CLOSE_CODE,
+    POLICY_VIOLATION_CLOSE_CODE,
+    Connection,
+    manager,
+)
+from app.core.replay import (
+    get_chat_ids,
+    get_user_from_token,
+    parse_last_ids,
+    replay_missed,
+)
+from app.core.typing_indicators import typing_indicators
+from app.models import ChatMessagePublic, User, UserPublic
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 
-# Хранилище активных WebSocket соединений
-class ConnectionManager:
-    def __init__(self):
-        # chat_id -> set of websockets
-        self.active_connections: Dict[int, Set[WebSocket]] = {}
-        # user_id -> set of websockets
-        self.user_connections: Dict[int, Set[WebSocket]] = {}
-
-    async def connect(self, websocket: WebSocket, chat_id: int, user_id: int):
-        await websocket.accept()
-        
-        if chat_id not in self.active_connections:
-            self.active_connections[chat_id] = set()
-        self.active_connections[chat_id].add(websocket)
-        
-        if user_id not in self.user_connections:
-            self.user_connections[user_id] = set()
-        self.user_connections[user_id].add(websocket)
-
-    def disconnect(self, websocket: WebSocket, chat_id: int, user_id: int):
-        if chat_id in self.active_connections:
-            self.active_connections[chat_id].discard(websocket)
-            if not self.active_connections[chat_id]:
-                del self.active_connections[chat_id]
-        
-        if user_id in self.user_connections:
-            self.user_connections[user_id].discard(websocket)
-            if not self.user_connections[user_id]:
-                del self.user_connections[user_id]
-
-    async def send_personal_message(self, message: dict, websocket: WebSocket):
-        await websocket.send_json(message)
-
-    async def broadcast_to_chat(self, message: dict, chat_id: int):
-        import logging
-        logger = logging.getLogger(__name__)
-        if chat_id in self.active_connections:
-            logger.info(f"Broadcasting to {len(self.active_connections[chat_id])} connections in chat {chat_id}")
-            disconnected = set()
-            for connection in self.active_connections[chat_id]:
-                try:
-                    await connection.send_json(message)
-                    logger.info(f"Message sent to connection in chat {chat_id}")
-                except Exception as e:
-                    logger.error(f"Error sending message to connection: {e}")
-                    disconnected.add(connection)
-            
-            # Удаляем отключенные соединения
-            for conn in disconnected:
-                self.active_connections[chat_id].discard(conn)
-        else:
-            logger.warning(f"No active connections for chat {chat_id}")
-
-
-manager = ConnectionManager()
-
-
-async def get_user_from_websocket(websocket: WebSocket, token: str) -> User | None:
-    """Получить пользователя из токена WebSocket"""
+def _is_chat_member(chat_id: int, user_id: int) -> bool:
+    with Session(engine) as session:
+        return crud.get_chat(session=session, chat_id=chat_id, user_id=user_id) is not None
+
+
+def _create_message(chat_id: int, sender_id: int, content: str) -> ChatMessagePublic:
+    """Сохранить сообщение и собрать ответ - выполняется в пуле потоков БД"""
+    with Session(engine) as session:
+        message = crud.create_message(
+            session=session,
+            chat_id=chat_id,
+            sender_id=sender_id,
+            content=content,
+        )
+
+        sender = session.get(User, message.sender_id)
+        return ChatMessagePublic(
+            id=message.id,
+            chat_id=message.chat_id,
+            sender_id=message.sender_id,
+            sender=UserPublic.model_validate(sender) if sender else None,
+            content=message.content,
+            created_at=message.created_at,
+            edited_at=message.edited_at,
+        )
+
+
+async def reject_connection(websocket: WebSocket, user_id: int | None = None) -> bool:
+    """Отклонить соединение, если воркер останавливается, перегружен или
+    у пользователя слишком много соединений.
+
+    Сокет принимается и сразу закрывается - иначе клиент не увидит код и
+    задержку переподключения в reason.
+    """
+    rejection = manager.check_admission(user_id)
+    if rejection is None:
+        return False
+    code, reason = rejection
+    await websocket.accept()
+    await websocket.close(code=code, reason=reason)
+    return True
+
+
+async def authenticate_websocket(websocket: WebSocket) -> User | None:
+    """Проверить токен из query параметров, при ошибке закрыть соединение"""
+    token = websocket.query_params.get("token")
+    if not token:
+        await websocket.close(code=1008, reason="Token required")
+        return None
+
+    user = await get_user_from_token(token)
+    if not user:
+        await websocket.close(code=1008, reason="Invalid token")
+        return None
+    return user
+
+
+async def handle_chat_message(connection: Connection, user: User, chat_id: int, content: str) -> None:
+    """Сохранить сообщение из WebSocket и разослать его участникам чата"""
+    try:
+        # Коммит SQLite выполняется вне event loop
+        with metrics.stage("db_commit"):
+            message_public = await run_db(_create_message, chat_id, user.id, content)
+        typing_indicators.stopped_typing(chat_id, user.id)
+
+        # Отправляем сообщение всем участникам чата
+        # Модель сериализуется один раз внутри broadcast_to_chat
+        await manager.broadcast_to_chat(
+            {
+                "type": "new_message",
+                "message": message_public,
+            },
+            chat_id,
+        )
+        # Счетчики непрочитанных считаются вне цикла приема кадров
+        asyncio.create_task(notify_new_message(message_public))
+    except Exception as e:
+        await manager.send_personal_message(
+            {
+                "type": "error",
+                "message": str(e),
+            },
+            connection,
+        )
+
+
+def handle_typing(user: User, chat_id: int) -> None:
+    """Уведомление о печати: рассылается пачкой по тику (app/core/typing_indicators.py)"""
+    typing_indicators.typing(chat_id, user.id, user.full_name or user.email)
+
+
+async def handle_subscribe(
+    connection: Connection, user: User, chat_id: int, last_id: int | None = None
+) -> None:
+    """Подписать соединение на чат, если пользователь в нем состоит"""
+    if not await run_db(_is_chat_member, chat_id, user.id):
+        await manager.send_personal_message(
+            {"type": "error", "message": "Chat not found or access denied", "chat_id": chat_id},
+            connection,
+        )
+        return
+    if last_id is not None:
+        connection.hold(chat_id)
+    manager.subscribe(connection, chat_id)
+    await manager.send_personal_message({"type": "subscribed", "chat_id": chat_id}, connection)
+    if last_id is not None:
+        await replay_missed(connection, chat_id, last_id)
+
+
+async def receive_loop(
+    websocket: WebSocket, connection: Connection, user: User, default_chat_id: int | None = None
+) -> None:
+    """Обработка входящих кадров.
+
+    Кадры адресуются чату полем chat_id; для /ws/{chat_id} по умолчанию
+    используется чат из пути. Некорректный кадр не рвет соединение - клиент
+    получает error.
+    """
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+        received = time.perf_counter()
+        connection.touch()
+        if not connection.allow_frame(connection.last_activity):
+            if connection.rate_limited >= settings.REALTIME_RATE_LIMIT_CLOSE_AFTER:
+                logger.warning(f"Closing flooding connection of user {user.id}")
+                manager.rate_limited_total += 1
+                connection.close(POLICY_VIOLATION_CLOSE_CODE, "Rate limit exceeded")
+                return
+            # Об отброшенных кадрах сообщаем один раз за серию
+            if connection.rate_limited == 1:
+                await manager.send_personal_message(
+                    {"type": "error", "message": "Rate limit exceeded"}, connection
+                )
+            continue
+        try:
+            frame = decode_client_frame(message)
+        except InvalidFrame as e:
+            await manager.send_personal_message({"type": "error", "message": str(e)}, connection)
+            continue
+        finally:
+            metrics.observe("parse", time.perf_counter() - received)
+
+        # Heartbeat: pong только обновляет активность, на ping клиента отвечаем
+        if isinstance(frame, PongFrame):
+            continue
+        if isinstance(frame, PingFrame):
+            await manager.send_personal_message({"type": "pong"}, connection)
+            continue
+
+        if isinstance(frame, SubscribeFrame):
+            await handle_subscribe(connection, user, frame.chat_id, frame.last_id)
+            continue
+
+        if isinstance(frame, UnsubscribeFrame):
+            manager.unsubscribe(connection, frame.chat_id)
+            await manager.send_personal_message(
+                {"type": "unsubscribed", "chat_id": frame.chat_id}, connection
+            )
+            continue
+
+        chat_id = frame.chat_id if frame.chat_id is not None else default_chat_id
+        if chat_id is None:
+            await manager.send_personal_message(
+                {"type": "error", "message": "chat_id is required"}, connection
+            )
+            continue
+
+        # Писать можно только в чаты, на которые подписано соединение
+        if chat_id not in connection.chat_ids:
+            await manager.send_personal_message(
+                {"type": "error", "message": "Not subscribed to chat", "chat_id": chat_id},
+                connection,
+            )
+            continue
+
+        if isinstance(frame, MessageFrame):
+            trace = Trace("ws_message", started=received)
+            token = current_trace.set(trace)
+            try:
+                await handle_chat_message(connection, user, chat_id, frame.content)
+            finally:
+                current_trace.reset(token)
+
+        elif isinstance(frame, TypingFrame):
+            handle_typing(user, chat_id)
+
+
+@router.websocket("/ws")
+async def user_websocket_endpoint(websocket: WebSocket):
+    """Единый WebSocket пользователя, подписанный на все его чаты.
+
+    Параметр last_ids="chat_id:message_id,..." досылает пропущенные
+    сообщения по каждому указанному чату. Бинарный режим MessagePack
+    включается подпротоколом "msgpack" или параметром protocol=msgpack.
+    """
+    if await reject_connection(websocket):
+        return
+    user = await authenticate_websocket(websocket)
+    if not user:
+        return
+    if await reject_connection(websocket, user.id):
+        return
+
+    last_ids = parse_last_ids(websocket.query_params.get("last_ids"))
+    chat_ids = await run_db(get_chat_ids, user.id)
+    protocol, subprotocol = negotiate_protocol(websocket)
+    connection = await manager.connect(
+        websocket,
+        user.id,
+        chat_ids,
+        protocol=protocol,
+        subprotocol=subprotocol,
+        all_chats=True,
+    )
     try:
-        payload = decode_access_token(token)
-        user_id: int = int(payload.get("sub"))
-        if user_id is None:
-            return None
-        
-        with Session(engine) as session:
-            user = session.get(User, user_id)
-            return user
+        # Откладываем живые события до реплея (без await между connect и hold)
+        for chat_id in last_ids:
+            if chat_id in connection.chat_ids:
+                connection.hold(chat_id)
+        await manager.send_personal_message(
+            {"type": "subscribed", "chat_ids": sorted(connection.chat_ids)}, connection
+        )
+
+        for chat_id, last_id in last_ids.items():
+            if chat_id in connection.chat_ids:
+                await replay_missed(connection, chat_id, last_id)
+        await receive_loop(websocket, connection, user)
+    except WebSocketDisconnect:
+        pass
     except Exception:
-        return None
+        logger.exception(f"WebSocket of user {user.id} failed")
+        connection.close(INTERNAL_ERROR_CLOSE_CODE, "Internal error")
+    finally:
+        # Соединение снимается с учета при любом исходе
+        manager.disconnect(connection)
 
 
 @router.websocket("/ws/{chat_id}")
 async def websocket_endpoint(websocket: WebSocket, chat_id: int):
     """WebSocket endpoint для чата"""
-    # Получаем токен из query параметров
-    token = websocket.query_params.get("token")
-    if not token:
-        await websocket.close(code=1008, reason="Token required")
+    if await reject_connection(websocket):
         return
-    
-    user = await get_user_from_websocket(websocket, token)
+    user = await authenticate_websocket(websocket)
     if not user:
-        await websocket.close(code=1008, reason="Invalid token")
         return
-    
+    if await reject_connection(websocket, user.id):
+        return
+
     # Проверяем, что пользователь является участником чата
-    with Session(engine) as session:
-        chat = crud.get_chat(session=session, chat_id=chat_id, user_id=user.id)
-        if not chat:
-            await websocket.close(code=1008, reason="Chat not found or access denied")
-            return
-    
-    await manager.connect(websocket, chat_id, user.id)
-    
+    if not await run_db(_is_chat_member, chat_id, user.id):
+        await websocket.close(code=1008, reason="Chat not found or access denied")
+        return
+
+    protocol, subprotocol = negotiate_protocol(websocket)
+    connection = await manager.connect(
+        websocket, user.id, [chat_id], protocol=protocol, subprotocol=subprotocol
+    )
+
     try:
-        while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
-            
-            if message_data.get("type") == "message":
-                # Создаем сообщение
-                with Session(engine) as session:
-                    try:
-                        message = crud.create_message(
-                            session=session,
-                            chat_id=chat_id,
-                            sender_id=user.id,
-                            content=message_data.get("content", ""),
-                        )
-                        
-                        sender = session.get(User, message.sender_id)
-                        message_public = ChatMessagePublic(
-                            id=message.id,
-                            chat_id=message.chat_id,
-                            sender_id=message.sender_id,
-                            sender=UserPublic.model_validate(sender) if sender else None,
-                            content=message.content,
-                            created_at=message.created_at,
-                            edited_at=message.edited_at,
-                        )
-                        
-                        # Отправляем сообщение всем участникам чата
-                        # Используем mode='json' для правильной сериализации datetime
-                        await manager.broadcast_to_chat(
-                            {
-                                "type": "new_message",
-                                "message": message_public.model_dump(mode='json'),
-                            },
-                            chat_id,
-                        )
-                    except Exception as e:
-                        await websocket.send_json({
-                            "type": "error",
-                            "message": str(e),
-                        })
-            
-            elif message_data.get("type") == "typing":
-                # Уведомление о печати
-                await manager.broadcast_to_chat(
-                    {
-                        "type": "typing",
-                        "user_id": user.id,
-                        "user_name": user.full_name or user.email,
-                    },
-                    chat_id,
-                )
-    
+        # last_id - последнее сообщение, которое клиент видел до разрыва
+        last_id = websocket.query_params.get("last_id")
+        if last_id is not None and last_id.isdigit():
+            await replay_missed(connection, chat_id, int(last_id))
+        await receive_loop(websocket, connection, user, default_chat_id=chat_id)
     except WebSocketDisconnect:
-        manager.disconnect(websocket, chat_id, user.id)
-
+        pass
+    except Exception:
+        logger.exception(f"WebSocket of user {user.id} in chat {chat_id} failed")
+        connection.close(INTERNAL_ERROR_CLOSE_CODE, "Internal error")
+    finally:
+        manager.disconnect(connection)
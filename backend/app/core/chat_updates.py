@@ -0,0 +1,135 @@
+"""Дельты списка чатов.
+
+Вместо перезапроса GET /chats/ клиент получает в соединения пользователя
+компактные события chat_updated: при новом сообщении - превью, updated_at
+и счетчик непрочитанных (у каждого участника свой), при изменении состава -
+список участников. Новые участники подписываются на чат в своих /ws
+соединениях.
+
+На каждое изменение в шину уходит одно событие канала chat_updates со
+счетчиками всех участников сразу, а каждый воркер раскладывает его по
+соединениям своих пользователей.
+"""
+
+import json
+import logging
+from collections.abc import Iterable
+from datetime import datetime, timezone
+
+from sqlmodel import Session, select
+
+from app import crud
+from app.core.db import engine, run_db
+from app.core.read_receipts import read_receipts
+from app.core.realtime import Frame, manager
+from app.models import CHAT_PREVIEW_LENGTH, ChatMember, ChatMessagePublic
+
+logger = logging.getLogger(__name__)
+
+CHAT_UPDATES_CHANNEL = "chat_updates"
+
+
+def _get_unread_counts(
+    chat_id: int, read_overrides: dict[int, datetime]
+) -> dict[int, int]:
+    with Session(engine) as session:
+        return crud.get_unread_counts(
+            session=session, chat_id=chat_id, read_overrides=read_overrides
+        )
+
+
+def _get_member_ids(chat_id: int) -> list[int]:
+    with Session(engine) as session:
+        return list(
+            session.exec(
+                select(ChatMember.user_id).where(ChatMember.chat_id == chat_id)
+            ).all()
+        )
+
+
+async def notify_new_message(message: ChatMessagePublic) -> None:
+    """Обновить список чатов у всех участников после нового сообщения"""
+    try:
+        counts = await run_db(
+            _get_unread_counts,
+            message.chat_id,
+            read_receipts.pending_for_chat(message.chat_id),
+        )
+        await manager.publish(
+            f"{CHAT_UPDATES_CHANNEL}:{message.chat_id}",
+            {
+                "updated_at": message.created_at,
+                "last_message": {
+                    "id": message.id,
+                    "sender_id": message.sender_id,
+                    "content": message.content[:CHAT_PREVIEW_LENGTH],
+                    "created_at": message.created_at,
+                },
+                "unread": counts,
+            },
+        )
+    except Exception as e:
+        logger.error(f"Error sending chat_updated for chat {message.chat_id}: {e}")
+
+
+async def notify_members_changed(
+    chat_id: int, added_user_ids: Iterable[int] = ()
+) -> None:
+    """Сообщить участникам о новом составе чата и подписать добавленных"""
+    try:
+        member_ids = await run_db(_get_member_ids, chat_id)
+        await manager.publish(
+            f"{CHAT_UPDATES_CHANNEL}:{chat_id}",
+            {
+                "updated_at": datetime.now(timezone.utc),
+                "member_ids": sorted(member_ids),
+                "added": sorted(set(added_user_ids) & set(member_ids)),
+            },
+        )
+    except Exception as e:
+        logger.error(f"Error sending chat_updated for chat {chat_id}: {e}")
+
+
+async def _on_chat_update(key: str, data: str) -> None:
+    """Разложить chat_updated по соединениям пользователей этого воркера"""
+    chat_id = int(key)
+    event = json.loads(data)
+    if "unread" in event:
+        # Кадр строится один раз на значение счетчика, а не на участника
+        frames: dict[int, Frame] = {}
+        for user_id, unread_count in event["unread"].items():
+            connections = list(manager.user_connections.get(int(user_id), ()))
+            if not connections:
+                continue
+            if unread_count not in frames:
+                frames[unread_count] = Frame.from_event(
+                    {
+                        "type": "chat_updated",
+                        "chat_id": chat_id,
+                        "updated_at": event["updated_at"],
+                        "last_message": event["last_message"],
+                        "unread_count": unread_count,
+                    }
+                )
+            for connection in connections:
+                connection.enqueue(frames[unread_count])
+        return
+
+    for user_id in event["added"]:
+        for connection in list(manager.user_connections.get(user_id, ())):
+            if connection.all_chats:
+                manager.subscribe(connection, chat_id)
+    frame = Frame.from_event(
+        {
+            "type": "chat_updated",
+            "chat_id": chat_id,
+            "updated_at": event["updated_at"],
+            "member_ids": event["member_ids"],
+        }
+    )
+    for user_id in event["member_ids"]:
+        for connection in list(manager.user_connections.get(user_id, ())):
+            connection.enqueue(frame)
+
+
+manager.channel_handlers[CHAT_UPDATES_CHANNEL] = _on_chat_update
@@ -77,6 +77,69 @@ class Settings(BaseSettings):
         db_path.parent.mkdir(parents=True, exist_ok=True)
         return f"sqlite:///{db_path}"
 
+    @computed_field  # type: ignore[prop-decorator]
+    @property
+    def SQLALCHEMY_ASYNC_DATABASE_URI(self) -> str:
+        # Тот же файл базы через асинхронный драйвер aiosqlite
+        return self.SQLALCHEMY_DATABASE_URI.replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+    # Размер пула потоков для работы с БД из async кода (WebSocket, брокер)
+    DB_EXECUTOR_WORKERS: int = 4
+
+    # Realtime (WebSocket) настройки
+    # "sqlite" - события доставляются между воркерами через общую базу,
+    # "memory" - только внутри одного процесса (один воркер, тесты)
+    REALTIME_BROKER: Literal["memory", "sqlite"] = "sqlite"
+    REALTIME_POLL_INTERVAL: float = 0.05  # секунды между опросами брокера
+    REALTIME_EVENT_TTL_SECONDS: int = 300  # сколько хранить события в брокере
+    # Очередь исходящих событий на каждое соединение и поведение при её
+    # переполнении медленным клиентом
+    REALTIME_SEND_QUEUE_SIZE: int = 256
+    REALTIME_SLOW_CONSUMER_POLICY: Literal["drop_oldest", "disconnect"] = "drop_oldest"
+    # Сколько пропущенных сообщений чата досылать при переподключении
+    REALTIME_REPLAY_LIMIT: int = 200
+    # Сервер пингует соединение, молчащее дольше REALTIME_PING_INTERVAL
+    # секунд, и закрывает молчащее дольше REALTIME_IDLE_TIMEOUT
+    REALTIME_PING_INTERVAL: float = 25
+    REALTIME_IDLE_TIMEOUT: float = 60
+    # Присутствие: изменения онлайн-статуса рассылаются пачкой раз в тик,
+    # время последнего визита пишется в базу раз в PRESENCE_FLUSH_INTERVAL
+    PRESENCE_TICK: float = 2
+    PRESENCE_FLUSH_INTERVAL: float = 30
+    # Как часто воркер рассылает полный список своих онлайн-пользователей
+    PRESENCE_SYNC_INTERVAL: float = 15
+    # Отметки о прочтении копятся в памяти: рассылаются раз в READ_RECEIPT_TICK,
+    # в базу пишутся одной транзакцией раз в READ_RECEIPT_FLUSH_INTERVAL
+    READ_RECEIPT_TICK: float = 0.5
+    READ_RECEIPT_FLUSH_INTERVAL: float = 5
+    # Индикатор печати гаснет через TYPING_TIMEOUT без новых typing,
+    # изменения рассылаются пачкой раз в TYPING_TICK
+    TYPING_TICK: float = 0.5
+    TYPING_TIMEOUT: float = 5
+    # Доля сообщений, чей путь по этапам конвейера сохраняется целиком
+    # (app/core/metrics.py); REALTIME_TRACE_FILE - файл для строк JSON
+    REALTIME_TRACE_SAMPLE_RATE: float = 0.01
+    REALTIME_TRACE_BUFFER: int = 100
+    REALTIME_TRACE_FILE: str | None = None
+    # Плавное отключение при остановке: соединения закрываются волнами за
+    # REALTIME_DRAIN_SECONDS, клиенту передается случайная задержка
+    # переподключения до REALTIME_RECONNECT_JITTER секунд
+    REALTIME_DRAIN_ON_SIGTERM: bool = True
+    REALTIME_DRAIN_SECONDS: float = 5
+    REALTIME_DRAIN_WAVES: int = 10
+    REALTIME_RECONNECT_JITTER: float = 30
+    # Допуск соединений: лимиты на воркер и на пользователя, сброс новых
+    # соединений при суммарной очереди отправки больше REALTIME_MAX_QUEUED_FRAMES
+    REALTIME_MAX_CONNECTIONS: int = 10000
+    REALTIME_MAX_CONNECTIONS_PER_USER: int = 10
+    REALTIME_MAX_QUEUED_FRAMES: int = 100000
+    # Входящие кадры соединения: REALTIME_FRAME_RATE в секунду с запасом
+    # REALTIME_FRAME_BURST; после REALTIME_RATE_LIMIT_CLOSE_AFTER отброшенных
+    # подряд кадров соединение закрывается
+    REALTIME_FRAME_RATE: float = 20
+    REALTIME_FRAME_BURST: int = 40
+    REALTIME_RATE_LIMIT_CLOSE_AFTER: int = 100
+
     SMTP_TLS: bool = True
     SMTP_SSL: bool = False
     SMTP_PORT: int = 587
@@ -1,13 +1,22 @@
-from sqlmodel import Session, create_engine, select
-from sqlalchemy import event
+import asyncio
+import functools
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, TypeVar
+
+from sqlmodel import Session, SQLModel, create_engine, select
+from sqlalchemy import Connection, Engine, event, inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.dialects.sqlite import BLOB
 
 from app import crud
 from app.core.config import settings
 from app.models import (
+    CHAT_PREVIEW_LENGTH,
     Chat,
     ChatMember,
     ChatMessage,
+    RealtimeEvent,  # noqa: F401
     User,
     UserCreate,
 )  # Импортируем все модели для регистрации в метаданных
@@ -23,10 +32,17 @@ engine = create_engine(
     echo=False,
 )
 
+# Асинхронный движок для async маршрутов (app/crud_async.py)
+async_engine = create_async_engine(
+    str(settings.SQLALCHEMY_ASYNC_DATABASE_URI),
+    echo=False,
+)
+
 # Настройка для работы с UUID в SQLite
 if settings.SQLALCHEMY_DATABASE_URI.startswith("sqlite"):
 
     @event.listens_for(engine, "connect")
+    @event.listens_for(async_engine.sync_engine, "connect")
     def set_sqlite_pragma(dbapi_conn, connection_record):
         cursor = dbapi_conn.cursor()
         # Включаем поддержку внешних ключей
@@ -34,20 +50,109 @@ if settings.SQLALCHEMY_DATABASE_URI.startswith("sqlite"):
         cursor.close()
 
 
+T = TypeVar("T")
+
+# Ограниченный пул потоков для синхронной работы с БД из async обработчиков:
+# коммит SQLite не блокирует event loop, а число одновременных
+# подключений к базе не растет вместе с числом сокетов
+db_executor = ThreadPoolExecutor(
+    max_workers=settings.DB_EXECUTOR_WORKERS, thread_name_prefix="db"
+)
+
+
+async def run_db(func: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+    """Выполнить синхронную функцию работы с БД в пуле db_executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        db_executor, functools.partial(func, *args, **kwargs)
+    )
+
+
 # make sure all SQLModel models are imported (app.models) before initializing DB
 # otherwise, SQLModel might fail to initialize relationships properly
 # for more details: https://github.com/fastapi/full-stack-fastapi-template/issues/28
 
 
+def upgrade_schema(db_engine: Engine) -> None:
+    """Догнать схему существующей базы.
+
+    create_all создает только отсутствующие таблицы, поэтому новые колонки
+    и индексы в уже созданных таблицах добавляем здесь. Новые колонки
+    должны быть nullable или иметь server_default.
+    """
+    inspector = inspect(db_engine)
+    added: set[tuple[str, str]] = set()
+    with db_engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=db_engine.dialect)
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                conn.execute(text(ddl))
+                added.add((table.name, column.name))
+
+            existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+
+        if ("chat", "last_message_id") in added:
+            backfill_chat_summary(conn)
+        if ("chatmember", "unread_count") in added:
+            backfill_unread_counts(conn)
+
+
+def backfill_chat_summary(conn: Connection) -> None:
+    """Заполнить сводку чатов по уже существующим сообщениям"""
+    conn.execute(
+        text(
+            """
+            UPDATE chat SET
+                message_count = (
+                    SELECT count(*) FROM chatmessage WHERE chatmessage.chat_id = chat.id
+                ),
+                last_message_id = (
+                    SELECT id FROM chatmessage WHERE chatmessage.chat_id = chat.id
+                    ORDER BY created_at DESC, id DESC LIMIT 1
+                )
+            """
+        )
+    )
+    conn.execute(
+        text(
+            """
+            UPDATE chat SET
+                last_message_preview = (
+                    SELECT substr(content, 1, :length) FROM chatmessage
+                    WHERE chatmessage.id = chat.last_message_id
+                ),
+                last_message_sender_id = (
+                    SELECT sender_id FROM chatmessage WHERE chatmessage.id = chat.last_message_id
+                ),
+                last_message_at = (
+                    SELECT created_at FROM chatmessage WHERE chatmessage.id = chat.last_message_id
+                )
+            WHERE last_message_id IS NOT NULL
+            """
+        ),
+        {"length": CHAT_PREVIEW_LENGTH},
+    )
+
+
 def init_db(session: Session) -> None:
     # Tables should be created with Alembic migrations
     # But if you don't want to use migrations, create
     # the tables un-commenting the next lines
-    from sqlmodel import SQLModel
-
     # This works because the models are already imported and registered from app.models
     # Создаем таблицы для тестов (в продакшене используются миграции Alembic)
     SQLModel.metadata.create_all(engine)
+    upgrade_schema(engine)
 
     user = session.exec(
         select(User).where(User.email == settings.FIRST_SUPERUSER)
@@ -59,3 +164,22 @@ def init_db(session: Session) -> None:
             is_superuser=True,
         )
         user = crud.create_user(session=session, user_create=user_in)
+
+
+def backfill_unread_counts(conn: Connection) -> None:
+    """Посчитать непрочитанные участников по уже существующим сообщениям"""
+    conn.execute(
+        text(
+            """
+            UPDATE chatmember SET unread_count = (
+                SELECT count(*) FROM chatmessage
+                WHERE chatmessage.chat_id = chatmember.chat_id
+                AND chatmessage.sender_id != chatmember.user_id
+                AND (
+                    chatmember.last_read_at IS NULL
+                    OR chatmessage.created_at > chatmember.last_read_at
+                )
+            )
+            """
+        )
+    )
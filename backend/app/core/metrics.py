@@ -0,0 +1,201 @@
+"""Задержки realtime-конвейера по этапам.
+
+Каждый этап пишется в гистограмму воркера:
+
+    parse       разбор входящего кадра WebSocket
+    db_commit   сохранение сообщения
+    serialize   сериализация события
+    bus_write   запись события в шину для других воркеров
+    fanout      раскладка кадра по очередям соединений чата
+    queue_wait  ожидание кадра в очереди соединения
+    send        отправка кадра одному получателю
+    end_to_end  от получения сообщения до отправки последнему получателю
+                на этом воркере
+
+Для нового сообщения заводится Trace, который передается по конвейеру
+через contextvar и закрывается, когда кадр ушел всем локальным
+получателям. Доля REALTIME_TRACE_SAMPLE_RATE трейсов сохраняется целиком:
+последние REALTIME_TRACE_BUFFER доступны в /utils/realtime-metrics/, а при
+заданном REALTIME_TRACE_FILE дописываются туда строками JSON.
+"""
+
+import json
+import logging
+import random
+import time
+from bisect import bisect_left
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин гистограммы, мс
+BUCKETS_MS = (
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    25,
+    50,
+    100,
+    250,
+    500,
+    1000,
+    2500,
+    5000,
+    float("inf"),
+)
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum_ms", "max_ms")
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(BUCKETS_MS)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, seconds: float) -> None:
+        ms = seconds * 1000
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.sum_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля сверху - граница корзины"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.counts, strict=True):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.sum_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": round(self.max_ms, 3),
+            "buckets": {
+                str(bound): count
+                for bound, count in zip(BUCKETS_MS, self.counts, strict=True)
+                if count
+            },
+        }
+
+
+class Trace:
+    """Прохождение одного сообщения по конвейеру"""
+
+    __slots__ = (
+        "kind",
+        "started",
+        "started_at",
+        "stages",
+        "pending",
+        "discarded",
+        "sampled",
+    )
+
+    def __init__(self, kind: str, started: float | None = None):
+        self.kind = kind
+        self.started = started if started is not None else time.perf_counter()
+        self.started_at = time.time()
+        self.stages: list[tuple[str, float]] = []
+        # Получатели на этом воркере, которым кадр еще не отправлен
+        self.pending = 0
+        # Получатели, которым кадр так и не ушел: вытеснен или соединение закрыто
+        self.discarded = 0
+        self.sampled = random.random() < settings.REALTIME_TRACE_SAMPLE_RATE
+
+
+class RealtimeMetrics:
+    def __init__(self) -> None:
+        self.histograms: dict[str, Histogram] = {}
+        self.traces: deque[dict[str, Any]] = deque(
+            maxlen=settings.REALTIME_TRACE_BUFFER
+        )
+
+    def observe(self, stage: str, seconds: float, trace: "Trace | None" = None) -> None:
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.observe(seconds)
+        if trace is not None and trace.sampled:
+            trace.stages.append((stage, seconds))
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """Замерить этап и записать его в текущий трейс"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started, current_trace.get())
+
+    def delivered(self, trace: Trace, now: float) -> None:
+        """Кадр отправлен одному получателю; после последнего трейс закрывается"""
+        trace.pending -= 1
+        if trace.pending == 0:
+            self.finish(trace, now)
+
+    def discarded(self, trace: Trace) -> None:
+        """Кадр не будет отправлен получателю - трейс все равно должен закрыться"""
+        trace.discarded += 1
+        self.delivered(trace, time.perf_counter())
+
+    def finish(self, trace: Trace, now: float | None = None) -> None:
+        now = now if now is not None else time.perf_counter()
+        self.observe("end_to_end", now - trace.started, trace)
+        if not trace.sampled:
+            return
+        record = {
+            "kind": trace.kind,
+            "started_at": trace.started_at,
+            "stages_ms": [
+                [stage, round(seconds * 1000, 3)] for stage, seconds in trace.stages
+            ],
+            "discarded": trace.discarded,
+        }
+        self.traces.append(record)
+        if settings.REALTIME_TRACE_FILE:
+            try:
+                with open(settings.REALTIME_TRACE_FILE, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+            except OSError as e:
+                logger.error(f"Error writing trace: {e}")
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "stages": {
+                stage: histogram.snapshot()
+                for stage, histogram in sorted(self.histograms.items())
+            },
+            "traces": list(self.traces),
+        }
+
+    def reset(self) -> None:
+        self.histograms.clear()
+        self.traces.clear()
+
+
+# Трейс сообщения, которое обрабатывается в текущей задаче
+current_trace: ContextVar[Trace | None] = ContextVar("current_trace", default=None)
+
+metrics = RealtimeMetrics()
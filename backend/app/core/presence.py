@@ -0,0 +1,234 @@
+"""Присутствие пользователей: кто онлайн и когда был в последний раз.
+
+Каждый воркер знает только свои соединения, поэтому изменения публикуются
+в канал presence шины: раз в тик - дельта (кто появился и ушел на этом
+воркере), раз в PRESENCE_SYNC_INTERVAL - полный список, который служит и
+heartbeat воркера. Из этих данных каждый воркер собирает общую картину.
+
+Рассылкой клиентам и записью last_seen_at занимается один воркер - с
+наименьшим node_id среди живых. Раз в тик он сравнивает общую картину с
+предыдущей и отправляет в каждый затронутый чат один кадр presence со
+всеми изменениями, а время последнего визита копит в памяти и пишет в
+базу одной транзакцией.
+
+Общую картину видит каждый воркер, поэтому время последнего визита
+отмечает у себя каждый и отдает его в ответах, пока лидер не запишет его в
+базу.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timezone
+
+from sqlmodel import Session
+
+from app import crud
+from app.core.config import settings
+from app.core.db import engine, run_db
+from app.core.realtime import ConnectionManager, manager
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_CHANNEL = "presence"
+
+
+def _get_chats_of_users(user_ids: list[int]) -> dict[int, list[int]]:
+    with Session(engine) as session:
+        return crud.get_chats_of_users(session=session, user_ids=user_ids)
+
+
+def _update_last_seen(last_seen: dict[int, datetime]) -> None:
+    with Session(engine) as session:
+        crud.update_last_seen(session=session, last_seen=last_seen)
+
+
+class PresenceService:
+    def __init__(self, manager: ConnectionManager):
+        self.manager = manager
+        self.node_id = manager.bus.node_id
+        # Изменения на этом воркере с прошлого тика
+        self._up: set[int] = set()
+        self._down: set[int] = set()
+        # Другие воркеры: node_id -> (онлайн-пользователи, когда слышали)
+        self._nodes: dict[str, tuple[set[int], float]] = {}
+        # Общая картина на прошлом тике
+        self._online: set[int] = set()
+        # Буфер записи last_seen_at (только у лидера)
+        self._last_seen: dict[int, datetime] = {}
+        # Смены статуса, замеченные этим воркером: user_id -> (время, когда
+        # заметили); порядок вставки совпадает с порядком, в котором заметили
+        self._seen: dict[int, tuple[datetime, float]] = {}
+        self._task: asyncio.Task[None] | None = None
+
+        manager.on_user_online.append(self._user_online)
+        manager.on_user_offline.append(self._user_offline)
+        manager.channel_handlers[PRESENCE_CHANNEL] = self._on_presence_event
+
+    def _user_online(self, user_id: int) -> None:
+        self._down.discard(user_id)
+        self._up.add(user_id)
+
+    def _user_offline(self, user_id: int) -> None:
+        self._up.discard(user_id)
+        self._down.add(user_id)
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self.online_users()
+
+    def online_users(self, now: float | None = None) -> set[int]:
+        """Пользователи, у которых есть соединение на любом живом воркере"""
+        now = now if now is not None else time.monotonic()
+        ttl = settings.PRESENCE_SYNC_INTERVAL * 3
+        online = set(self.manager.user_connections)
+        for users, heard_at in self._nodes.values():
+            if now - heard_at < ttl:
+                online |= users
+        return online
+
+    def last_seen(self, user_id: int) -> datetime | None:
+        """Еще не записанное в базу время последнего визита"""
+        buffered = self._last_seen.get(user_id)
+        seen = self._seen.get(user_id)
+        if seen is None:
+            return buffered
+        if buffered is None:
+            return seen[0]
+        return max(buffered, seen[0])
+
+    def is_leader(self, now: float | None = None) -> bool:
+        now = now if now is not None else time.monotonic()
+        ttl = settings.PRESENCE_SYNC_INTERVAL * 3
+        live = [
+            node for node, (_, heard_at) in self._nodes.items() if now - heard_at < ttl
+        ]
+        return self.node_id <= min(live, default=self.node_id)
+
+    async def _on_presence_event(self, _key: str, data: str) -> None:
+        event = json.loads(data)
+        node = event["node"]
+        if node == self.node_id:
+            return
+        users, _ = self._nodes.get(node, (set(), 0.0))
+        if "online" in event:
+            users = set(event["online"])
+        else:
+            users = (users | set(event["up"])) - set(event["down"])
+        self._nodes[node] = (users, time.monotonic())
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # При остановке пользователи этого воркера уходят в офлайн
+        now = datetime.now(timezone.utc)
+        for user_id in self.manager.user_connections:
+            self._last_seen[user_id] = now
+        await self.flush()
+
+    async def _loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_sync = loop.time()
+        next_flush = loop.time() + settings.PRESENCE_FLUSH_INTERVAL
+        while True:
+            await asyncio.sleep(settings.PRESENCE_TICK)
+            try:
+                full_sync = loop.time() >= next_sync
+                if full_sync:
+                    next_sync = loop.time() + settings.PRESENCE_SYNC_INTERVAL
+                await self.tick(full_sync=full_sync)
+                if loop.time() >= next_flush:
+                    next_flush = loop.time() + settings.PRESENCE_FLUSH_INTERVAL
+                    await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Presence tick failed: {e}")
+
+    async def tick(self, full_sync: bool = False) -> None:
+        """Опубликовать изменения воркера и разослать общие изменения по чатам"""
+        if full_sync:
+            await self.manager.publish(
+                PRESENCE_CHANNEL,
+                {"node": self.node_id, "online": sorted(self.manager.user_connections)},
+            )
+        elif self._up or self._down:
+            await self.manager.publish(
+                PRESENCE_CHANNEL,
+                {
+                    "node": self.node_id,
+                    "up": sorted(self._up),
+                    "down": sorted(self._down),
+                },
+            )
+        self._up.clear()
+        self._down.clear()
+
+        online = self.online_users()
+        came_online = online - self._online
+        went_offline = self._online - online
+        self._online = online
+
+        now = datetime.now(timezone.utc)
+        seen_at = time.monotonic()
+        for user_id in came_online | went_offline:
+            # Переставляем в конец, чтобы истекать по порядку
+            self._seen.pop(user_id, None)
+            self._seen[user_id] = (now, seen_at)
+        # Лидер пишет время в базу не позже чем через PRESENCE_FLUSH_INTERVAL
+        expired = seen_at - 2 * settings.PRESENCE_FLUSH_INTERVAL
+        while self._seen:
+            user_id, (_, first_seen_at) = next(iter(self._seen.items()))
+            if first_seen_at > expired:
+                break
+            del self._seen[user_id]
+        if not self.is_leader() or not (came_online or went_offline):
+            return
+
+        for user_id in came_online | went_offline:
+            self._last_seen[user_id] = now
+
+        changed = sorted(came_online | went_offline)
+        chats = await run_db(_get_chats_of_users, changed)
+        last_seen_at = now.isoformat()
+        for chat_id, user_ids in chats.items():
+            await self.manager.broadcast_to_chat(
+                {
+                    "type": "presence",
+                    "chat_id": chat_id,
+                    "users": [
+                        {
+                            "user_id": user_id,
+                            "online": user_id in came_online,
+                            "last_seen_at": last_seen_at,
+                        }
+                        for user_id in sorted(user_ids)
+                    ],
+                },
+                chat_id,
+            )
+
+    async def flush(self) -> None:
+        """Записать накопленные last_seen_at одной транзакцией"""
+        if not self._last_seen:
+            return
+        pending, self._last_seen = self._last_seen, {}
+        try:
+            await run_db(_update_last_seen, pending)
+        except Exception:
+            # Вернем в буфер, не затирая более свежие значения
+            for user_id, ts in pending.items():
+                self._last_seen.setdefault(user_id, ts)
+            raise
+
+
+presence = PresenceService(manager)
@@ -0,0 +1,97 @@
+"""Формат кадров WebSocket.
+
+По умолчанию кадры - JSON текст. Клиент может договориться о бинарном
+режиме MessagePack: подпротоколом "msgpack" в Sec-WebSocket-Protocol или
+параметром ?protocol=msgpack. Схема событий в обоих режимах одинаковая.
+
+Входящие кадры разбираются по типу кадра (текстовый - JSON, бинарный -
+MessagePack) и проверяются моделями ниже.
+"""
+
+import json
+from typing import Annotated, Any, Literal
+
+import msgpack
+from fastapi import WebSocket
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+
+JSON_PROTOCOL = "json"
+MSGPACK_PROTOCOL = "msgpack"
+
+
+class InvalidFrame(ValueError):
+    pass
+
+
+class PingFrame(BaseModel):
+    type: Literal["ping"]
+
+
+class PongFrame(BaseModel):
+    type: Literal["pong"]
+
+
+class SubscribeFrame(BaseModel):
+    type: Literal["subscribe"]
+    chat_id: int
+    last_id: int | None = None
+
+
+class UnsubscribeFrame(BaseModel):
+    type: Literal["unsubscribe"]
+    chat_id: int
+
+
+class MessageFrame(BaseModel):
+    type: Literal["message"]
+    chat_id: int | None = None
+    content: str = Field(min_length=1, max_length=4096)
+
+
+class TypingFrame(BaseModel):
+    type: Literal["typing"]
+    chat_id: int | None = None
+
+
+ClientFrame = Annotated[
+    PingFrame
+    | PongFrame
+    | SubscribeFrame
+    | UnsubscribeFrame
+    | MessageFrame
+    | TypingFrame,
+    Field(discriminator="type"),
+]
+
+_client_frame_adapter: TypeAdapter[ClientFrame] = TypeAdapter(ClientFrame)
+
+
+def negotiate_protocol(websocket: WebSocket) -> tuple[str, str | None]:
+    """Выбрать формат кадров; второй элемент - подпротокол для accept"""
+    if MSGPACK_PROTOCOL in websocket.scope.get("subprotocols", []):
+        return MSGPACK_PROTOCOL, MSGPACK_PROTOCOL
+    if websocket.query_params.get("protocol") == MSGPACK_PROTOCOL:
+        return MSGPACK_PROTOCOL, None
+    return JSON_PROTOCOL, None
+
+
+def pack(event: Any) -> bytes:
+    return msgpack.packb(event, use_bin_type=True)
+
+
+def decode_client_frame(message: dict[str, Any]) -> ClientFrame:
+    """Разобрать и проверить входящий кадр из websocket.receive()"""
+    try:
+        if message.get("bytes") is not None:
+            payload = msgpack.unpackb(message["bytes"], raw=False)
+        else:
+            payload = json.loads(message.get("text") or "")
+        return _client_frame_adapter.validate_python(payload)
+    except ValidationError as e:
+        errors = ", ".join(
+            f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}"
+            for error in e.errors()
+        )
+        raise InvalidFrame(f"Invalid frame: {errors}") from e
+    except (ValueError, msgpack.UnpackException) as e:
+        raise InvalidFrame("Invalid frame: malformed payload") from e
@@ -0,0 +1,167 @@
+"""Шина pub/sub для realtime-событий.
+
+Каждый воркер публикует событие один раз, а доставляет его только своим
+WebSocket соединениям. Брокер отвечает за то, чтобы событие увидели все
+воркеры, включая тот, который его опубликовал.
+"""
+
+import asyncio
+import logging
+import uuid
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import Engine, delete, func
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.core.db import run_db
+from app.core.metrics import metrics
+from app.models import RealtimeEvent
+
+logger = logging.getLogger(__name__)
+
+# Обработчик события: (канал, уже сериализованное событие)
+Handler = Callable[[str, str], Awaitable[None]]
+
+
+class PubSubBackend:
+    """Базовый брокер. Локальная доставка происходит сразу при публикации."""
+
+    def __init__(self) -> None:
+        self.node_id = uuid.uuid4().hex
+        self._handler: Handler | None = None
+
+    def set_handler(self, handler: Handler) -> None:
+        self._handler = handler
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def publish(self, channel: str, data: str) -> None:
+        await self._deliver(channel, data)
+
+    async def _deliver(self, channel: str, data: str) -> None:
+        if self._handler is None:
+            return
+        try:
+            await self._handler(channel, data)
+        except Exception as e:
+            logger.error(f"Error delivering event to {channel}: {e}")
+
+
+class MemoryBackend(PubSubBackend):
+    """Брокер в памяти процесса - достаточно для одного воркера и тестов"""
+
+
+class SQLiteBackend(PubSubBackend):
+    """Брокер поверх общей SQLite базы.
+
+    Событие записывается в таблицу realtimeevent, остальные воркеры опрашивают
+    её по возрастанию id. Собственные события воркер доставляет сразу и при
+    опросе пропускает.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        poll_interval: float = 0.05,
+        ttl_seconds: int = 300,
+    ) -> None:
+        super().__init__()
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self.ttl_seconds = ttl_seconds
+        self._last_id = 0
+        self._task: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        # Историю не доставляем - начинаем с последнего события
+        self._last_id = await run_db(self._get_last_id)
+        self._task = asyncio.create_task(self._poll_loop())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def publish(self, channel: str, data: str) -> None:
+        with metrics.stage("bus_write"):
+            await run_db(self._insert, channel, data)
+        await self._deliver(channel, data)
+
+    def _get_last_id(self) -> int:
+        with Session(self.engine) as session:
+            return session.exec(select(func.max(RealtimeEvent.id))).one() or 0
+
+    def _insert(self, channel: str, payload: str) -> None:
+        with Session(self.engine) as session:
+            session.add(
+                RealtimeEvent(channel=channel, node_id=self.node_id, payload=payload)
+            )
+            session.commit()
+
+    def _fetch(self, after_id: int, limit: int = 500) -> list[RealtimeEvent]:
+        with Session(self.engine) as session:
+            statement = (
+                select(RealtimeEvent)
+                .where(RealtimeEvent.id > after_id)
+                .order_by(RealtimeEvent.id)
+                .limit(limit)
+            )
+            return list(session.exec(statement).all())
+
+    def _prune(self) -> None:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+        with Session(self.engine) as session:
+            session.execute(
+                delete(RealtimeEvent).where(RealtimeEvent.created_at < cutoff)
+            )
+            session.commit()
+
+    async def poll_once(self) -> int:
+        """Забрать новые события из базы и доставить чужие локально"""
+        events = await run_db(self._fetch, self._last_id)
+        for row in events:
+            self._last_id = row.id
+            if row.node_id == self.node_id:
+                continue
+            await self._deliver(row.channel, row.payload)
+        return len(events)
+
+    async def _poll_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_prune = loop.time() + self.ttl_seconds
+        while True:
+            try:
+                if not await self.poll_once():
+                    await asyncio.sleep(self.poll_interval)
+                if loop.time() >= next_prune:
+                    next_prune = loop.time() + self.ttl_seconds
+                    await run_db(self._prune)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Realtime broker poll failed: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+
+def create_backend(engine: Engine) -> PubSubBackend:
+    """Создать брокер согласно настройкам"""
+    if settings.REALTIME_BROKER == "sqlite":
+        return SQLiteBackend(
+            engine,
+            poll_interval=settings.REALTIME_POLL_INTERVAL,
+            ttl_seconds=settings.REALTIME_EVENT_TTL_SECONDS,
+        )
+    return MemoryBackend()
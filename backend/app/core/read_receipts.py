@@ -0,0 +1,219 @@
+"""Отметки о прочтении чатов с отложенной записью.
+
+Клиенты отмечают чат прочитанным при каждой прокрутке, поэтому
+POST /chats/{chat_id}/read не пишет в базу сразу. Позиция прочтения
+участника копится в памяти (только максимум), раз в
+READ_RECEIPT_FLUSH_INTERVAL и при остановке все накопленное пишется одной
+транзакцией. Раз в READ_RECEIPT_TICK в каждый затронутый чат уходит один
+кадр read_receipts со всеми новыми отметками, а самому читателю - chat_updated
+с нулевым счетчиком непрочитанных.
+
+Кадр read_receipts идет по шине через канал reads, и каждый воркер запоминает
+услышанные отметки, пока их не запишет воркер-источник. Поэтому отметка,
+сделанная на одном воркере, видна в ответах других не позже чем через
+READ_RECEIPT_TICK, а не только после записи в базу.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timezone
+
+from sqlmodel import Session
+
+from app import crud
+from app.core.config import settings
+from app.core.db import engine, run_db
+from app.core.realtime import ConnectionManager, Frame, manager
+
+logger = logging.getLogger(__name__)
+
+READ_CHANNEL = "reads"
+
+
+def _update_last_read(last_read: dict[tuple[int, int], datetime]) -> None:
+    with Session(engine) as session:
+        crud.update_last_read(session=session, last_read=last_read)
+
+
+class ReadReceiptBuffer:
+    def __init__(self, manager: ConnectionManager):
+        self.manager = manager
+        # Еще не записанные позиции: (chat_id, user_id) -> время
+        self._pending: dict[tuple[int, int], datetime] = {}
+        # Еще не разосланные отметки: chat_id -> {user_id: время}
+        self._unsent: dict[int, dict[int, datetime]] = {}
+        # Отметки, услышанные по шине: (chat_id, user_id) -> (время, когда слышали);
+        # порядок вставки совпадает с порядком, в котором их слышали
+        self._heard: dict[tuple[int, int], tuple[datetime, float]] = {}
+        # Итоговые позиции (максимум из своих и услышанных) для быстрых выборок:
+        # chat_id -> {user_id: время} и user_id -> {chat_id: время}
+        self._by_chat: dict[int, dict[int, datetime]] = {}
+        self._by_user: dict[int, dict[int, datetime]] = {}
+        self._task: asyncio.Task[None] | None = None
+        self.marked_total = 0
+        self.flushes_total = 0
+        manager.channel_handlers[READ_CHANNEL] = self._on_read_event
+
+    def mark(
+        self, chat_id: int, user_id: int, read_at: datetime | None = None
+    ) -> datetime:
+        """Запомнить, что участник прочитал чат; возвращает итоговую позицию"""
+        read_at = read_at or datetime.now(timezone.utc)
+        key = (chat_id, user_id)
+        current = self._pending.get(key)
+        if current is not None and current >= read_at:
+            return current
+        self._pending[key] = read_at
+        self._unsent.setdefault(chat_id, {})[user_id] = read_at
+        self._reindex(key)
+        self.marked_total += 1
+        return read_at
+
+    def last_read(self, chat_id: int, user_id: int) -> datetime | None:
+        """Еще не записанная в базу позиция прочтения"""
+        return self._by_chat.get(chat_id, {}).get(user_id)
+
+    def pending_for_chat(self, chat_id: int) -> dict[int, datetime]:
+        """Еще не записанные позиции прочтения участников чата"""
+        return dict(self._by_chat.get(chat_id, {}))
+
+    def pending_for_user(self, user_id: int) -> dict[int, datetime]:
+        """Еще не записанные позиции прочтения пользователя: chat_id -> время"""
+        return dict(self._by_user.get(user_id, {}))
+
+    def _reindex(self, key: tuple[int, int]) -> None:
+        """Пересчитать позицию в индексах после изменения своих или услышанных"""
+        chat_id, user_id = key
+        heard = self._heard.get(key)
+        ts = _latest(self._pending.get(key), heard[0] if heard else None)
+        if ts is not None:
+            self._by_chat.setdefault(chat_id, {})[user_id] = ts
+            self._by_user.setdefault(user_id, {})[chat_id] = ts
+            return
+        for index, outer, inner in (
+            (self._by_chat, chat_id, user_id),
+            (self._by_user, user_id, chat_id),
+        ):
+            positions = index.get(outer)
+            if positions is not None:
+                positions.pop(inner, None)
+                if not positions:
+                    del index[outer]
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.tick()
+        await self.flush()
+
+    async def _loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_flush = loop.time() + settings.READ_RECEIPT_FLUSH_INTERVAL
+        while True:
+            await asyncio.sleep(settings.READ_RECEIPT_TICK)
+            try:
+                await self.tick()
+                if loop.time() >= next_flush:
+                    next_flush = loop.time() + settings.READ_RECEIPT_FLUSH_INTERVAL
+                    await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Read receipts tick failed: {e}")
+
+    async def tick(self) -> None:
+        """Разослать накопленные отметки - один кадр на чат"""
+        # Воркер-источник пишет отметку в базу не позже чем через
+        # READ_RECEIPT_FLUSH_INTERVAL; дальше она читается уже из базы
+        expired = time.monotonic() - 2 * settings.READ_RECEIPT_FLUSH_INTERVAL
+        while self._heard:
+            key, (_, heard_at) = next(iter(self._heard.items()))
+            if heard_at > expired:
+                break
+            del self._heard[key]
+            self._reindex(key)
+        unsent, self._unsent = self._unsent, {}
+        for chat_id, users in unsent.items():
+            await self.manager.publish(
+                f"{READ_CHANNEL}:{chat_id}",
+                {
+                    "type": "read_receipts",
+                    "chat_id": chat_id,
+                    "users": [
+                        {"user_id": user_id, "last_read_at": ts.isoformat()}
+                        for user_id, ts in sorted(users.items())
+                    ],
+                },
+            )
+
+    async def _on_read_event(self, key: str, data: str) -> None:
+        """Запомнить отметки с шины и разослать их соединениям этого воркера"""
+        chat_id = int(key)
+        heard_at = time.monotonic()
+        users = json.loads(data)["users"]
+        for user in users:
+            read_key = (chat_id, user["user_id"])
+            ts = datetime.fromisoformat(user["last_read_at"])
+            current = self._heard.get(read_key)
+            if current is not None and current[0] >= ts:
+                continue
+            # Переставляем в конец, чтобы истекать по порядку
+            self._heard.pop(read_key, None)
+            self._heard[read_key] = (ts, heard_at)
+            self._reindex(read_key)
+        frame = Frame(data, chat_id)
+        for connection in list(self.manager.active_connections.get(chat_id, ())):
+            connection.enqueue(frame)
+        # Остальные устройства читателя снимают счетчик в списке чатов
+        updated = Frame.from_event(
+            {"type": "chat_updated", "chat_id": chat_id, "unread_count": 0}
+        )
+        for user in users:
+            for connection in list(
+                self.manager.user_connections.get(user["user_id"], ())
+            ):
+                connection.enqueue(updated)
+
+    async def flush(self) -> None:
+        """Записать накопленные позиции прочтения одной транзакцией"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            await run_db(_update_last_read, pending)
+        except Exception:
+            # Вернем в буфер, не затирая более свежие значения
+            for key, ts in pending.items():
+                current = self._pending.get(key)
+                if current is None or current < ts:
+                    self._pending[key] = ts
+            raise
+        # Свои же отметки, вернувшиеся по шине, теперь читаются из базы
+        for key, ts in pending.items():
+            heard = self._heard.get(key)
+            if heard is not None and heard[0] <= ts:
+                del self._heard[key]
+            self._reindex(key)
+        self.flushes_total += 1
+
+
+def _latest(a: datetime | None, b: datetime | None) -> datetime | None:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+read_receipts = ReadReceiptBuffer(manager)
@@ -0,0 +1,608 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from collections.abc import Awaitable, Callable, Iterable
+from datetime import date, datetime
+from typing import Any
+
+from fastapi import WebSocket
+from pydantic import BaseModel
+
+from app.core.config import settings
+from app.core.db import engine
+from app.core.metrics import Trace, current_trace, metrics
+from app.core.protocol import JSON_PROTOCOL, MSGPACK_PROTOCOL, pack
+from app.core.pubsub import PubSubBackend, create_backend
+
+logger = logging.getLogger(__name__)
+
+# Код закрытия для клиента, который не успевает читать события
+SLOW_CONSUMER_CLOSE_CODE = 1013
+# Код отказа в соединении перегруженным воркером
+TRY_AGAIN_LATER_CLOSE_CODE = 1013
+# Код закрытия при нарушении лимитов клиентом
+POLICY_VIOLATION_CLOSE_CODE = 1008
+# Код закрытия для соединения, не подававшего признаков жизни
+IDLE_TIMEOUT_CLOSE_CODE = 1001
+# Код закрытия при необработанной ошибке на сервере
+INTERNAL_ERROR_CLOSE_CODE = 1011
+# Код закрытия при перезапуске сервера; в reason - задержка переподключения
+SERVICE_RESTART_CLOSE_CODE = 1012
+
+# Как часто пересчитывать суммарную глубину очередей для допуска, секунды
+LOAD_SAMPLE_INTERVAL = 0.5
+
+# Заранее сериализованный служебный кадр
+PING_FRAME_DATA = '{"type":"ping"}'
+
+
+def chat_channel(chat_id: int) -> str:
+    return f"chat:{chat_id}"
+
+
+def user_channel(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime | date):
+        return value.isoformat()
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_event(event: dict[str, Any]) -> str:
+    """Сериализовать событие в JSON.
+
+    Pydantic модели верхнего уровня сериализуются напрямую через
+    model_dump_json, без промежуточного словаря.
+    """
+    parts = []
+    for key, value in event.items():
+        if isinstance(value, BaseModel):
+            encoded = value.model_dump_json()
+        else:
+            encoded = json.dumps(value, separators=(",", ":"), default=_json_default)
+        parts.append(f"{json.dumps(key)}:{encoded}")
+    return "{" + ",".join(parts) + "}"
+
+
+class Frame:
+    """Готовое к отправке событие.
+
+    Кодируется один раз и один и тот же объект кладется в очереди всех
+    получателей. MessagePack представление строится лениво, при первой
+    отправке бинарному клиенту, и тоже одно на всех.
+    """
+
+    __slots__ = (
+        "data",
+        "chat_id",
+        "_message_id",
+        "_message_id_parsed",
+        "_event",
+        "_binary",
+        "trace",
+        "fanout_at",
+    )
+
+    def __init__(self, data: str, chat_id: int | None = None):
+        self.data = data
+        self.chat_id = chat_id
+        # Трейс сообщения и момент раскладки по очередям - для метрик задержки
+        self.trace: Trace | None = None
+        self.fanout_at: float | None = None
+        self._message_id: int | None = None
+        self._message_id_parsed = False
+        self._event: dict[str, Any] | None = None
+        self._binary: bytes | None = None
+
+    @classmethod
+    def from_event(cls, event: dict[str, Any], chat_id: int | None = None) -> "Frame":
+        return cls(encode_event(event), chat_id)
+
+    @property
+    def event(self) -> dict[str, Any]:
+        if self._event is None:
+            self._event = json.loads(self.data)
+        return self._event
+
+    @property
+    def binary(self) -> bytes:
+        """Событие в MessagePack для клиентов бинарного протокола"""
+        if self._binary is None:
+            self._binary = pack(self.event)
+        return self._binary
+
+    @property
+    def message_id(self) -> int | None:
+        """id сообщения для new_message; разбирается лениво и только при реплее"""
+        if not self._message_id_parsed:
+            event = self.event
+            message = (
+                event.get("message") if event.get("type") == "new_message" else None
+            )
+            self._message_id = message.get("id") if isinstance(message, dict) else None
+            self._message_id_parsed = True
+        return self._message_id
+
+
+class Connection:
+    """WebSocket соединение с собственной ограниченной очередью отправки.
+
+    Рассылка только кладет событие в очередь, отправкой занимается отдельная
+    задача-писатель, поэтому медленный клиент не задерживает остальных.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        on_close: Callable[["Connection"], None],
+        queue_size: int = 256,
+        policy: str = "drop_oldest",
+        protocol: str = JSON_PROTOCOL,
+        all_chats: bool = False,
+    ):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.protocol = protocol
+        # Соединение /ws: подписывается и на чаты, в которые пользователя добавят
+        self.all_chats = all_chats
+        self.chat_ids: set[int] = set()
+        self.policy = policy
+        self.queue: asyncio.Queue[Frame] = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.closed = False
+        # Время последнего входящего кадра (time.monotonic)
+        self.last_activity = time.monotonic()
+        # Token bucket входящих кадров и число отброшенных подряд
+        self._tokens = float(settings.REALTIME_FRAME_BURST)
+        self._tokens_at = self.last_activity
+        self.rate_limited = 0
+        self._on_close = on_close
+        self._writer: asyncio.Task[None] | None = None
+        # chat_id -> живые события, отложенные на время реплея пропущенных
+        self._held: dict[int, list[Frame]] = {}
+
+    def start(self) -> None:
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def touch(self) -> None:
+        """Отметить активность клиента (любой входящий кадр, в том числе pong)"""
+        self.last_activity = time.monotonic()
+
+    def allow_frame(self, now: float | None = None) -> bool:
+        """Списать входящий кадр из лимита частоты; False - кадр надо отбросить"""
+        now = now if now is not None else time.monotonic()
+        self._tokens = min(
+            float(settings.REALTIME_FRAME_BURST),
+            self._tokens + (now - self._tokens_at) * settings.REALTIME_FRAME_RATE,
+        )
+        self._tokens_at = now
+        if self._tokens < 1:
+            self.rate_limited += 1
+            return False
+        self._tokens -= 1
+        self.rate_limited = 0
+        return True
+
+    def idle_for(self, now: float | None = None) -> float:
+        return (now if now is not None else time.monotonic()) - self.last_activity
+
+    def enqueue(self, frame: Frame) -> bool:
+        """Поставить событие в очередь без ожидания"""
+        if self.closed:
+            self._discard(frame)
+            return False
+        if frame.chat_id in self._held:
+            self._held[frame.chat_id].append(frame)
+            return True
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.policy == "drop_oldest":
+            self._discard(self.queue.get_nowait())
+            self.queue.put_nowait(frame)
+            self.dropped += 1
+            return True
+
+        logger.warning(f"Closing slow consumer connection of user {self.user_id}")
+        self.close(SLOW_CONSUMER_CLOSE_CODE, "Slow consumer")
+        self._discard(frame)
+        return False
+
+    @staticmethod
+    def _discard(frame: Frame) -> None:
+        """Кадр не уйдет этому получателю - закрыть его долю в трейсе"""
+        if frame.trace is not None:
+            metrics.discarded(frame.trace)
+
+    def hold(self, chat_id: int) -> None:
+        """Откладывать живые события чата, пока не отправлен реплей"""
+        self._held.setdefault(chat_id, [])
+
+    def release(
+        self, chat_id: int, replay: list[Frame], last_id: int | None = None
+    ) -> None:
+        """Отправить реплей, затем отложенные события без уже показанных сообщений"""
+        pending = self._held.pop(chat_id, [])
+        for frame in replay:
+            self.enqueue(frame)
+        for frame in pending:
+            if last_id is not None:
+                message_id = frame.message_id
+                if message_id is not None and message_id <= last_id:
+                    self._discard(frame)
+                    continue
+            self.enqueue(frame)
+
+    def close(self, code: int = 1000, reason: str = "") -> None:
+        """Закрыть соединение и снять его с учета в менеджере"""
+        if self.closed:
+            return
+        self._on_close(self)
+        asyncio.create_task(self._close_socket(code, reason))
+
+    def stop(self) -> None:
+        """Остановить писателя, не трогая сам сокет"""
+        if self.closed:
+            return
+        self.closed = True
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        # Неотправленные кадры больше не ждут отправки
+        while not self.queue.empty():
+            self._discard(self.queue.get_nowait())
+        for held in self._held.values():
+            for frame in held:
+                self._discard(frame)
+        self._held.clear()
+
+    async def _close_socket(self, code: int, reason: str) -> None:
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            # Сокет уже закрыт клиентом
+            pass
+
+    async def send(self, frame: Frame) -> None:
+        """Отправить кадр клиенту; вызывается только задачей-писателем"""
+        if self.protocol == MSGPACK_PROTOCOL:
+            await self.websocket.send_bytes(frame.binary)
+        else:
+            await self.websocket.send_text(frame.data)
+
+    async def _write_loop(self) -> None:
+        # Кадр, который сейчас отправляется
+        frame: Frame | None = None
+        try:
+            while True:
+                frame = await self.queue.get()
+                send_started = time.perf_counter()
+                await self.send(frame)
+                if frame.fanout_at is not None:
+                    sent = time.perf_counter()
+                    metrics.observe(
+                        "queue_wait", send_started - frame.fanout_at, frame.trace
+                    )
+                    metrics.observe("send", sent - send_started, frame.trace)
+                    if frame.trace is not None:
+                        metrics.delivered(frame.trace, sent)
+                frame = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error sending message to connection: {e}")
+            self._on_close(self)
+        finally:
+            if frame is not None:
+                self._discard(frame)
+
+
+# Хранилище активных WebSocket соединений
+class ConnectionManager:
+    def __init__(self, bus: PubSubBackend):
+        # chat_id -> set of connections
+        self.active_connections: dict[int, set[Connection]] = {}
+        # user_id -> set of connections
+        self.user_connections: dict[int, set[Connection]] = {}
+        # Шина доставляет события всем воркерам, включая текущий
+        self.bus = bus
+        self.bus.set_handler(self._on_event)
+        # Подписчики на первое/последнее соединение пользователя на воркере
+        self.on_user_online: list[Callable[[int], None]] = []
+        self.on_user_offline: list[Callable[[int], None]] = []
+        # Обработчики служебных каналов шины: вид канала -> (ключ, данные)
+        self.channel_handlers: dict[str, Callable[[str, str], Awaitable[None]]] = {}
+        # Счетчик соединений, закрытых по таймауту бездействия
+        self.reaped_total = 0
+        self._reaper: asyncio.Task[None] | None = None
+        # Режим отключения: новые соединения не принимаются
+        self.draining = False
+        self.connection_count = 0
+        # Отказы в новых соединениях и закрытия за превышение частоты кадров
+        self.rejected_total = 0
+        self.rate_limited_total = 0
+        self._queued_frames = 0
+        self._load_sampled_at = 0.0
+        self._drain_task: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        await self.bus.start()
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reaper_loop())
+
+    async def stop(self) -> None:
+        if self._reaper is not None:
+            self._reaper.cancel()
+            try:
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+            self._reaper = None
+        if self._drain_task is not None and not self._drain_task.done():
+            self._drain_task.cancel()
+        await self.bus.stop()
+
+    def all_connections(self) -> list[Connection]:
+        return [conn for conns in self.user_connections.values() for conn in conns]
+
+    def reap(self, now: float | None = None) -> int:
+        """Пинговать молчащие соединения и закрывать те, что не ответили.
+
+        Соединение, молчащее дольше REALTIME_PING_INTERVAL, получает ping;
+        молчащее дольше REALTIME_IDLE_TIMEOUT считается мертвым
+        (полуоткрытый TCP, зависший клиент) и снимается с учета.
+        """
+        now = now if now is not None else time.monotonic()
+        reaped = 0
+        for connection in self.all_connections():
+            idle = connection.idle_for(now)
+            if idle >= settings.REALTIME_IDLE_TIMEOUT:
+                logger.info(f"Reaping idle connection of user {connection.user_id}")
+                connection.close(IDLE_TIMEOUT_CLOSE_CODE, "Idle timeout")
+                reaped += 1
+            elif idle >= settings.REALTIME_PING_INTERVAL:
+                connection.enqueue(Frame(PING_FRAME_DATA))
+        self.reaped_total += reaped
+        return reaped
+
+    async def _reaper_loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.REALTIME_PING_INTERVAL / 2)
+            try:
+                self.reap()
+            except Exception as e:
+                logger.error(f"Connection reaper failed: {e}")
+
+    @staticmethod
+    def reconnect_hint() -> str:
+        """reason кадра закрытия со случайной задержкой переподключения"""
+        delay_ms = random.randint(
+            1000, max(1000, int(settings.REALTIME_RECONNECT_JITTER * 1000))
+        )
+        return json.dumps({"retry_after_ms": delay_ms})
+
+    async def drain(self) -> None:
+        """Закрыть все соединения воркера волнами, чтобы клиенты не
+        переподключались одновременно.
+
+        Соединения перемешиваются и закрываются REALTIME_DRAIN_WAVES волнами
+        за REALTIME_DRAIN_SECONDS; каждый клиент получает код 1012 и свою
+        задержку переподключения.
+        """
+        self.draining = True
+        connections = self.all_connections()
+        random.shuffle(connections)
+        interval = settings.REALTIME_DRAIN_SECONDS / max(
+            1, settings.REALTIME_DRAIN_WAVES
+        )
+        # Пустые волны не ждем: соединений может быть меньше, чем волн
+        waves = min(max(1, settings.REALTIME_DRAIN_WAVES), len(connections))
+        logger.info(f"Draining {len(connections)} connections in {waves} waves")
+        for wave in range(waves):
+            for connection in connections[wave::waves]:
+                connection.close(SERVICE_RESTART_CLOSE_CODE, self.reconnect_hint())
+            if wave < waves - 1:
+                await asyncio.sleep(interval)
+
+    def start_drain(self) -> asyncio.Task[None]:
+        if self._drain_task is None:
+            self._drain_task = asyncio.create_task(self.drain())
+        return self._drain_task
+
+    def queued_frames(self, now: float | None = None) -> int:
+        """Суммарная глубина очередей отправки, пересчитывается не чаще
+        LOAD_SAMPLE_INTERVAL - при шторме подключений обход всех соединений
+        на каждое из них обошелся бы дорого."""
+        now = now if now is not None else time.monotonic()
+        if now - self._load_sampled_at >= LOAD_SAMPLE_INTERVAL:
+            self._queued_frames = sum(
+                conn.queue.qsize() for conn in self.all_connections()
+            )
+            self._load_sampled_at = now
+        return self._queued_frames
+
+    def check_admission(self, user_id: int | None = None) -> tuple[int, str] | None:
+        """Код и reason отказа в новом соединении или None, если его можно принять.
+
+        Без user_id проверяется только воркер - до аутентификации, которая
+        ходит в базу. Перегруженный воркер отвечает 1013 с задержкой
+        переподключения, чтобы балансировщик увел клиента на другой.
+        """
+        if self.draining:
+            return SERVICE_RESTART_CLOSE_CODE, self.reconnect_hint()
+        rejection = None
+        if self.connection_count >= settings.REALTIME_MAX_CONNECTIONS:
+            rejection = TRY_AGAIN_LATER_CLOSE_CODE, self.reconnect_hint()
+        elif self.queued_frames() >= settings.REALTIME_MAX_QUEUED_FRAMES:
+            rejection = TRY_AGAIN_LATER_CLOSE_CODE, self.reconnect_hint()
+        elif (
+            user_id is not None
+            and len(self.user_connections.get(user_id, ()))
+            >= settings.REALTIME_MAX_CONNECTIONS_PER_USER
+        ):
+            rejection = POLICY_VIOLATION_CLOSE_CODE, "Too many connections"
+        if rejection is not None:
+            self.rejected_total += 1
+        return rejection
+
+    def stats(self) -> dict[str, int]:
+        """Показатели соединений этого воркера"""
+        now = time.monotonic()
+        connections = self.all_connections()
+        stale = sum(
+            1
+            for conn in connections
+            if conn.idle_for(now) >= settings.REALTIME_PING_INTERVAL
+        )
+        return {
+            "connections": len(connections),
+            "live": len(connections) - stale,
+            "stale": stale,
+            "users": len(self.user_connections),
+            "chats": len(self.active_connections),
+            "queued_frames": sum(conn.queue.qsize() for conn in connections),
+            "dropped_frames": sum(conn.dropped for conn in connections),
+            "reaped_total": self.reaped_total,
+            "rejected_total": self.rejected_total,
+            "rate_limited_total": self.rate_limited_total,
+            "draining": int(self.draining),
+        }
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        chat_ids: Iterable[int] = (),
+        protocol: str = JSON_PROTOCOL,
+        subprotocol: str | None = None,
+        all_chats: bool = False,
+    ) -> Connection:
+        """Принять соединение пользователя и подписать его на чаты"""
+        await websocket.accept(subprotocol=subprotocol)
+
+        connection = Connection(
+            websocket,
+            user_id,
+            on_close=self.disconnect,
+            queue_size=settings.REALTIME_SEND_QUEUE_SIZE,
+            policy=settings.REALTIME_SLOW_CONSUMER_POLICY,
+            protocol=protocol,
+            all_chats=all_chats,
+        )
+        self.register(connection, chat_ids)
+        return connection
+
+    def register(self, connection: Connection, chat_ids: Iterable[int] = ()) -> None:
+        """Поставить соединение на учет, подписать на чаты и запустить писателя"""
+        user_id = connection.user_id
+        if user_id not in self.user_connections:
+            self.user_connections[user_id] = set()
+            for callback in self.on_user_online:
+                callback(user_id)
+        self.user_connections[user_id].add(connection)
+        self.connection_count += 1
+
+        for chat_id in chat_ids:
+            self.subscribe(connection, chat_id)
+
+        connection.start()
+
+    def subscribe(self, connection: Connection, chat_id: int) -> None:
+        if connection.closed:
+            return
+        connection.chat_ids.add(chat_id)
+        if chat_id not in self.active_connections:
+            self.active_connections[chat_id] = set()
+        self.active_connections[chat_id].add(connection)
+
+    def unsubscribe(self, connection: Connection, chat_id: int) -> None:
+        connection.chat_ids.discard(chat_id)
+        if chat_id in self.active_connections:
+            self.active_connections[chat_id].discard(connection)
+            if not self.active_connections[chat_id]:
+                del self.active_connections[chat_id]
+
+    def disconnect(self, connection: Connection) -> None:
+        connection.stop()
+
+        for chat_id in list(connection.chat_ids):
+            self.unsubscribe(connection, chat_id)
+
+        user_id = connection.user_id
+        if connection in self.user_connections.get(user_id, ()):
+            self.user_connections[user_id].discard(connection)
+            self.connection_count -= 1
+            if not self.user_connections[user_id]:
+                del self.user_connections[user_id]
+                for callback in self.on_user_offline:
+                    callback(user_id)
+
+    async def send_personal_message(
+        self, message: dict[str, Any], connection: Connection
+    ) -> None:
+        connection.enqueue(Frame.from_event(message))
+
+    async def broadcast_to_chat(self, message: dict[str, Any], chat_id: int) -> None:
+        """Опубликовать событие чата один раз - доставку выполнит каждый воркер.
+
+        Событие сериализуется здесь ровно один раз, дальше по шине и в очереди
+        соединений идет готовая строка.
+        """
+        with metrics.stage("serialize"):
+            data = encode_event(message)
+        await self.bus.publish(chat_channel(chat_id), data)
+
+    async def send_to_user(self, user_id: int, event: dict[str, Any]) -> None:
+        """Отправить событие во все соединения пользователя на всех воркерах"""
+        await self.bus.publish(user_channel(user_id), encode_event(event))
+
+    async def publish(self, channel: str, event: dict[str, Any]) -> None:
+        """Опубликовать служебное событие в произвольный канал шины"""
+        await self.bus.publish(channel, encode_event(event))
+
+    async def _on_event(self, channel: str, data: str) -> None:
+        kind, _, key = channel.partition(":")
+        if kind in self.channel_handlers:
+            await self.channel_handlers[kind](key, data)
+        elif kind == "chat":
+            chat_id = int(key)
+            self._send_to_local_chat(Frame(data, chat_id), chat_id)
+        elif kind == "user":
+            frame = Frame(data)
+            for connection in list(self.user_connections.get(int(key), ())):
+                connection.enqueue(frame)
+
+    def _send_to_local_chat(self, frame: Frame, chat_id: int) -> None:
+        """Разложить событие по очередям соединений чата на этом воркере"""
+        if chat_id not in self.active_connections:
+            logger.debug(f"No local connections for chat {chat_id}")
+            trace = current_trace.get()
+            if trace is not None and trace.pending == 0:
+                metrics.finish(trace)
+            return
+
+        # Копия множества: при переполнении очереди соединение может отключиться
+        connections = list(self.active_connections[chat_id])
+        logger.debug(
+            f"Broadcasting to {len(connections)} connections in chat {chat_id}"
+        )
+        trace = current_trace.get()
+        frame.fanout_at = time.perf_counter()
+        if trace is not None:
+            frame.trace = trace
+            trace.pending += len(connections)
+        for connection in connections:
+            connection.enqueue(frame)
+        metrics.observe("fanout", time.perf_counter() - frame.fanout_at, trace)
+
+
+manager = ConnectionManager(create_backend(engine))
@@ -0,0 +1,116 @@
+"""Общие части realtime-маршрутов /ws и /events.
+
+Аутентификация по токену из query параметра, разбор позиций last_ids и
+досылка сообщений, пропущенных клиентом за время разрыва.
+"""
+
+from sqlmodel import Session
+
+from app import crud
+from app.core.config import settings
+from app.core.db import engine, run_db
+from app.core.realtime import Connection, Frame
+from app.core.security import decode_access_token
+from app.models import ChatMessagePublic, User, UserPublic
+
+
+def _get_user(user_id: int) -> User | None:
+    with Session(engine) as session:
+        return session.get(User, user_id)
+
+
+def get_chat_ids(user_id: int) -> list[int]:
+    """Чаты пользователя - выполняется в пуле потоков БД"""
+    with Session(engine) as session:
+        return crud.get_user_chat_ids(session=session, user_id=user_id)
+
+
+def _get_missed_messages(
+    chat_id: int, after_id: int, limit: int
+) -> list[ChatMessagePublic]:
+    """Сообщения чата после after_id - выполняется в пуле потоков БД"""
+    with Session(engine) as session:
+        messages = crud.get_messages_after(
+            session=session, chat_id=chat_id, after_id=after_id, limit=limit
+        )
+        result = []
+        for message in messages:
+            sender = session.get(User, message.sender_id)
+            result.append(
+                ChatMessagePublic(
+                    id=message.id,
+                    chat_id=message.chat_id,
+                    sender_id=message.sender_id,
+                    sender=UserPublic.model_validate(sender) if sender else None,
+                    content=message.content,
+                    created_at=message.created_at,
+                    edited_at=message.edited_at,
+                )
+            )
+        return result
+
+
+def parse_last_ids(value: str | None) -> dict[int, int]:
+    """Разобрать параметр last_ids вида chat_id:message_id,chat_id:message_id"""
+    result: dict[int, int] = {}
+    if not value:
+        return result
+    for pair in value.split(","):
+        chat_id, _, message_id = pair.partition(":")
+        try:
+            result[int(chat_id)] = int(message_id)
+        except ValueError:
+            continue
+    return result
+
+
+async def get_user_from_token(token: str) -> User | None:
+    """Получить пользователя из токена WebSocket или потока событий"""
+    try:
+        payload = decode_access_token(token)
+        user_id: int = int(payload.get("sub"))
+        if user_id is None:
+            return None
+
+        return await run_db(_get_user, user_id)
+    except Exception:
+        return None
+
+
+async def replay_missed(connection: Connection, chat_id: int, last_id: int) -> None:
+    """Дослать сообщения чата, пропущенные с last_id, до живых событий.
+
+    Живые события чата откладываются, пока идет чтение из базы; после
+    реплея из них выбрасываются уже отправленные сообщения. Клиент получает
+    replay_done с последним id; truncated означает, что остаток нужно
+    догрузить через историю.
+    """
+    limit = settings.REALTIME_REPLAY_LIMIT
+    connection.hold(chat_id)
+    try:
+        messages = await run_db(_get_missed_messages, chat_id, last_id, limit + 1)
+    except Exception:
+        connection.release(chat_id, [])
+        raise
+
+    truncated = len(messages) > limit
+    messages = messages[:limit]
+    replayed_upto = messages[-1].id if messages else last_id
+
+    frames = [
+        Frame.from_event({"type": "new_message", "message": message}, chat_id)
+        for message in messages
+    ]
+    frames.append(
+        Frame.from_event(
+            {
+                "type": "replay_done",
+                "chat_id": chat_id,
+                "last_id": replayed_upto,
+                "truncated": truncated,
+            },
+            chat_id,
+        )
+    )
+    # Пока реплей неполный, не отбрасываем живые события - они новее разрыва
+    connection.release(chat_id, frames, last_id=None if truncated else replayed_upto)
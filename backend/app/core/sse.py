@@ -0,0 +1,86 @@
+"""Server-Sent Events поверх конвейера рассылки WebSocket.
+
+SSEConnection - такое же соединение менеджера, как WebSocket: те же
+подписки на чаты, очередь с политикой медленного клиента, реплей и
+heartbeat. Отличается только отправка: кадр превращается в событие SSE
+
+    id: 1:42,7:15
+    data: {"type": "new_message", ...}
+
+id есть у new_message и содержит последние доставленные id сообщений по
+чатам в формате last_ids. Браузер возвращает его в Last-Event-ID при
+переподключении, и поток досылает пропущенное. Ping менеджера уходит
+комментарием ": ping" и держит соединение живым через прокси.
+"""
+
+import asyncio
+import json
+from collections.abc import AsyncIterator, Callable
+from typing import Any
+
+from app.core.realtime import PING_FRAME_DATA, Connection, Frame
+
+
+def format_last_ids(last_ids: dict[int, int]) -> str:
+    return ",".join(
+        f"{chat_id}:{message_id}" for chat_id, message_id in sorted(last_ids.items())
+    )
+
+
+def retry_after_ms(reason: str) -> int | None:
+    """Задержка переподключения из reason кадра закрытия, если она там есть"""
+    if not reason.startswith("{"):
+        return None
+    try:
+        return int(json.loads(reason)["retry_after_ms"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class SSEConnection(Connection):
+    def __init__(
+        self,
+        user_id: int,
+        on_close: Callable[[Connection], None],
+        last_ids: dict[int, int] | None = None,
+        **kwargs: Any,
+    ):
+        super().__init__(None, user_id, on_close, **kwargs)  # type: ignore[arg-type]
+        self.last_ids = dict(last_ids or {})
+        # Один кусок потока в ожидании ответа: писатель ждет, пока клиент
+        # его прочитает, и отставание копится в очереди соединения
+        self._chunks: asyncio.Queue[str] = asyncio.Queue(maxsize=1)
+        self.ended = False
+
+    async def send(self, frame: Frame) -> None:
+        if frame.data == PING_FRAME_DATA:
+            await self._chunks.put(": ping\n\n")
+            # Клиент SSE не отвечает на ping - живым его считает прочитанный поток
+            self.touch()
+            return
+        chunk = f"data: {frame.data}\n\n"
+        if frame.chat_id is not None:
+            message_id = frame.message_id
+            if message_id is not None and message_id > self.last_ids.get(
+                frame.chat_id, 0
+            ):
+                self.last_ids[frame.chat_id] = message_id
+                chunk = f"id: {format_last_ids(self.last_ids)}\n{chunk}"
+        await self._chunks.put(chunk)
+
+    async def _close_socket(self, code: int, reason: str) -> None:  # noqa: ARG002
+        # Недочитанный кусок теряется - клиент досылает его по Last-Event-ID
+        while not self._chunks.empty():
+            self._chunks.get_nowait()
+        retry = retry_after_ms(reason)
+        self.ended = True
+        self._chunks.put_nowait(f"retry: {retry}\n\n" if retry is not None else "")
+
+    async def stream(self) -> AsyncIterator[str]:
+        """Тело ответа text/event-stream"""
+        while True:
+            chunk = await self._chunks.get()
+            if chunk:
+                yield chunk
+            if self.ended and self._chunks.empty():
+                return
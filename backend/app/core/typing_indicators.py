@@ -0,0 +1,151 @@
+"""Индикаторы печати с троттлингом и пакетной рассылкой.
+
+Клиент шлет typing на каждое нажатие клавиши, но в чат уходит только
+смена состояния: кто начал печатать и кто перестал. Повторные typing
+лишь продлевают состояние на TYPING_TIMEOUT; "перестал печатать"
+формируется сервером по истечении этого времени или при отправке
+сообщения. Раз в TYPING_TICK все изменения чата уходят одним кадром:
+
+    {"type": "typing", "chat_id": 1,
+     "started": [{"user_id": 2, "user_name": "..."}], "stopped": [3]}
+
+Печатающий пользователь не получает кадры о себе.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Any
+
+from app.core.config import settings
+from app.core.realtime import ConnectionManager, Frame, manager
+
+logger = logging.getLogger(__name__)
+
+TYPING_CHANNEL = "typing"
+
+
+class TypingIndicators:
+    def __init__(self, manager: ConnectionManager):
+        self.manager = manager
+        # chat_id -> {user_id: (когда истекает, имя)}
+        self._typing: dict[int, dict[int, tuple[float, str]]] = {}
+        # Начавшие печатать с прошлого тика: chat_id -> {user_id: имя}
+        self._started: dict[int, dict[int, str]] = {}
+        self._task: asyncio.Task[None] | None = None
+        # Кадры typing, поглощенные троттлингом
+        self.throttled_total = 0
+
+        manager.channel_handlers[TYPING_CHANNEL] = self._on_typing_event
+
+    def typing(
+        self, chat_id: int, user_id: int, user_name: str, now: float | None = None
+    ) -> bool:
+        """Отметить, что пользователь печатает; True, если это новое состояние"""
+        now = now if now is not None else time.monotonic()
+        users = self._typing.setdefault(chat_id, {})
+        was_typing = user_id in users
+        users[user_id] = (now + settings.TYPING_TIMEOUT, user_name)
+        if was_typing:
+            self.throttled_total += 1
+            return False
+        self._started.setdefault(chat_id, {})[user_id] = user_name
+        return True
+
+    def stopped_typing(self, chat_id: int, user_id: int) -> None:
+        """Пользователь перестал печатать (например, отправил сообщение)"""
+        users = self._typing.get(chat_id)
+        if users and user_id in users:
+            users[user_id] = (0.0, users[user_id][1])
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.TYPING_TICK)
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error(f"Typing tick failed: {e}")
+
+    async def tick(self, now: float | None = None) -> None:
+        """Разослать изменения состояния печати - один кадр на чат"""
+        now = now if now is not None else time.monotonic()
+        started, self._started = self._started, {}
+        stopped: dict[int, list[int]] = {}
+        for chat_id, users in list(self._typing.items()):
+            for user_id, (expires_at, _) in list(users.items()):
+                if expires_at > now:
+                    continue
+                del users[user_id]
+                # Начал и закончил за один тик - в чат ничего не уходит
+                if started.get(chat_id, {}).pop(user_id, None) is None:
+                    stopped.setdefault(chat_id, []).append(user_id)
+            if not users:
+                del self._typing[chat_id]
+
+        for chat_id in started.keys() | stopped.keys():
+            started_users = started.get(chat_id, {})
+            stopped_users = stopped.get(chat_id, [])
+            if not started_users and not stopped_users:
+                continue
+            await self.manager.publish(
+                f"{TYPING_CHANNEL}:{chat_id}",
+                {
+                    "type": "typing",
+                    "chat_id": chat_id,
+                    "started": [
+                        {"user_id": user_id, "user_name": name}
+                        for user_id, name in sorted(started_users.items())
+                    ],
+                    "stopped": sorted(stopped_users),
+                },
+            )
+
+    async def _on_typing_event(self, key: str, data: str) -> None:
+        """Доставить кадр typing в соединения чата на этом воркере без самих печатающих"""
+        chat_id = int(key)
+        connections = list(self.manager.active_connections.get(chat_id, ()))
+        if not connections:
+            return
+        event = json.loads(data)
+        typers = {user["user_id"] for user in event["started"]} | set(event["stopped"])
+        frame = Frame(data, chat_id)
+        # Кадр без самого получателя; строится один раз на печатающего
+        own_frames: dict[int, Frame | None] = {}
+        for connection in connections:
+            if connection.user_id not in typers:
+                connection.enqueue(frame)
+                continue
+            if connection.user_id not in own_frames:
+                own_frames[connection.user_id] = _without_user(
+                    event, connection.user_id
+                )
+            own_frame = own_frames[connection.user_id]
+            if own_frame is not None:
+                connection.enqueue(own_frame)
+
+
+def _without_user(event: dict[str, Any], user_id: int) -> Frame | None:
+    started = [user for user in event["started"] if user["user_id"] != user_id]
+    stopped = [stopped_id for stopped_id in event["stopped"] if stopped_id != user_id]
+    if not started and not stopped:
+        return None
+    return Frame.from_event(
+        {**event, "started": started, "stopped": stopped}, event["chat_id"]
+    )
+
+
+typing_indicators = TypingIndicators(manager)
@@ -1,9 +1,12 @@
+from datetime import datetime, timezone
 from typing import Any
 
+from sqlalchemy import DateTime, and_, bindparam, case, literal, tuple_, update
 from sqlmodel import Session, func, or_, select
 
 from app.core.security import get_password_hash, verify_password
 from app.models import (
+    CHAT_PREVIEW_LENGTH,
     Chat,
     ChatCreate,
     ChatMember,
@@ -135,6 +138,35 @@ def get_user_chats(*, session: Session, user_id: int) -> list[Chat]:
     return list(session.exec(statement).all())
 
 
+def get_user_chat_ids(*, session: Session, user_id: int) -> list[int]:
+    """Получить id всех чатов пользователя"""
+    statement = select(ChatMember.chat_id).where(ChatMember.user_id == user_id)
+    return list(session.exec(statement).all())
+
+
+def get_members_of_chats(*, session: Session, chat_ids: list[int]) -> dict[int, list[ChatMember]]:
+    """Участники нескольких чатов одним запросом: chat_id -> [ChatMember]"""
+    if not chat_ids:
+        return {}
+    statement = (
+        select(ChatMember)
+        .where(ChatMember.chat_id.in_(chat_ids))
+        .order_by(ChatMember.id)
+    )
+    result: dict[int, list[ChatMember]] = {chat_id: [] for chat_id in chat_ids}
+    for member in session.exec(statement).all():
+        result[member.chat_id].append(member)
+    return result
+
+
+def get_users_by_ids(*, session: Session, user_ids: set[int]) -> dict[int, User]:
+    """Пользователи по id одним запросом"""
+    if not user_ids:
+        return {}
+    statement = select(User).where(User.id.in_(user_ids))
+    return {user.id: user for user in session.exec(statement).all()}
+
+
 def get_chat(*, session: Session, chat_id: int, user_id: int) -> Chat | None:
     """Получить чат, если пользователь является его участником"""
     statement = (
@@ -146,6 +178,146 @@ def get_chat(*, session: Session, chat_id: int, user_id: int) -> Chat | None:
     return session.exec(statement).first()
 
 
+def chat_summary_values(message: ChatMessage | None) -> dict[str, Any]:
+    """Поля сводки чата для его последнего сообщения; None - сообщений нет"""
+    return {
+        "last_message_id": message.id if message else None,
+        "last_message_preview": message.content[:CHAT_PREVIEW_LENGTH] if message else None,
+        "last_message_sender_id": message.sender_id if message else None,
+        "last_message_at": message.created_at if message else None,
+    }
+
+
+def last_message_statement(chat_id: int) -> Any:
+    """Запрос последнего сообщения чата - для пересчета сводки после удаления"""
+    return (
+        select(ChatMessage)
+        .where(ChatMessage.chat_id == chat_id)
+        .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+        .limit(1)
+    )
+
+
+def edit_summary_statement(message: ChatMessage) -> Any:
+    """Обновить превью, если отредактировано последнее сообщение чата"""
+    return (
+        update(Chat)
+        .where(Chat.id == message.chat_id, Chat.last_message_id == message.id)
+        # updated_at не трогаем: порядок в списке меняют только новые сообщения
+        .values(
+            last_message_preview=message.content[:CHAT_PREVIEW_LENGTH],
+            updated_at=Chat.updated_at,
+        )
+    )
+
+
+def unread_increment_statement(message: ChatMessage) -> Any:
+    """Новое сообщение - непрочитанное для всех участников, кроме отправителя"""
+    return (
+        update(ChatMember)
+        .where(ChatMember.chat_id == message.chat_id, ChatMember.user_id != message.sender_id)
+        .values(unread_count=ChatMember.unread_count + 1)
+    )
+
+
+def unread_decrement_statement(message: ChatMessage) -> Any:
+    """Удаленное сообщение больше не непрочитанное у тех, кто его не прочел"""
+    return (
+        update(ChatMember)
+        .where(
+            ChatMember.chat_id == message.chat_id,
+            ChatMember.user_id != message.sender_id,
+            ChatMember.unread_count > 0,
+            or_(
+                ChatMember.last_read_at.is_(None),
+                ChatMember.last_read_at < message.created_at,
+            ),
+        )
+        .values(unread_count=ChatMember.unread_count - 1)
+    )
+
+
+def cursor_key(cursor_id: int, cursor: ChatMessage | None) -> tuple[Any, Any]:
+    """Ключ сортировки истории и его значение у сообщения-курсора.
+
+    Порядок истории - (created_at, id). Если курсор уже удален, сравниваем
+    по id: они растут вместе с created_at.
+    """
+    if cursor is None:
+        return ChatMessage.id, cursor_id
+    return tuple_(ChatMessage.created_at, ChatMessage.id), tuple_(cursor.created_at, cursor.id)
+
+
+def chat_messages_statement(
+    *, chat_id: int, limit: int, skip: int = 0, condition: Any = None, older: bool = True
+) -> Any:
+    """Страница истории чата по индексу (chat_id, created_at, id).
+
+    condition отсекает сообщения по ключу относительно курсора - поиск по
+    индексу на любой глубине, и новые сообщения не сдвигают страницы.
+    Страница older идет от новых к старым.
+    """
+    statement = select(ChatMessage).where(ChatMessage.chat_id == chat_id)
+    if condition is not None:
+        statement = statement.where(condition)
+    if older:
+        order = (ChatMessage.created_at.desc(), ChatMessage.id.desc())
+    else:
+        order = (ChatMessage.created_at, ChatMessage.id)
+    return statement.order_by(*order).offset(skip).limit(limit)
+
+
+def page_statement(
+    *,
+    chat_id: int,
+    limit: int,
+    skip: int = 0,
+    before_id: int | None = None,
+    after_id: int | None = None,
+    cursor: ChatMessage | None = None,
+) -> Any:
+    """Страница перед before_id или после after_id; без курсора - последняя"""
+    if before_id is not None:
+        key, bound = cursor_key(before_id, cursor)
+        condition = key < bound
+    elif after_id is not None:
+        key, bound = cursor_key(after_id, cursor)
+        condition = key > bound
+    else:
+        condition = None
+    return chat_messages_statement(
+        chat_id=chat_id, limit=limit, skip=skip, condition=condition, older=after_id is None
+    )
+
+
+def around_statements(
+    *,
+    chat_id: int,
+    limit: int,
+    anchor: ChatMessage | None = None,
+    around_at: datetime | None = None,
+) -> tuple[Any, Any]:
+    """Окно из limit сообщений вокруг якоря: запросы половины до и остатка после.
+
+    Якорь - сообщение (входит во вторую половину) или момент времени,
+    например last_read_at участника: тогда вторая половина начинается с
+    первого непрочитанного. Каждая половина - один поиск по индексу.
+    """
+    if anchor is not None:
+        key, bound = cursor_key(anchor.id, anchor)
+        before, after = key < bound, key >= bound
+    else:
+        # В базе время UTC без пояса
+        if around_at.tzinfo is not None:
+            around_at = around_at.astimezone(timezone.utc).replace(tzinfo=None)
+        before, after = ChatMessage.created_at <= around_at, ChatMessage.created_at > around_at
+    half = limit // 2
+    return (
+        chat_messages_statement(chat_id=chat_id, limit=half, condition=before),
+        chat_messages_statement(chat_id=chat_id, limit=limit - half, condition=after, older=False),
+    )
+
+
 def create_message(*, session: Session, chat_id: int, sender_id: int, content: str) -> ChatMessage:
     """Создать сообщение в чате"""
     # Проверяем, что отправитель является участником чата
@@ -161,20 +333,40 @@ def create_message(*, session: Session, chat_id: int, sender_id: int, content: s
     
     message = ChatMessage(chat_id=chat_id, sender_id=sender_id, content=content)
     session.add(message)
-    
-    # Обновляем время последнего обновления чата
-    chat = session.get(Chat, chat_id)
-    if chat:
-        from datetime import datetime, timezone
-        chat.updated_at = datetime.now(timezone.utc)
-    
+    session.flush()
+
+    # Сводка и время обновления чата - в той же транзакции
+    session.execute(
+        update(Chat)
+        .where(Chat.id == chat_id)
+        .values(
+            **chat_summary_values(message),
+            message_count=Chat.message_count + 1,
+            updated_at=message.created_at,
+        )
+    )
+    session.execute(unread_increment_statement(message))
     session.commit()
     session.refresh(message)
     return message
 
 
-def get_chat_messages(*, session: Session, chat_id: int, user_id: int, skip: int = 0, limit: int = 50) -> list[ChatMessage]:
-    """Получить сообщения чата"""
+def get_chat_messages(
+    *,
+    session: Session,
+    chat_id: int,
+    user_id: int,
+    skip: int = 0,
+    limit: int = 50,
+    before_id: int | None = None,
+    after_id: int | None = None,
+) -> list[ChatMessage]:
+    """Получить сообщения чата в хронологическом порядке.
+
+    Без курсора - последние limit сообщений (skip оставлен для старых
+    клиентов). before_id - limit сообщений перед указанным, after_id -
+    после него.
+    """
     # Проверяем, что пользователь является участником
     member = session.exec(
         select(ChatMember).where(
@@ -186,15 +378,70 @@ def get_chat_messages(*, session: Session, chat_id: int, user_id: int, skip: int
     if not member:
         return []
     
+    cursor_id = before_id if before_id is not None else after_id
+    cursor = session.get(ChatMessage, cursor_id) if cursor_id is not None else None
+    if cursor is not None and cursor.chat_id != chat_id:
+        cursor = None
+    statement = page_statement(
+        chat_id=chat_id,
+        limit=limit,
+        skip=skip,
+        before_id=before_id,
+        after_id=after_id,
+        cursor=cursor,
+    )
+    messages = list(session.exec(statement).all())
+    if after_id is None:
+        messages.reverse()  # Возвращаем в хронологическом порядке
+    return messages
+
+
+def get_messages_around(
+    *,
+    session: Session,
+    chat_id: int,
+    user_id: int,
+    limit: int = 50,
+    around_id: int | None = None,
+    around_at: datetime | None = None,
+) -> list[ChatMessage] | None:
+    """Окно истории вокруг сообщения around_id или момента around_at.
+
+    Для перехода к сообщению из поиска и открытия чата на первом
+    непрочитанном. None - якорного сообщения нет в чате.
+    """
+    member = session.exec(
+        select(ChatMember).where(
+            ChatMember.chat_id == chat_id,
+            ChatMember.user_id == user_id
+        )
+    ).first()
+    if not member:
+        return []
+
+    anchor = None
+    if around_id is not None:
+        anchor = session.get(ChatMessage, around_id)
+        if anchor is None or anchor.chat_id != chat_id:
+            return None
+    before, after = around_statements(
+        chat_id=chat_id, limit=limit, anchor=anchor, around_at=around_at
+    )
+    messages = list(session.exec(before).all())
+    messages.reverse()
+    return messages + list(session.exec(after).all())
+
+
+def get_messages_after(*, session: Session, chat_id: int, after_id: int, limit: int = 200) -> list[ChatMessage]:
+    """Получить сообщения чата с id больше after_id в хронологическом порядке"""
     statement = (
         select(ChatMessage)
         .where(ChatMessage.chat_id == chat_id)
-        .order_by(ChatMessage.created_at.desc())
-        .offset(skip)
+        .where(ChatMessage.id > after_id)
+        .order_by(ChatMessage.id)
         .limit(limit)
     )
-    messages = list(session.exec(statement).all())
-    return list(reversed(messages))  # Возвращаем в хронологическом порядке
+    return list(session.exec(statement).all())
 
 
 def update_message(*, session: Session, message_id: int, sender_id: int, content: str) -> ChatMessage | None:
@@ -207,6 +454,7 @@ def update_message(*, session: Session, message_id: int, sender_id: int, content
     from datetime import datetime, timezone
     message.edited_at = datetime.now(timezone.utc)
     session.add(message)
+    session.execute(edit_summary_statement(message))
     session.commit()
     session.refresh(message)
     return message
@@ -219,6 +467,21 @@ def delete_message(*, session: Session, message_id: int, user_id: int) -> bool:
         return False
     
     session.delete(message)
+    session.flush()
+
+    values: dict[str, Any] = {
+        "message_count": Chat.message_count - 1,
+        "updated_at": Chat.updated_at,
+    }
+    chat = session.get(Chat, message.chat_id)
+    if chat and chat.last_message_id == message.id:
+        values.update(
+            chat_summary_values(
+                session.exec(last_message_statement(message.chat_id)).first()
+            )
+        )
+    session.execute(update(Chat).where(Chat.id == message.chat_id).values(**values))
+    session.execute(unread_decrement_statement(message))
     session.commit()
     return True
 
@@ -277,5 +540,166 @@ def mark_chat_as_read(*, session: Session, chat_id: int, user_id: int) -> None:
     
     if member:
         member.last_read_at = datetime.now(timezone.utc)
+        member.unread_count = 0
         session.add(member)
         session.commit()
+
+
+def get_chats_of_users(*, session: Session, user_ids: list[int]) -> dict[int, list[int]]:
+    """Сгруппировать пользователей по общим чатам: chat_id -> [user_id]"""
+    if not user_ids:
+        return {}
+    statement = select(ChatMember.chat_id, ChatMember.user_id).where(
+        ChatMember.user_id.in_(user_ids)
+    )
+    result: dict[int, list[int]] = {}
+    for chat_id, user_id in session.exec(statement).all():
+        result.setdefault(chat_id, []).append(user_id)
+    return result
+
+
+def update_last_seen(*, session: Session, last_seen: dict[int, datetime]) -> None:
+    """Записать время последнего визита нескольких пользователей одной транзакцией"""
+    if not last_seen:
+        return
+    table = User.__table__  # type: ignore[attr-defined]
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("b_id"))
+        .values(last_seen_at=bindparam("b_last_seen"))
+    )
+    session.execute(
+        statement,
+        [{"b_id": user_id, "b_last_seen": ts} for user_id, ts in last_seen.items()],
+    )
+    session.commit()
+
+
+def update_last_read(
+    *, session: Session, last_read: dict[tuple[int, int], datetime]
+) -> None:
+    """Записать позиции прочтения (chat_id, user_id) -> время одной транзакцией.
+
+    Время только растет: более старое значение не затирает записанное.
+    Счетчик непрочитанных пересчитывается от новой позиции - сообщения,
+    пришедшие после отметки, но до записи, остаются непрочитанными.
+    """
+    if not last_read:
+        return
+    table = ChatMember.__table__  # type: ignore[attr-defined]
+    unread_after = (
+        select(func.count(ChatMessage.id))
+        .where(
+            ChatMessage.chat_id == table.c.chat_id,
+            ChatMessage.sender_id != table.c.user_id,
+            ChatMessage.created_at > bindparam("b_last_read"),
+        )
+        .scalar_subquery()
+    )
+    statement = (
+        update(table)
+        .where(table.c.chat_id == bindparam("b_chat_id"))
+        .where(table.c.user_id == bindparam("b_user_id"))
+        .where(
+            or_(
+                table.c.last_read_at.is_(None),
+                table.c.last_read_at < bindparam("b_last_read"),
+            )
+        )
+        .values(last_read_at=bindparam("b_last_read"), unread_count=unread_after)
+    )
+    session.execute(
+        statement,
+        [
+            {"b_chat_id": chat_id, "b_user_id": user_id, "b_last_read": ts}
+            for (chat_id, user_id), ts in last_read.items()
+        ],
+    )
+    session.commit()
+
+
+def count_unread_after_reads(
+    *, session: Session, reads: dict[tuple[int, int], datetime]
+) -> dict[tuple[int, int], int]:
+    """Непрочитанные после позиций прочтения: (chat_id, user_id) -> count.
+
+    Один запрос на любое число позиций: позиция участника подставляется в
+    условие соединения через CASE, сообщения каждого чата берутся по индексу
+    (chat_id, created_at, id).
+    """
+    if not reads:
+        return {}
+    keys = {
+        key: and_(ChatMember.chat_id == key[0], ChatMember.user_id == key[1])
+        for key in reads
+    }
+    read_at = case(
+        *((keys[key], literal(ts, DateTime)) for key, ts in reads.items())
+    )
+    statement = (
+        select(ChatMember.chat_id, ChatMember.user_id, func.count(ChatMessage.id))
+        .outerjoin(
+            ChatMessage,
+            and_(
+                ChatMessage.chat_id == ChatMember.chat_id,
+                ChatMessage.sender_id != ChatMember.user_id,
+                ChatMessage.created_at > read_at,
+            ),
+        )
+        .where(or_(*keys.values()))
+        .group_by(ChatMember.chat_id, ChatMember.user_id)
+    )
+    return {
+        (chat_id, user_id): count
+        for chat_id, user_id, count in session.exec(statement).all()
+    }
+
+
+def get_unread_counts(
+    *,
+    session: Session,
+    chat_id: int,
+    read_overrides: dict[int, datetime] | None = None,
+) -> dict[int, int]:
+    """Число непрочитанных сообщений чата для каждого участника: user_id -> count.
+
+    Читаются счетчики участников. read_overrides - еще не записанные в базу
+    позиции прочтения: для них непрочитанные считаются от этой позиции.
+    """
+    statement = select(ChatMember.user_id, ChatMember.unread_count).where(
+        ChatMember.chat_id == chat_id
+    )
+    counts: dict[int, int] = dict(session.exec(statement).all())
+
+    after = count_unread_after_reads(
+        session=session,
+        reads={(chat_id, user_id): ts for user_id, ts in (read_overrides or {}).items()},
+    )
+    for (_, user_id), count in after.items():
+        counts[user_id] = min(counts[user_id], count)
+    return counts
+
+
+def get_unread_summary(
+    *,
+    session: Session,
+    user_id: int,
+    read_overrides: dict[int, datetime] | None = None,
+) -> dict[int, int]:
+    """Непрочитанные пользователя по всем его чатам: chat_id -> count.
+
+    Одна строка ChatMember на чат; read_overrides (chat_id -> время) -
+    еще не записанные в базу позиции прочтения, по ним один общий запрос.
+    """
+    statement = select(ChatMember.chat_id, ChatMember.unread_count).where(
+        ChatMember.user_id == user_id
+    )
+    counts: dict[int, int] = dict(session.exec(statement).all())
+
+    after = count_unread_after_reads(
+        session=session,
+        reads={(chat_id, user_id): ts for chat_id, ts in (read_overrides or {}).items()},
+    )
+    for (chat_id, _), count in after.items():
+        counts[chat_id] = min(counts[chat_id], count)
+    return counts
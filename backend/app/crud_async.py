@@ -0,0 +1,217 @@
+"""Асинхронные CRUD операции мессенджера.
+
+Повторяют функции из app/crud.py, но работают через AsyncSession
+(aiosqlite), чтобы async маршруты не блокировали event loop на запросах
+к базе. Маршрут выбирает слой через зависимость SessionDep или
+AsyncSessionDep.
+"""
+
+from datetime import datetime, timezone
+from typing import Any
+
+from sqlalchemy import update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.crud import (
+    around_statements,
+    chat_summary_values,
+    edit_summary_statement,
+    last_message_statement,
+    page_statement,
+    unread_decrement_statement,
+    unread_increment_statement,
+)
+from app.models import Chat, ChatMember, ChatMessage, User
+
+
+async def get_member(
+    *, session: AsyncSession, chat_id: int, user_id: int
+) -> ChatMember | None:
+    """Получить участника чата"""
+    result = await session.exec(
+        select(ChatMember).where(
+            ChatMember.chat_id == chat_id, ChatMember.user_id == user_id
+        )
+    )
+    return result.first()
+
+
+async def get_user(*, session: AsyncSession, user_id: int) -> User | None:
+    return await session.get(User, user_id)
+
+
+async def get_user_chats(*, session: AsyncSession, user_id: int) -> list[Chat]:
+    """Получить все чаты пользователя"""
+    statement = (
+        select(Chat)
+        .join(ChatMember, Chat.id == ChatMember.chat_id)
+        .where(ChatMember.user_id == user_id)
+        .order_by(Chat.updated_at.desc())
+    )
+    result = await session.exec(statement)
+    return list(result.all())
+
+
+async def get_user_chat_ids(*, session: AsyncSession, user_id: int) -> list[int]:
+    """Получить id всех чатов пользователя"""
+    result = await session.exec(
+        select(ChatMember.chat_id).where(ChatMember.user_id == user_id)
+    )
+    return list(result.all())
+
+
+async def get_chat(*, session: AsyncSession, chat_id: int, user_id: int) -> Chat | None:
+    """Получить чат, если пользователь является его участником"""
+    statement = (
+        select(Chat)
+        .join(ChatMember, Chat.id == ChatMember.chat_id)
+        .where(Chat.id == chat_id)
+        .where(ChatMember.user_id == user_id)
+    )
+    result = await session.exec(statement)
+    return result.first()
+
+
+async def create_message(
+    *, session: AsyncSession, chat_id: int, sender_id: int, content: str
+) -> ChatMessage:
+    """Создать сообщение в чате"""
+    member = await get_member(session=session, chat_id=chat_id, user_id=sender_id)
+    if not member:
+        raise ValueError("User is not a member of this chat")
+
+    message = ChatMessage(chat_id=chat_id, sender_id=sender_id, content=content)
+    session.add(message)
+    await session.flush()
+
+    # Сводка и время обновления чата - в той же транзакции
+    await session.exec(
+        update(Chat)
+        .where(Chat.id == chat_id)
+        .values(
+            **chat_summary_values(message),
+            message_count=Chat.message_count + 1,
+            updated_at=message.created_at,
+        )
+    )
+    await session.exec(unread_increment_statement(message))
+    await session.commit()
+    await session.refresh(message)
+    return message
+
+
+async def get_chat_messages(
+    *,
+    session: AsyncSession,
+    chat_id: int,
+    user_id: int,
+    skip: int = 0,
+    limit: int = 50,
+    before_id: int | None = None,
+    after_id: int | None = None,
+) -> list[ChatMessage]:
+    """Получить сообщения чата в хронологическом порядке"""
+    member = await get_member(session=session, chat_id=chat_id, user_id=user_id)
+    if not member:
+        return []
+
+    cursor_id = before_id if before_id is not None else after_id
+    cursor = (
+        await session.get(ChatMessage, cursor_id) if cursor_id is not None else None
+    )
+    if cursor is not None and cursor.chat_id != chat_id:
+        cursor = None
+    statement = page_statement(
+        chat_id=chat_id,
+        limit=limit,
+        skip=skip,
+        before_id=before_id,
+        after_id=after_id,
+        cursor=cursor,
+    )
+    messages = list((await session.exec(statement)).all())
+    if after_id is None:
+        messages.reverse()  # Возвращаем в хронологическом порядке
+    return messages
+
+
+async def get_messages_around(
+    *,
+    session: AsyncSession,
+    chat_id: int,
+    user_id: int,
+    limit: int = 50,
+    around_id: int | None = None,
+    around_at: datetime | None = None,
+) -> list[ChatMessage] | None:
+    """Окно истории вокруг сообщения или момента; None - якоря нет в чате"""
+    member = await get_member(session=session, chat_id=chat_id, user_id=user_id)
+    if not member:
+        return []
+
+    anchor = None
+    if around_id is not None:
+        anchor = await session.get(ChatMessage, around_id)
+        if anchor is None or anchor.chat_id != chat_id:
+            return None
+    before, after = around_statements(
+        chat_id=chat_id, limit=limit, anchor=anchor, around_at=around_at
+    )
+    messages = list((await session.exec(before)).all())
+    messages.reverse()
+    return messages + list((await session.exec(after)).all())
+
+
+async def update_message(
+    *, session: AsyncSession, message_id: int, sender_id: int, content: str
+) -> ChatMessage | None:
+    """Обновить сообщение"""
+    message = await session.get(ChatMessage, message_id)
+    if not message or message.sender_id != sender_id:
+        return None
+
+    message.content = content
+    message.edited_at = datetime.now(timezone.utc)
+    session.add(message)
+    await session.exec(edit_summary_statement(message))
+    await session.commit()
+    await session.refresh(message)
+    return message
+
+
+async def delete_message(
+    *, session: AsyncSession, message_id: int, user_id: int
+) -> ChatMessage | None:
+    """Удалить сообщение; возвращает удаленное сообщение"""
+    message = await session.get(ChatMessage, message_id)
+    if not message or message.sender_id != user_id:
+        return None
+
+    await session.delete(message)
+    await session.flush()
+
+    values: dict[str, Any] = {
+        "message_count": Chat.message_count - 1,
+        "updated_at": Chat.updated_at,
+    }
+    chat = await session.get(Chat, message.chat_id)
+    if chat and chat.last_message_id == message.id:
+        result = await session.exec(last_message_statement(message.chat_id))
+        values.update(chat_summary_values(result.first()))
+    await session.exec(update(Chat).where(Chat.id == message.chat_id).values(**values))
+    await session.exec(unread_decrement_statement(message))
+    await session.commit()
+    return message
+
+
+async def mark_chat_as_read(
+    *, session: AsyncSession, chat_id: int, user_id: int
+) -> None:
+    """Отметить чат как прочитанный"""
+    member = await get_member(session=session, chat_id=chat_id, user_id=user_id)
+    if member:
+        member.last_read_at = datetime.now(timezone.utc)
+        member.unread_count = 0
+        session.add(member)
+        await session.commit()
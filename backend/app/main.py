@@ -1,4 +1,9 @@
+import asyncio
 import logging
+import signal
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
 import sentry_sdk
 from fastapi import FastAPI
 from fastapi.routing import APIRoute
@@ -8,7 +13,11 @@ from sqlmodel import Session, SQLModel, select
 from app import crud
 from app.api.main import api_router
 from app.core.config import settings
-from app.core.db import engine
+from app.core.db import engine, upgrade_schema
+from app.core.presence import presence
+from app.core.read_receipts import read_receipts
+from app.core.realtime import manager
+from app.core.typing_indicators import typing_indicators
 from app.models import User, UserCreate
 
 logging.basicConfig(level=logging.INFO)
@@ -29,6 +38,8 @@ def create_tables():
         logger.info("Checking and creating database tables if needed...")
         # SQLModel.create_all безопасно создает только отсутствующие таблицы
         SQLModel.metadata.create_all(engine)
+        # Новые колонки и индексы в уже существующих таблицах
+        upgrade_schema(engine)
         logger.info("Database tables ready")
     except Exception as e:
         logger.error(f"Error creating tables: {e}")
@@ -60,8 +71,53 @@ def create_initial_user():
 create_tables()
 create_initial_user()
 
+
+def install_drain_on_sigterm() -> None:
+    """Перед остановкой по SIGTERM закрыть WebSocket волнами.
+
+    uvicorn при остановке сразу закрывает все сокеты, еще до shutdown в
+    lifespan, и клиенты переподключаются одновременно. Поэтому SIGTERM
+    перехватывается: сначала manager.drain(), затем исходный обработчик
+    uvicorn. Повторный сигнал останавливает сервер без ожидания.
+    """
+    original = signal.getsignal(signal.SIGTERM)
+    if not callable(original):
+        return
+    loop = asyncio.get_running_loop()
+
+    def on_sigterm() -> None:
+        if manager.draining:
+            original(signal.SIGTERM, None)
+            return
+        task = manager.start_drain()
+        task.add_done_callback(lambda _: original(signal.SIGTERM, None))
+
+    try:
+        loop.add_signal_handler(signal.SIGTERM, on_sigterm)
+    except (NotImplementedError, RuntimeError, ValueError):
+        # Не главный поток (TestClient) или платформа без сигналов в asyncio
+        pass
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    # Подписка воркера на realtime-шину
+    await manager.start()
+    await presence.start()
+    await read_receipts.start()
+    await typing_indicators.start()
+    if settings.REALTIME_DRAIN_ON_SIGTERM:
+        install_drain_on_sigterm()
+    yield
+    await typing_indicators.stop()
+    await read_receipts.stop()
+    await presence.stop()
+    await manager.stop()
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
+    lifespan=lifespan,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     generate_unique_id_function=custom_generate_unique_id,
 )
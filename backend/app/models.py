@@ -2,6 +2,7 @@ from datetime import datetime, timezone
 from typing import Literal
 
 from pydantic import EmailStr
+from sqlalchemy import Index
 from sqlmodel import Column, DateTime, Field, Integer, Relationship, SQLModel, func
 
 
@@ -46,6 +47,10 @@ class User(UserBase, table=True):
         default=None, sa_column=Column(Integer, primary_key=True, autoincrement=True)
     )
     hashed_password: str
+    # Последний визит; пишется пачками сервисом присутствия (app/core/presence.py)
+    last_seen_at: datetime | None = Field(
+        default=None, sa_column=Column(DateTime, nullable=True)
+    )
     chat_members: list["ChatMember"] = Relationship(
         back_populates="user", cascade_delete=True
     )
@@ -85,6 +90,10 @@ class NewPassword(SQLModel):
 # ========== МОДЕЛИ МЕССЕНДЖЕРА FUSION ==========
 
 
+# Длина превью последнего сообщения в сводке чата
+CHAT_PREVIEW_LENGTH = 100
+
+
 # Модель чата (личный или групповой)
 class Chat(SQLModel, table=True):
     id: int | None = Field(
@@ -100,7 +109,20 @@ class Chat(SQLModel, table=True):
     )
     updated_at: datetime = Field(
         default_factory=lambda: datetime.now(timezone.utc),
-        sa_column=Column(DateTime, default=func.now(), onupdate=func.now()),
+        sa_column=Column(DateTime, default=func.now(), onupdate=func.now(), index=True),
+    )
+    # Сводка для списка чатов; обновляется в транзакции записи сообщения
+    # (app/crud.py), чтобы список не читал ChatMessage
+    last_message_id: int | None = Field(default=None)
+    last_message_preview: str | None = Field(
+        default=None, max_length=CHAT_PREVIEW_LENGTH
+    )
+    last_message_sender_id: int | None = Field(default=None)
+    last_message_at: datetime | None = Field(
+        default=None, sa_column=Column(DateTime, nullable=True)
+    )
+    message_count: int = Field(
+        default=0, sa_column=Column(Integer, nullable=False, server_default="0")
     )
 
     # Связи
@@ -118,7 +140,9 @@ class ChatMember(SQLModel, table=True):
         default=None, sa_column=Column(Integer, primary_key=True, autoincrement=True)
     )
     chat_id: int = Field(foreign_key="chat.id", nullable=False, ondelete="CASCADE")
-    user_id: int = Field(foreign_key="user.id", nullable=False, ondelete="CASCADE")
+    user_id: int = Field(
+        foreign_key="user.id", nullable=False, ondelete="CASCADE", index=True
+    )
     joined_at: datetime = Field(
         default_factory=lambda: datetime.now(timezone.utc),
         sa_column=Column(DateTime, default=func.now()),
@@ -126,6 +150,11 @@ class ChatMember(SQLModel, table=True):
     last_read_at: datetime | None = Field(
         default=None, sa_column=Column(DateTime, nullable=True)
     )
+    # Непрочитанные сообщения: растет при записи сообщения в чат, при
+    # отметке о прочтении пересчитывается от last_read_at (app/crud.py)
+    unread_count: int = Field(
+        default=0, sa_column=Column(Integer, nullable=False, server_default="0")
+    )
 
     # Связи
     chat: Chat = Relationship(back_populates="members")
@@ -134,10 +163,17 @@ class ChatMember(SQLModel, table=True):
 
 # Сообщения в чате
 class ChatMessage(SQLModel, table=True):
+    # Страницы истории - поиск по (chat_id, created_at, id), см. crud.chat_messages_statement
+    __table_args__ = (
+        Index("ix_chatmessage_chat_id_created_at_id", "chat_id", "created_at", "id"),
+    )
+
     id: int | None = Field(
         default=None, sa_column=Column(Integer, primary_key=True, autoincrement=True)
     )
-    chat_id: int = Field(foreign_key="chat.id", nullable=False, ondelete="CASCADE")
+    chat_id: int = Field(
+        foreign_key="chat.id", nullable=False, ondelete="CASCADE", index=True
+    )
     sender_id: int = Field(foreign_key="user.id", nullable=False, ondelete="CASCADE")
     content: str = Field(max_length=4096)
     created_at: datetime = Field(
@@ -167,7 +203,11 @@ class ChatPublic(SQLModel):
     created_at: datetime
     updated_at: datetime
     members: list["ChatMemberPublic"] = Field(default_factory=list)
+    # В списке чатов content последнего сообщения - превью из сводки
     last_message: "ChatMessagePublic | None" = None
+    message_count: int = 0
+    # Непрочитанные текущим пользователем
+    unread_count: int = 0
 
 
 class ChatMemberPublic(SQLModel):
@@ -178,6 +218,17 @@ class ChatMemberPublic(SQLModel):
     last_read_at: datetime | None
 
 
+class ChatUnreadPublic(SQLModel):
+    chat_id: int
+    unread_count: int
+
+
+class UnreadSummaryPublic(SQLModel):
+    total: int
+    # Только чаты с непрочитанными
+    chats: list[ChatUnreadPublic]
+
+
 class ChatAddMembers(SQLModel):
     member_ids: list[int] = Field(min_length=1)
 
@@ -212,3 +263,32 @@ class ChatMessagesPublic(SQLModel):
 
 class UserSearch(SQLModel):
     query: str = Field(min_length=1, max_length=100)
+
+
+class UserPresence(SQLModel):
+    user_id: int
+    online: bool
+    last_seen_at: datetime | None = None
+
+
+class UsersPresence(SQLModel):
+    data: list[UserPresence]
+
+
+# Событие realtime-шины: через эту таблицу воркеры обмениваются
+# событиями для WebSocket клиентов (см. app/core/pubsub.py)
+class RealtimeEvent(SQLModel, table=True):
+    # AUTOINCREMENT не переиспользует id после очистки таблицы,
+    # иначе воркеры пропустили бы новые события
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id: int | None = Field(
+        default=None, sa_column=Column(Integer, primary_key=True, autoincrement=True)
+    )
+    channel: str = Field(max_length=64)
+    node_id: str = Field(max_length=32)
+    payload: str
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc),
+        sa_column=Column(DateTime, default=func.now(), index=True),
+    )
@@ -0,0 +1,146 @@
+"""Бенчмарк задержки рассылки при конкурентных писателях.
+
+Сравнивает сохранение сообщений прямо в event loop (как раньше делал
+websocket_endpoint) с выполнением через пул потоков БД (run_db). Пока
+писатели коммитят сообщения, отдельная задача рассылает пробные события в
+чат со слушателями и меряет, через сколько они доходят до сокетов.
+
+Запуск из каталога backend:
+
+    python scripts/benchmark_realtime_writers.py --writers 8 --messages 50
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+from pathlib import Path
+
+# Отдельная база и брокер в памяти, чтобы не трогать рабочий app.db
+os.environ["SQLITE_DB_PATH"] = str(Path(tempfile.mkdtemp()) / "bench.db")
+os.environ["REALTIME_BROKER"] = "memory"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlmodel import Session, SQLModel  # noqa: E402
+
+from app import crud  # noqa: E402
+from app.api.routes.websocket import _create_message  # noqa: E402
+from app.core.db import engine, run_db  # noqa: E402
+from app.core.pubsub import MemoryBackend  # noqa: E402
+from app.core.realtime import ConnectionManager  # noqa: E402
+from app.models import User  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+
+class ProbeSocket:
+    """Сокет-слушатель: записывает задержку доставки пробных событий"""
+
+    def __init__(self, latencies: list[float]) -> None:
+        self.latencies = latencies
+
+    async def accept(self, subprotocol: str | None = None) -> None:
+        pass
+
+    async def send_text(self, data: str) -> None:
+        event = json.loads(data)
+        if event["type"] == "probe":
+            self.latencies.append(asyncio.get_running_loop().time() - event["sent_at"])
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        pass
+
+
+def setup_chat(writers: int) -> tuple[int, list[int]]:
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        users = []
+        for i in range(writers):
+            user = User(email=f"bench{i}@example.com", hashed_password="x")
+            session.add(user)
+            users.append(user)
+        session.commit()
+        user_ids = [user.id for user in users]
+        chat = crud.create_group_chat(
+            session=session, creator_id=user_ids[0], name="bench", member_ids=user_ids
+        )
+        return chat.id, user_ids
+
+
+async def run_mode(
+    mode: str, chat_id: int, user_ids: list[int], messages: int, listeners: int
+) -> list[float]:
+    manager = ConnectionManager(MemoryBackend())
+    latencies: list[float] = []
+    probe_chat_id = -1
+    for user_id in range(listeners):
+        await manager.connect(ProbeSocket(latencies), user_id, [probe_chat_id])  # type: ignore[arg-type]
+
+    loop = asyncio.get_running_loop()
+    done = asyncio.Event()
+
+    async def probe() -> None:
+        while not done.is_set():
+            await manager.broadcast_to_chat(
+                {"type": "probe", "sent_at": loop.time()}, probe_chat_id
+            )
+            await asyncio.sleep(0.005)
+
+    async def writer(user_id: int) -> None:
+        for i in range(messages):
+            if mode == "inline":
+                message = _create_message(chat_id, user_id, f"message {i}")
+            else:
+                message = await run_db(
+                    _create_message, chat_id, user_id, f"message {i}"
+                )
+            await manager.broadcast_to_chat(
+                {"type": "new_message", "message": message}, chat_id
+            )
+            await asyncio.sleep(0)
+
+    probe_task = asyncio.create_task(probe())
+    await asyncio.gather(*(writer(user_id) for user_id in user_ids))
+    done.set()
+    await probe_task
+    await asyncio.sleep(0.05)
+    return latencies
+
+
+def report(mode: str, latencies: list[float]) -> None:
+    if not latencies:
+        logger.info(f"{mode:>8}: no samples")
+        return
+    ms = sorted(value * 1000 for value in latencies)
+    quantiles = statistics.quantiles(ms, n=100)
+    logger.info(
+        f"{mode:>8}: samples={len(ms)} p50={quantiles[49]:.2f}ms "
+        f"p95={quantiles[94]:.2f}ms p99={quantiles[98]:.2f}ms max={ms[-1]:.2f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--listeners", type=int, default=100)
+    args = parser.parse_args()
+
+    chat_id, user_ids = setup_chat(args.writers)
+    logger.info(
+        f"writers={args.writers} messages/writer={args.messages} listeners={args.listeners}"
+    )
+    for mode in ("inline", "executor"):
+        latencies = asyncio.run(
+            run_mode(mode, chat_id, user_ids, args.messages, args.listeners)
+        )
+        report(mode, latencies)
+
+
+if __name__ == "__main__":
+    main()
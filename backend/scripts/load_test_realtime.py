@@ -0,0 +1,299 @@
+"""Нагрузочный тест рассылки WebSocket.
+
+Поднимает N аутентифицированных клиентов против запущенного сервера,
+раскладывает их по групповым чатам заданного размера и гоняет трафик
+сообщений и typing. Каждый клиент держит соединение /ws и меряет задержку
+доставки new_message от отправки до получения (часы общие - клиенты и
+сервер на одной машине). В конце печатает перцентили задержки, пропускную
+способность и память воркеров по /utils/realtime-stats/.
+
+Запуск из каталога backend при запущенном сервере:
+
+    python scripts/load_test_realtime.py --url http://localhost:8000 \\
+        --clients 1000 --chat-size 50 --duration 30
+
+Для тысяч соединений поднимите лимит дескрипторов: ulimit -n 65536.
+Пользователи и чаты теста создаются через API и остаются в базе, поэтому
+запускайте его на отдельной базе.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import statistics
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import httpx
+import msgpack
+import websockets
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core.config import settings  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+
+MARKER = "lt"
+PASSWORD = "load-test-password"
+
+
+@dataclass
+class Results:
+    sent: int = 0
+    expected: int = 0
+    delivered: int = 0
+    typing_frames: int = 0
+    other_frames: int = 0
+    errors: int = 0
+    latencies: list[float] = field(default_factory=list)
+
+
+@dataclass
+class Client:
+    user_id: int
+    token: str
+    chat_id: int = 0
+    ws: Any = None
+
+
+async def create_client(
+    http: httpx.AsyncClient, run_id: str, index: int, limit: asyncio.Semaphore
+) -> Client:
+    email = f"{MARKER}-{run_id}-{index}@example.com"
+    async with limit:
+        response = await http.post(
+            "/users/signup", json={"email": email, "password": PASSWORD}
+        )
+        response.raise_for_status()
+        user_id = response.json()["id"]
+        response = await http.post(
+            "/login/access-token", data={"username": email, "password": PASSWORD}
+        )
+        response.raise_for_status()
+    return Client(user_id=user_id, token=response.json()["access_token"])
+
+
+async def create_chats(
+    http: httpx.AsyncClient, clients: list[Client], chat_size: int, run_id: str
+) -> list[list[Client]]:
+    groups = [clients[i : i + chat_size] for i in range(0, len(clients), chat_size)]
+    for number, group in enumerate(groups):
+        response = await http.post(
+            "/chats/group",
+            headers={"Authorization": f"Bearer {group[0].token}"},
+            json={
+                "chat_type": "group",
+                "name": f"{MARKER}-{run_id}-{number}",
+                "member_ids": [client.user_id for client in group[1:]],
+            },
+        )
+        response.raise_for_status()
+        for client in group:
+            client.chat_id = response.json()["id"]
+    return groups
+
+
+def decode(data: str | bytes) -> dict[str, Any]:
+    if isinstance(data, bytes):
+        return msgpack.unpackb(data)
+    return json.loads(data)
+
+
+async def read_loop(client: Client, results: Results) -> None:
+    try:
+        async for data in client.ws:
+            event = decode(data)
+            event_type = event.get("type")
+            # Клиент без своего трафика иначе будет закрыт по таймауту бездействия
+            if event_type == "ping":
+                await client.ws.send(json.dumps({"type": "pong"}))
+            elif event_type == "new_message":
+                content = event["message"]["content"]
+                if content.startswith(MARKER):
+                    sent_at = float(content.split()[1])
+                    results.latencies.append(time.time() - sent_at)
+                    results.delivered += 1
+            elif event_type == "typing":
+                results.typing_frames += 1
+            elif event_type == "error":
+                results.errors += 1
+            else:
+                results.other_frames += 1
+    except websockets.ConnectionClosed:
+        pass
+
+
+async def drive_chat(
+    group: list[Client],
+    results: Results,
+    message_rate: float,
+    typing_rate: float,
+    deadline: float,
+) -> None:
+    """Трафик одного чата: сообщения и typing от случайных участников"""
+    loop = asyncio.get_running_loop()
+    next_message = loop.time()
+    next_typing = loop.time()
+    while loop.time() < deadline:
+        now = loop.time()
+        if message_rate and now >= next_message:
+            client = random.choice(group)
+            await client.ws.send(
+                json.dumps(
+                    {
+                        "type": "message",
+                        "chat_id": client.chat_id,
+                        "content": f"{MARKER} {time.time():.6f}",
+                    }
+                )
+            )
+            results.sent += 1
+            results.expected += len(group)
+            next_message += 1 / message_rate
+        if typing_rate and now >= next_typing:
+            client = random.choice(group)
+            await client.ws.send(
+                json.dumps({"type": "typing", "chat_id": client.chat_id})
+            )
+            next_typing += 1 / typing_rate
+        wake_at = min(
+            next_message if message_rate else deadline,
+            next_typing if typing_rate else deadline,
+        )
+        await asyncio.sleep(max(0.0, wake_at - loop.time()))
+
+
+async def worker_stats(
+    http: httpx.AsyncClient, samples: int
+) -> dict[int, dict[str, Any]]:
+    """Опросить realtime-stats несколько раз, чтобы застать каждый воркер"""
+    response = await http.post(
+        "/login/access-token",
+        data={
+            "username": settings.FIRST_SUPERUSER,
+            "password": settings.FIRST_SUPERUSER_PASSWORD,
+        },
+    )
+    if response.status_code != 200:
+        logger.info("superuser login failed, worker stats skipped")
+        return {}
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    workers: dict[int, dict[str, Any]] = {}
+    for _ in range(samples):
+        # Новое соединение на каждый запрос - балансировка между воркерами
+        async with httpx.AsyncClient(base_url=str(http.base_url)) as probe:
+            response = await probe.get("/utils/realtime-stats/", headers=headers)
+        if response.status_code == 200:
+            stats = response.json()
+            workers[stats["pid"]] = stats
+    return workers
+
+
+def report(
+    results: Results, elapsed: float, workers: dict[int, dict[str, Any]]
+) -> None:
+    logger.info(
+        f"sent={results.sent} expected={results.expected} delivered={results.delivered} "
+        f"lost={results.expected - results.delivered} errors={results.errors}"
+    )
+    logger.info(
+        f"throughput: {results.sent / elapsed:.1f} msg/s in, "
+        f"{results.delivered / elapsed:.1f} deliveries/s out, "
+        f"typing frames={results.typing_frames} other frames={results.other_frames}"
+    )
+    if len(results.latencies) >= 2:
+        ms = sorted(value * 1000 for value in results.latencies)
+        quantiles = statistics.quantiles(ms, n=100)
+        logger.info(
+            f"latency: p50={quantiles[49]:.2f}ms p95={quantiles[94]:.2f}ms "
+            f"p99={quantiles[98]:.2f}ms max={ms[-1]:.2f}ms"
+        )
+    for pid, stats in sorted(workers.items()):
+        logger.info(
+            f"worker {pid}: max_rss={stats['max_rss_kb'] / 1024:.1f}MiB "
+            f"connections={stats['connections']} dropped_frames={stats['dropped_frames']}"
+        )
+
+
+async def run(args: argparse.Namespace) -> None:
+    api_url = args.url.rstrip("/") + settings.API_V1_STR
+    ws_url = api_url.replace("http", "ws", 1) + "/ws"
+    subprotocols = ["msgpack"] if args.protocol == "msgpack" else None
+    run_id = uuid.uuid4().hex[:8]
+    results = Results()
+
+    async with httpx.AsyncClient(base_url=api_url, timeout=60) as http:
+        limit = asyncio.Semaphore(args.setup_concurrency)
+        clients = await asyncio.gather(
+            *(create_client(http, run_id, i, limit) for i in range(args.clients))
+        )
+        groups = await create_chats(http, list(clients), args.chat_size, run_id)
+        logger.info(
+            f"clients={len(clients)} chats={len(groups)} chat_size={args.chat_size}"
+        )
+
+        for client in clients:
+            client.ws = await websockets.connect(
+                f"{ws_url}?token={client.token}",
+                subprotocols=subprotocols,
+                max_queue=None,
+            )
+            decode(await client.ws.recv())  # subscribed
+        readers = [
+            asyncio.create_task(read_loop(client, results)) for client in clients
+        ]
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + args.duration
+        await asyncio.gather(
+            *(
+                drive_chat(
+                    group, results, args.message_rate, args.typing_rate, deadline
+                )
+                for group in groups
+            )
+        )
+        # Ждем доставки последних сообщений
+        await asyncio.sleep(args.drain)
+        elapsed = loop.time() - started
+
+        workers = await worker_stats(http, args.stats_samples)
+        for client in clients:
+            await client.ws.close()
+        await asyncio.gather(*readers)
+
+    report(results, elapsed, workers)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--chat-size", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument(
+        "--message-rate", type=float, default=2, help="messages/s per chat"
+    )
+    parser.add_argument(
+        "--typing-rate", type=float, default=5, help="typing frames/s per chat"
+    )
+    parser.add_argument("--protocol", choices=["json", "msgpack"], default="json")
+    parser.add_argument("--drain", type=float, default=2)
+    parser.add_argument("--setup-concurrency", type=int, default=20)
+    parser.add_argument("--stats-samples", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -125,3 +125,185 @@ def test_create_and_send_message(
     assert len(messages_data["data"]) > 0
     assert messages_data["data"][0]["content"] == message_data["content"]
 
+
+
+def test_mark_chat_read(
+    client: TestClient, superuser_token_headers: dict[str, str], db
+) -> None:
+    """Отметка о прочтении видна сразу, до записи в базу"""
+    from tests.utils.user import create_random_user
+
+    user = create_random_user(db)
+    chat = client.post(
+        f"{settings.API_V1_STR}/chats/private/{user.id}",
+        headers=superuser_token_headers,
+    ).json()
+
+    response = client.post(
+        f"{settings.API_V1_STR}/chats/{chat['id']}/read",
+        headers=superuser_token_headers,
+    )
+    assert response.status_code == 200
+
+    chat = client.get(
+        f"{settings.API_V1_STR}/chats/{chat['id']}",
+        headers=superuser_token_headers,
+    ).json()
+    me = client.get(
+        f"{settings.API_V1_STR}/users/me", headers=superuser_token_headers
+    ).json()
+    [member] = [m for m in chat["members"] if m["user_id"] == me["id"]]
+    assert member["last_read_at"] is not None
+
+    response = client.post(
+        f"{settings.API_V1_STR}/chats/999999/read",
+        headers=superuser_token_headers,
+    )
+    assert response.status_code == 404
+
+
+def test_get_chats_query_count_is_independent_of_chat_count(
+    client: TestClient, db, monkeypatch
+) -> None:
+    """Список чатов собирается постоянным числом запросов"""
+    from datetime import timedelta
+
+    from sqlalchemy import event
+
+    from app import crud
+    from app.core.db import engine
+    from app.core.read_receipts import read_receipts
+    from app.core.security import create_access_token
+    from tests.utils.user import create_random_user
+
+    # Отметки о прочтении остаются в буфере на все время теста
+    async def no_flush() -> None:
+        pass
+
+    monkeypatch.setattr(read_receipts, "flush", no_flush)
+
+    owner = create_random_user(db)
+    members = [create_random_user(db) for _ in range(3)]
+    headers = {
+        "Authorization": f"Bearer {create_access_token(owner.id, timedelta(minutes=5))}"
+    }
+
+    def add_chats(count: int) -> None:
+        for i in range(count):
+            chat = crud.create_group_chat(
+                session=db,
+                creator_id=owner.id,
+                name=f"chat {i}",
+                member_ids=[member.id for member in members],
+            )
+            for member in members:
+                crud.create_message(
+                    session=db, chat_id=chat.id, sender_id=member.id, content="hi"
+                )
+            # Каждый второй чат прочитан, но отметка еще не записана в базу
+            if i % 2:
+                response = client.post(
+                    f"{settings.API_V1_STR}/chats/{chat.id}/read", headers=headers
+                )
+                assert response.status_code == 200
+
+    def count_queries() -> tuple[int, int]:
+        statements: list[str] = []
+
+        def before_execute(conn, cursor, statement, *args) -> None:  # noqa: ARG001
+            # Опрос realtime-шины идет в фоне и к запросу не относится
+            if "realtimeevent" not in statement:
+                statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", before_execute)
+        try:
+            response = client.get(f"{settings.API_V1_STR}/chats/", headers=headers)
+        finally:
+            event.remove(engine, "before_cursor_execute", before_execute)
+        assert response.status_code == 200
+        return len(statements), response.json()["count"]
+
+    crud.get_or_create_private_chat(session=db, user1_id=owner.id, user2_id=members[0].id)
+    add_chats(2)
+    few_queries, few_chats = count_queries()
+    add_chats(20)
+    many_queries, many_chats = count_queries()
+
+    assert (few_chats, many_chats) == (3, 23)
+    assert len(read_receipts.pending_for_user(owner.id)) == 11
+    assert many_queries == few_queries
+
+
+def test_unread_counts_in_chats_and_summary(client: TestClient, db) -> None:
+    """Счетчики непрочитанных в списке чатов и в /chats/unread-summary"""
+    from datetime import timedelta
+
+    from app import crud
+    from app.core.security import create_access_token
+    from tests.utils.user import create_random_user
+
+    reader = create_random_user(db)
+    sender = create_random_user(db)
+    headers = {
+        "Authorization": f"Bearer {create_access_token(reader.id, timedelta(minutes=5))}"
+    }
+    chat = crud.get_or_create_private_chat(session=db, user1_id=reader.id, user2_id=sender.id)
+    for _ in range(3):
+        crud.create_message(session=db, chat_id=chat.id, sender_id=sender.id, content="hi")
+
+    def summary() -> dict:
+        response = client.get(f"{settings.API_V1_STR}/chats/unread-summary", headers=headers)
+        assert response.status_code == 200
+        return response.json()
+
+    assert summary() == {"total": 3, "chats": [{"chat_id": chat.id, "unread_count": 3}]}
+    [listed] = client.get(f"{settings.API_V1_STR}/chats/", headers=headers).json()["data"]
+    assert listed["unread_count"] == 3
+
+    # Отметка еще в буфере, но счетчики уже нулевые
+    client.post(f"{settings.API_V1_STR}/chats/{chat.id}/read", headers=headers)
+    assert summary() == {"total": 0, "chats": []}
+    detail = client.get(f"{settings.API_V1_STR}/chats/{chat.id}", headers=headers).json()
+    assert detail["unread_count"] == 0
+
+    crud.create_message(session=db, chat_id=chat.id, sender_id=sender.id, content="new")
+    assert summary()["total"] == 1
+
+
+def test_get_messages_with_cursor(client: TestClient, db) -> None:
+    """Листание истории по before_id / after_id"""
+    from datetime import timedelta
+
+    from app import crud
+    from app.core.security import create_access_token
+    from tests.utils.user import create_random_user
+
+    user = create_random_user(db)
+    other = create_random_user(db)
+    headers = {
+        "Authorization": f"Bearer {create_access_token(user.id, timedelta(minutes=5))}"
+    }
+    chat = crud.get_or_create_private_chat(session=db, user1_id=user.id, user2_id=other.id)
+    ids = [
+        crud.create_message(session=db, chat_id=chat.id, sender_id=other.id, content=str(i)).id
+        for i in range(5)
+    ]
+    url = f"{settings.API_V1_STR}/chats/{chat.id}/messages"
+
+    def page(**params: int) -> list[int]:
+        response = client.get(url, headers=headers, params=params)
+        assert response.status_code == 200
+        return [message["id"] for message in response.json()["data"]]
+
+    assert page(limit=2) == ids[3:]
+    assert page(limit=2, before_id=ids[3]) == ids[1:3]
+    assert page(limit=2, after_id=ids[1]) == ids[2:4]
+
+    assert page(limit=3, around_id=ids[2]) == ids[1:4]
+
+    response = client.get(
+        url, headers=headers, params={"before_id": ids[3], "after_id": ids[1]}
+    )
+    assert response.status_code == 400
+    response = client.get(url, headers=headers, params={"around_id": 0})
+    assert response.status_code == 404
@@ -0,0 +1,33 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.core.realtime import manager
+
+
+def test_events_require_token(client: TestClient) -> None:
+    r = client.get(f"{settings.API_V1_STR}/events")
+    assert r.status_code == 403
+    r = client.get(f"{settings.API_V1_STR}/events", params={"token": "invalid"})
+    assert r.status_code == 403
+
+
+def test_events_per_user_limit(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "REALTIME_MAX_CONNECTIONS_PER_USER", 0)
+    r = client.get(f"{settings.API_V1_STR}/events", headers=superuser_token_headers)
+    assert r.status_code == 429
+
+
+def test_events_refused_while_draining(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(manager, "draining", True)
+    r = client.get(f"{settings.API_V1_STR}/events", headers=superuser_token_headers)
+    assert r.status_code == 503
+    assert int(r.headers["Retry-After"]) >= 1
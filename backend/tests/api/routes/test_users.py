@@ -484,3 +484,21 @@ def test_delete_user_without_privileges(
     )
     assert r.status_code == 403
     assert r.json()["detail"] == "The user doesn't have enough privileges"
+
+
+def test_read_users_presence(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    user_in = UserCreate(email=random_email(), password=random_lower_string())
+    user = crud.create_user(session=db, user_create=user_in)
+
+    r = client.get(
+        f"{settings.API_V1_STR}/users/presence",
+        headers=normal_user_token_headers,
+        params={"user_ids": [user.id, 999999]},
+    )
+    assert r.status_code == 200
+    data = r.json()["data"]
+    assert [item["user_id"] for item in data] == [user.id]
+    assert data[0]["online"] is False
+    assert data[0]["last_seen_at"] is None
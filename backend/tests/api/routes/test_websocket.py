@@ -0,0 +1,421 @@
+import json
+import time
+from typing import Any
+
+import msgpack
+import pytest
+from fastapi.testclient import TestClient
+from fastapi.websockets import WebSocketDisconnect
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.realtime import manager
+from tests.utils.user import create_random_user
+
+
+def _token(headers: dict[str, str]) -> str:
+    return headers["Authorization"].removeprefix("Bearer ")
+
+
+def _receive_event(ws: Any, binary: bool = False) -> dict[str, Any]:
+    """Следующее событие, пропуская дельты списка чатов"""
+    while True:
+        event = msgpack.unpackb(ws.receive_bytes()) if binary else ws.receive_json()
+        if event["type"] != "chat_updated":
+            return event
+
+
+def _create_private_chat(
+    client: TestClient, headers: dict[str, str], db: Session
+) -> int:
+    user = create_random_user(db)
+    response = client.post(
+        f"{settings.API_V1_STR}/chats/private/{user.id}",
+        headers=headers,
+    )
+    return response.json()["id"]
+
+
+def test_user_websocket_subscribes_to_all_chats(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    chat_ids = {
+        _create_private_chat(client, superuser_token_headers, db) for _ in range(2)
+    }
+
+    token = _token(superuser_token_headers)
+    with client.websocket_connect(f"{settings.API_V1_STR}/ws?token={token}") as ws:
+        hello = _receive_event(ws)
+        assert hello["type"] == "subscribed"
+        assert chat_ids <= set(hello["chat_ids"])
+
+        # Одно соединение получает события из любого чата пользователя
+        for chat_id in chat_ids:
+            ws.send_json({"type": "message", "chat_id": chat_id, "content": "hello"})
+            event = _receive_event(ws)
+            assert event["type"] == "new_message"
+            assert event["message"]["chat_id"] == chat_id
+
+
+def test_user_websocket_unsubscribe(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    chat_id = _create_private_chat(client, superuser_token_headers, db)
+
+    token = _token(superuser_token_headers)
+    with client.websocket_connect(f"{settings.API_V1_STR}/ws?token={token}") as ws:
+        _receive_event(ws)
+        ws.send_json({"type": "unsubscribe", "chat_id": chat_id})
+        assert _receive_event(ws) == {"type": "unsubscribed", "chat_id": chat_id}
+
+        ws.send_json({"type": "message", "chat_id": chat_id, "content": "hello"})
+        assert _receive_event(ws)["type"] == "error"
+
+        ws.send_json({"type": "subscribe", "chat_id": chat_id})
+        assert _receive_event(ws) == {"type": "subscribed", "chat_id": chat_id}
+
+
+def test_user_websocket_rejects_foreign_chat(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    superuser_token_headers: dict[str, str],
+    db: Session,
+) -> None:
+    chat_id = _create_private_chat(client, superuser_token_headers, db)
+
+    token = _token(normal_user_token_headers)
+    with client.websocket_connect(f"{settings.API_V1_STR}/ws?token={token}") as ws:
+        _receive_event(ws)
+        ws.send_json({"type": "subscribe", "chat_id": chat_id})
+        assert _receive_event(ws)["type"] == "error"
+
+
+def test_websocket_replays_missed_messages(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    chat_id = _create_private_chat(client, superuser_token_headers, db)
+    ids = []
+    for i in range(3):
+        response = client.post(
+            f"{settings.API_V1_STR}/messages/{chat_id}",
+            headers=superuser_token_headers,
+            json={"content": f"message {i}"},
+        )
+        ids.append(response.json()["id"])
+
+    token = _token(superuser_token_headers)
+    url = f"{settings.API_V1_STR}/ws/{chat_id}?token={token}&last_id={ids[0]}"
+    with client.websocket_connect(url) as ws:
+        replayed = [_receive_event(ws), _receive_event(ws)]
+        assert [event["message"]["id"] for event in replayed] == ids[1:]
+        done = _receive_event(ws)
+        assert done == {
+            "type": "replay_done",
+            "chat_id": chat_id,
+            "last_id": ids[2],
+            "truncated": False,
+        }
+
+
+def test_user_websocket_replays_per_chat(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    chat_id = _create_private_chat(client, superuser_token_headers, db)
+    response = client.post(
+        f"{settings.API_V1_STR}/messages/{chat_id}",
+        headers=superuser_token_headers,
+        json={"content": "missed"},
+    )
+    message_id = response.json()["id"]
+
+    token = _token(superuser_token_headers)
+    url = f"{settings.API_V1_STR}/ws?token={token}&last_ids={chat_id}:{message_id - 1}"
+    with client.websocket_connect(url) as ws:
+        assert _receive_event(ws)["type"] == "subscribed"
+        event = _receive_event(ws)
+        assert event["type"] == "new_message"
+        assert event["message"]["id"] == message_id
+        assert _receive_event(ws)["type"] == "replay_done"
+
+
+def test_websocket_heartbeat(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    token = _token(superuser_token_headers)
+    with client.websocket_connect(f"{settings.API_V1_STR}/ws?token={token}") as ws:
+        _receive_event(ws)
+        ws.send_json({"type": "ping"})
+        assert _receive_event(ws) == {"type": "pong"}
+
+        r = client.get(
+            f"{settings.API_V1_STR}/utils/realtime-stats/",
+            headers=superuser_token_headers,
+        )
+        assert r.status_code == 200
+        stats = r.json()
+        assert stats["connections"] >= 1
+        assert stats["live"] + stats["stale"] == stats["connections"]
+        assert stats["pid"] > 0
+
+
+def test_realtime_stats_requires_superuser(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/realtime-stats/",
+        headers=normal_user_token_headers,
+    )
+    assert r.status_code == 403
+
+
+def test_websocket_msgpack_protocol(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    chat_id = _create_private_chat(client, superuser_token_headers, db)
+
+    token = _token(superuser_token_headers)
+    with client.websocket_connect(
+        f"{settings.API_V1_STR}/ws?token={token}", subprotocols=["msgpack"]
+    ) as ws:
+        assert ws.accepted_subprotocol == "msgpack"
+        hello = _receive_event(ws, binary=True)
+        assert hello["type"] == "subscribed"
+
+        ws.send_bytes(
+            msgpack.packb({"type": "message", "chat_id": chat_id, "content": "hi"})
+        )
+        event = _receive_event(ws, binary=True)
+        assert event["type"] == "new_message"
+        assert event["message"]["content"] == "hi"
+
+        # JSON кадры принимаются и в бинарном режиме
+        ws.send_json({"type": "ping"})
+        assert _receive_event(ws, binary=True) == {"type": "pong"}
+
+
+def test_websocket_rejects_invalid_frames(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    chat_id = _create_private_chat(client, superuser_token_headers, db)
+
+    token = _token(superuser_token_headers)
+    with client.websocket_connect(f"{settings.API_V1_STR}/ws?token={token}") as ws:
+        _receive_event(ws)
+        for frame in (
+            "not json",
+            '{"type": "unknown"}',
+            json.dumps({"type": "message", "chat_id": chat_id, "content": ""}),
+            '{"type": "subscribe"}',
+        ):
+            ws.send_text(frame)
+            event = _receive_event(ws)
+            assert event["type"] == "error"
+            assert event["message"].startswith("Invalid frame")
+
+        # Соединение осталось рабочим
+        ws.send_json({"type": "message", "chat_id": chat_id, "content": "ok"})
+        assert _receive_event(ws)["type"] == "new_message"
+
+
+def test_websocket_receives_edits_and_deletes(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    chat_id = _create_private_chat(client, superuser_token_headers, db)
+
+    token = _token(superuser_token_headers)
+    with client.websocket_connect(
+        f"{settings.API_V1_STR}/ws/{chat_id}?token={token}"
+    ) as ws:
+        message = client.post(
+            f"{settings.API_V1_STR}/messages/{chat_id}",
+            headers=superuser_token_headers,
+            json={"content": "draft"},
+        ).json()
+        assert _receive_event(ws)["type"] == "new_message"
+
+        response = client.put(
+            f"{settings.API_V1_STR}/messages/{message['id']}",
+            headers=superuser_token_headers,
+            json={"content": "final"},
+        )
+        assert response.status_code == 200
+        event = _receive_event(ws)
+        assert event["type"] == "message_edited"
+        assert event["id"] == message["id"]
+        assert event["chat_id"] == chat_id
+        assert event["content"] == "final"
+        assert event["edited_at"] == response.json()["edited_at"]
+        assert "sender" not in event
+
+        response = client.delete(
+            f"{settings.API_V1_STR}/messages/{message['id']}",
+            headers=superuser_token_headers,
+        )
+        assert response.status_code == 200
+        assert _receive_event(ws) == {
+            "type": "message_deleted",
+            "id": message["id"],
+            "chat_id": chat_id,
+        }
+
+    response = client.delete(
+        f"{settings.API_V1_STR}/messages/{message['id']}",
+        headers=superuser_token_headers,
+    )
+    assert response.status_code == 404
+
+
+def test_user_websocket_receives_chat_list_deltas(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    superuser_token_headers: dict[str, str],
+) -> None:
+    me = client.get(
+        f"{settings.API_V1_STR}/users/me", headers=normal_user_token_headers
+    ).json()
+
+    token = _token(normal_user_token_headers)
+    with client.websocket_connect(f"{settings.API_V1_STR}/ws?token={token}") as ws:
+        ws.receive_json()
+
+        # Новый чат: участник узнает о нем и подписывается без переподключения
+        chat_id = client.post(
+            f"{settings.API_V1_STR}/chats/private/{me['id']}",
+            headers=superuser_token_headers,
+        ).json()["id"]
+        event = ws.receive_json()
+        assert event["type"] == "chat_updated"
+        assert event["chat_id"] == chat_id
+        assert me["id"] in event["member_ids"]
+
+        for i in range(2):
+            client.post(
+                f"{settings.API_V1_STR}/messages/{chat_id}",
+                headers=superuser_token_headers,
+                json={"content": f"hello {i}"},
+            )
+            events = [ws.receive_json(), ws.receive_json()]
+            by_type = {event["type"]: event for event in events}
+            assert by_type["new_message"]["message"]["content"] == f"hello {i}"
+            delta = by_type["chat_updated"]
+            assert delta["chat_id"] == chat_id
+            assert delta["last_message"]["content"] == f"hello {i}"
+            assert delta["unread_count"] == i + 1
+            assert "members" not in delta
+
+
+def test_realtime_metrics_record_pipeline_stages(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    normal_user_token_headers: dict[str, str],
+    db: Session,
+) -> None:
+    chat_id = _create_private_chat(client, superuser_token_headers, db)
+
+    token = _token(superuser_token_headers)
+    with client.websocket_connect(
+        f"{settings.API_V1_STR}/ws/{chat_id}?token={token}"
+    ) as ws:
+        ws.send_json({"type": "message", "content": "measured"})
+        assert _receive_event(ws)["type"] == "new_message"
+
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/realtime-metrics/",
+        headers=superuser_token_headers,
+        params={"reset": True},
+    )
+    assert r.status_code == 200
+    stages = r.json()["stages"]
+    for stage in ("parse", "db_commit", "serialize", "fanout", "send", "end_to_end"):
+        assert stages[stage]["count"] >= 1
+
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/realtime-metrics/",
+        headers=normal_user_token_headers,
+    )
+    assert r.status_code == 403
+
+
+def test_rest_message_trace_includes_commit(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    db: Session,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "REALTIME_TRACE_SAMPLE_RATE", 1.0)
+    chat_id = _create_private_chat(client, superuser_token_headers, db)
+    metrics.reset()
+
+    r = client.post(
+        f"{settings.API_V1_STR}/messages/{chat_id}",
+        headers=superuser_token_headers,
+        json={"content": "traced"},
+    )
+    assert r.status_code == 200
+    # Рассылка идет фоновой задачей - ждем, пока трейс закроется
+    for _ in range(50):
+        if metrics.traces:
+            break
+        time.sleep(0.01)
+
+    [trace] = [trace for trace in metrics.traces if trace["kind"] == "rest_message"]
+    names = [stage for stage, _ in trace["stages_ms"]]
+    assert names[0] == "db_commit"
+    assert names[-1] == "end_to_end"
+
+
+def test_websocket_refused_while_draining(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(manager, "draining", True)
+    token = _token(superuser_token_headers)
+    with client.websocket_connect(f"{settings.API_V1_STR}/ws?token={token}") as ws:
+        with pytest.raises(WebSocketDisconnect) as exc_info:
+            ws.receive_json()
+    assert exc_info.value.code == 1012
+    assert json.loads(exc_info.value.reason)["retry_after_ms"] >= 1000
+
+
+def test_websocket_per_user_connection_limit(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "REALTIME_MAX_CONNECTIONS_PER_USER", 1)
+    token = _token(superuser_token_headers)
+    with client.websocket_connect(f"{settings.API_V1_STR}/ws?token={token}") as ws:
+        _receive_event(ws)
+        with client.websocket_connect(
+            f"{settings.API_V1_STR}/ws?token={token}"
+        ) as second:
+            with pytest.raises(WebSocketDisconnect) as exc_info:
+                second.receive_json()
+        assert exc_info.value.code == 1008
+        # Первое соединение продолжает работать
+        ws.send_json({"type": "ping"})
+        assert _receive_event(ws)["type"] == "pong"
+
+
+def test_websocket_closes_flooding_connection(
+    client: TestClient,
+    superuser_token_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "REALTIME_FRAME_RATE", 0.001)
+    monkeypatch.setattr(settings, "REALTIME_FRAME_BURST", 2)
+    monkeypatch.setattr(settings, "REALTIME_RATE_LIMIT_CLOSE_AFTER", 3)
+    token = _token(superuser_token_headers)
+    with client.websocket_connect(f"{settings.API_V1_STR}/ws?token={token}") as ws:
+        _receive_event(ws)
+        for _ in range(5):
+            ws.send_json({"type": "ping"})
+        assert _receive_event(ws)["type"] == "pong"
+        assert _receive_event(ws)["type"] == "pong"
+        # Сверх лимита - одна ошибка на серию, затем закрытие
+        assert _receive_event(ws) == {"type": "error", "message": "Rate limit exceeded"}
+        with pytest.raises(WebSocketDisconnect) as exc_info:
+            _receive_event(ws)
+    assert exc_info.value.code == 1008
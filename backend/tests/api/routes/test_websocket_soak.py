@@ -0,0 +1,211 @@
+"""Soak-тест жизненного цикла WebSocket.
+
+Тысячи соединений проходят через настоящие обработчики /ws и /ws/{chat_id}
+с разными исходами: штатное закрытие, мусорные кадры, ошибка чтения,
+падение отправки. После каждого раунда менеджер должен вернуться к
+исходному состоянию, а объекты соединений - собраться сборщиком мусора.
+Число соединений задается переменной окружения SOAK_CONNECTIONS.
+"""
+
+import asyncio
+import gc
+import json
+import os
+import random
+import weakref
+from datetime import timedelta
+from typing import Any
+
+import pytest
+from sqlmodel import Session
+
+from app import crud
+from app.api.routes import websocket as websocket_routes
+from app.core.config import settings
+from app.core.pubsub import MemoryBackend
+from app.core.realtime import ConnectionManager
+from app.core.security import create_access_token
+from tests.utils.user import create_random_user
+
+SOAK_CONNECTIONS = int(os.environ.get("SOAK_CONNECTIONS", "600"))
+ROUNDS = 3
+SCENARIOS = ("clean", "garbage", "receive_error", "send_error")
+
+
+class ScriptedWebSocket:
+    """Клиент, который отправляет заданные кадры и завершается по сценарию"""
+
+    def __init__(self, token: str, scenario: str, chat_id: int) -> None:
+        self.query_params = {"token": token}
+        self.scope: dict[str, Any] = {"subprotocols": []}
+        self.scenario = scenario
+        self.frames = [
+            {"type": "websocket.receive", "text": json.dumps({"type": "ping"})},
+            {
+                "type": "websocket.receive",
+                "text": json.dumps({"type": "unsubscribe", "chat_id": chat_id}),
+            },
+            {
+                "type": "websocket.receive",
+                "text": json.dumps({"type": "subscribe", "chat_id": chat_id}),
+            },
+        ]
+        if scenario == "garbage":
+            self.frames += [
+                {"type": "websocket.receive", "text": "{not json"},
+                {"type": "websocket.receive", "bytes": b"\xc1\xc1"},
+                {"type": "websocket.receive", "text": json.dumps({"type": "message"})},
+            ]
+        self.closed_with: int | None = None
+
+    async def accept(self, subprotocol: str | None = None) -> None:
+        pass
+
+    async def receive(self) -> dict[str, Any]:
+        await asyncio.sleep(0)
+        if self.frames:
+            return self.frames.pop(0)
+        if self.scenario == "receive_error":
+            raise RuntimeError("connection reset")
+        return {"type": "websocket.disconnect", "code": 1000}
+
+    async def send_text(self, data: str) -> None:  # noqa: ARG002
+        if self.scenario == "send_error":
+            raise RuntimeError("broken pipe")
+
+    async def send_bytes(self, data: bytes) -> None:
+        await self.send_text("")
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:  # noqa: ARG002
+        self.closed_with = code
+
+
+@pytest.fixture
+def soak_manager(monkeypatch: pytest.MonkeyPatch) -> ConnectionManager:
+    manager = ConnectionManager(MemoryBackend())
+    monkeypatch.setattr(websocket_routes, "manager", manager)
+    # Соединения распределены всего на четырех пользователей
+    monkeypatch.setattr(settings, "REALTIME_MAX_CONNECTIONS_PER_USER", SOAK_CONNECTIONS)
+    # Перехват логов pytest хранит записи с traceback, а тот - кадры с
+    # соединениями; в рабочем процессе записи не удерживаются
+    monkeypatch.setattr(websocket_routes.logger, "disabled", True)
+    return manager
+
+
+def test_websocket_lifecycle_soak(db: Session, soak_manager: ConnectionManager) -> None:
+    users = [create_random_user(db) for _ in range(4)]
+    chat = crud.create_group_chat(
+        session=db,
+        creator_id=users[0].id,
+        name="soak",
+        member_ids=[user.id for user in users[1:]],
+    )
+    tokens = [create_access_token(user.id, timedelta(minutes=30)) for user in users]
+    connections: list[weakref.ref[Any]] = []
+
+    original_connect = soak_manager.connect
+
+    async def tracking_connect(*args: Any, **kwargs: Any) -> Any:
+        connection = await original_connect(*args, **kwargs)
+        connections.append(weakref.ref(connection))
+        return connection
+
+    soak_manager.connect = tracking_connect  # type: ignore[method-assign]
+
+    async def client(index: int) -> ScriptedWebSocket:
+        scenario = SCENARIOS[index % len(SCENARIOS)]
+        websocket = ScriptedWebSocket(random.choice(tokens), scenario, chat.id)
+        if index % 2:
+            await websocket_routes.user_websocket_endpoint(websocket)  # type: ignore[arg-type]
+        else:
+            await websocket_routes.websocket_endpoint(websocket, chat.id)  # type: ignore[arg-type]
+        return websocket
+
+    async def run_round() -> None:
+        sockets = await asyncio.gather(*(client(i) for i in range(SOAK_CONNECTIONS)))
+        # Даем завершиться задачам закрытия сокетов и писателям
+        for _ in range(3):
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.05)
+        assert soak_manager.active_connections == {}
+        assert soak_manager.user_connections == {}
+        assert soak_manager.connection_count == 0
+        # Сервер закрывает сокет с 1011 при необработанной ошибке
+        for websocket in sockets:
+            if websocket.scenario == "receive_error":
+                assert websocket.closed_with == 1011
+        assert all(
+            task.done() or task is asyncio.current_task()
+            for task in asyncio.all_tasks()
+        )
+
+    for _ in range(ROUNDS):
+        asyncio.run(run_round())
+        gc.collect()
+        # Ни одно соединение не удерживается менеджером или задачами
+        assert len(connections) == SOAK_CONNECTIONS
+        assert [ref for ref in connections if ref() is not None] == []
+        connections.clear()
+
+
+class IdleWebSocket:
+    """Клиент без своего трафика, который только отвечает на ping сервера"""
+
+    def __init__(self, token: str, answer_pings: bool) -> None:
+        self.query_params = {"token": token}
+        self.scope: dict[str, Any] = {"subprotocols": []}
+        self.answer_pings = answer_pings
+        self.inbox: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+        self.pings = 0
+        self.closed_with: int | None = None
+
+    async def accept(self, subprotocol: str | None = None) -> None:
+        pass
+
+    async def receive(self) -> dict[str, Any]:
+        return await self.inbox.get()
+
+    async def send_text(self, data: str) -> None:
+        if json.loads(data)["type"] == "ping":
+            self.pings += 1
+            if self.answer_pings:
+                pong = json.dumps({"type": "pong"})
+                self.inbox.put_nowait({"type": "websocket.receive", "text": pong})
+
+    async def send_bytes(self, data: bytes) -> None:
+        await self.send_text(data.decode())
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:  # noqa: ARG002
+        self.closed_with = code
+        self.inbox.put_nowait({"type": "websocket.disconnect", "code": code})
+
+
+def test_idle_client_answering_pings_outlives_idle_timeout(
+    db: Session, soak_manager: ConnectionManager, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "REALTIME_PING_INTERVAL", 0.05)
+    monkeypatch.setattr(settings, "REALTIME_IDLE_TIMEOUT", 0.2)
+    token = create_access_token(create_random_user(db).id, timedelta(minutes=30))
+
+    async def run() -> tuple[IdleWebSocket, IdleWebSocket]:
+        alive = IdleWebSocket(token, answer_pings=True)
+        silent = IdleWebSocket(token, answer_pings=False)
+        handlers = [
+            asyncio.create_task(
+                websocket_routes.user_websocket_endpoint(websocket)  # type: ignore[arg-type]
+            )
+            for websocket in (alive, silent)
+        ]
+        # Втрое дольше таймаута бездействия
+        for _ in range(30):
+            await asyncio.sleep(0.02)
+            soak_manager.reap()
+        assert soak_manager.connection_count == 1
+        await alive.close()
+        await asyncio.gather(*handlers)
+        return alive, silent
+
+    alive, silent = asyncio.run(run())
+    assert alive.pings > 1
+    assert silent.closed_with == 1001
+    assert soak_manager.user_connections == {}
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+from sqlmodel import Session
+
+from app import crud
+from app.core import chat_updates
+from app.core.chat_updates import (
+    CHAT_UPDATES_CHANNEL,
+    notify_members_changed,
+    notify_new_message,
+)
+from app.core.pubsub import MemoryBackend
+from app.core.realtime import ConnectionManager
+from app.models import ChatMessagePublic
+from tests.utils.realtime import FakeWebSocket
+from tests.utils.user import create_random_user
+
+
+@pytest.fixture
+def local_manager(
+    monkeypatch: pytest.MonkeyPatch,
+) -> tuple[ConnectionManager, list[str]]:
+    """Отдельный менеджер с записью всех публикаций в шину"""
+    manager = ConnectionManager(MemoryBackend())
+    manager.channel_handlers[CHAT_UPDATES_CHANNEL] = chat_updates._on_chat_update
+    monkeypatch.setattr(chat_updates, "manager", manager)
+    published: list[str] = []
+    publish = manager.bus.publish
+
+    async def recording_publish(channel: str, data: str) -> None:
+        published.append(channel)
+        await publish(channel, data)
+
+    monkeypatch.setattr(manager.bus, "publish", recording_publish)
+    return manager, published
+
+
+def test_new_message_is_published_once_for_all_members(
+    db: Session, local_manager: tuple[ConnectionManager, list[str]]
+) -> None:
+    manager, published = local_manager
+    sender, *members = [create_random_user(db) for _ in range(4)]
+    chat = crud.create_group_chat(
+        session=db,
+        creator_id=sender.id,
+        name="updates",
+        member_ids=[member.id for member in members],
+    )
+    message = crud.create_message(
+        session=db, chat_id=chat.id, sender_id=sender.id, content="hello"
+    )
+
+    async def run() -> dict[int, FakeWebSocket]:
+        sockets = {user.id: FakeWebSocket() for user in (sender, members[0])}
+        for user_id, ws in sockets.items():
+            await manager.connect(ws, user_id, all_chats=True)  # type: ignore[arg-type]
+        await notify_new_message(ChatMessagePublic.model_validate(message))
+        await asyncio.sleep(0.01)
+        return sockets
+
+    sockets = asyncio.run(run())
+    assert published == [f"{CHAT_UPDATES_CHANNEL}:{chat.id}"]
+    for user_id, unread_count in ((sender.id, 0), (members[0].id, 1)):
+        [event] = [e for e in sockets[user_id].sent if e["type"] == "chat_updated"]
+        assert event["chat_id"] == chat.id
+        assert event["last_message"]["id"] == message.id
+        assert event["unread_count"] == unread_count
+
+
+def test_members_change_subscribes_added_users_locally(
+    db: Session, local_manager: tuple[ConnectionManager, list[str]]
+) -> None:
+    manager, published = local_manager
+    creator = create_random_user(db)
+    added = create_random_user(db)
+    chat = crud.create_group_chat(
+        session=db, creator_id=creator.id, name="members", member_ids=[]
+    )
+    crud.add_members_to_group_chat(
+        session=db, chat_id=chat.id, member_ids=[added.id], current_user_id=creator.id
+    )
+
+    async def run() -> FakeWebSocket:
+        ws = FakeWebSocket()
+        connection = await manager.connect(ws, added.id, all_chats=True)  # type: ignore[arg-type]
+        await notify_members_changed(chat.id, [added.id])
+        await asyncio.sleep(0.01)
+        assert connection in manager.active_connections[chat.id]
+        return ws
+
+    ws = asyncio.run(run())
+    assert published == [f"{CHAT_UPDATES_CHANNEL}:{chat.id}"]
+    [event] = [e for e in ws.sent if e["type"] == "chat_updated"]
+    assert event["member_ids"] == sorted([creator.id, added.id])
@@ -0,0 +1,14 @@
+import asyncio
+import threading
+
+from app.core.db import run_db
+
+
+def test_run_db_runs_outside_event_loop_thread() -> None:
+    async def run() -> str:
+        return await run_db(lambda: threading.current_thread().name)
+
+    loop_thread = threading.current_thread().name
+    thread_name = asyncio.run(run())
+    assert thread_name != loop_thread
+    assert thread_name.startswith("db")
@@ -0,0 +1,90 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+from app.core.config import settings
+from app.core.metrics import Histogram, RealtimeMetrics, Trace, current_trace
+from app.core.pubsub import MemoryBackend
+from app.core.realtime import ConnectionManager, Frame
+from tests.utils.realtime import FakeWebSocket
+
+
+def test_histogram_quantiles() -> None:
+    histogram = Histogram()
+    for ms in [0.3] * 90 + [7] * 9 + [300]:
+        histogram.observe(ms / 1000)
+
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 100
+    assert snapshot["p50_ms"] == 0.5
+    assert snapshot["p95_ms"] == 10
+    assert snapshot["p99_ms"] == 10
+    assert snapshot["max_ms"] == 300
+
+
+def test_trace_closes_after_last_local_recipient(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    monkeypatch.setattr(settings, "REALTIME_TRACE_SAMPLE_RATE", 1.0)
+    trace_file = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(settings, "REALTIME_TRACE_FILE", str(trace_file))
+    metrics = RealtimeMetrics()
+    monkeypatch.setattr("app.core.realtime.metrics", metrics)
+
+    async def run() -> None:
+        manager = ConnectionManager(MemoryBackend())
+        for user_id in range(3):
+            await manager.connect(FakeWebSocket(), user_id, [1])  # type: ignore[arg-type]
+
+        token = current_trace.set(Trace("ws_message"))
+        await manager.broadcast_to_chat(
+            {"type": "new_message", "message": {"id": 1}}, 1
+        )
+        current_trace.reset(token)
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+
+    stages = metrics.snapshot()["stages"]
+    assert stages["send"]["count"] == 3
+    assert stages["queue_wait"]["count"] == 3
+    assert stages["fanout"]["count"] == 1
+    assert stages["end_to_end"]["count"] == 1
+
+    [trace] = metrics.snapshot()["traces"]
+    assert trace["kind"] == "ws_message"
+    names = [stage for stage, _ in trace["stages_ms"]]
+    assert names[:2] == ["serialize", "fanout"]
+    assert names.count("send") == 3
+    assert names[-1] == "end_to_end"
+    assert json.loads(trace_file.read_text()) == trace
+
+
+def test_trace_closes_when_frames_are_dropped(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "REALTIME_TRACE_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(settings, "REALTIME_SEND_QUEUE_SIZE", 1)
+    metrics = RealtimeMetrics()
+    monkeypatch.setattr("app.core.realtime.metrics", metrics)
+
+    async def run() -> None:
+        manager = ConnectionManager(MemoryBackend())
+        evicted, closed, _ = [
+            await manager.connect(FakeWebSocket(), user_id, [1])  # type: ignore[arg-type]
+            for user_id in range(3)
+        ]
+
+        token = current_trace.set(Trace("ws_message"))
+        manager._send_to_local_chat(Frame.from_event({"type": "new_message"}, 1), 1)
+        current_trace.reset(token)
+        # До отправки: кадр вытеснен из очереди одного и брошен закрытым другим
+        evicted.enqueue(Frame.from_event({"type": "ping"}))
+        manager.disconnect(closed)
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+
+    assert metrics.snapshot()["stages"]["end_to_end"]["count"] == 1
+    [trace] = metrics.snapshot()["traces"]
+    assert trace["discarded"] == 2
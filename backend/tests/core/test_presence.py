@@ -0,0 +1,113 @@
+import asyncio
+import json
+
+from sqlmodel import Session
+
+from app import crud
+from app.core.presence import PresenceService
+from app.core.pubsub import MemoryBackend
+from app.core.realtime import ConnectionManager
+from app.models import User
+from tests.utils.realtime import FakeWebSocket
+from tests.utils.user import create_random_user
+
+
+def test_presence_diffs_are_coalesced_per_chat(db: Session) -> None:
+    watcher = create_random_user(db)
+    members = [create_random_user(db) for _ in range(3)]
+    chat = crud.create_group_chat(
+        session=db,
+        creator_id=watcher.id,
+        name="presence",
+        member_ids=[member.id for member in members],
+    )
+
+    async def run() -> FakeWebSocket:
+        manager = ConnectionManager(MemoryBackend())
+        service = PresenceService(manager)
+        watcher_ws = FakeWebSocket()
+        await manager.connect(watcher_ws, watcher.id, [chat.id])  # type: ignore[arg-type]
+        await service.tick()
+        await asyncio.sleep(0.01)
+        watcher_ws.sent.clear()
+
+        # Три входа за один тик - один кадр в чат
+        for member in members:
+            await manager.connect(FakeWebSocket(), member.id, [])  # type: ignore[arg-type]
+        await service.tick()
+        await asyncio.sleep(0.01)
+        await service.flush()
+        return watcher_ws
+
+    watcher_ws = asyncio.run(run())
+    presence_frames = [e for e in watcher_ws.sent if e["type"] == "presence"]
+    assert len(presence_frames) == 1
+    users = presence_frames[0]["users"]
+    assert {u["user_id"] for u in users} == {member.id for member in members}
+    assert all(u["online"] for u in users)
+
+    # last_seen_at записан пачкой
+    for member in members:
+        db.expire_all()
+        assert db.get(User, member.id).last_seen_at is not None
+
+
+def test_presence_merges_other_workers() -> None:
+    async def run() -> None:
+        manager = ConnectionManager(MemoryBackend())
+        service = PresenceService(manager)
+
+        await service._on_presence_event(
+            "", json.dumps({"node": "other", "online": [101, 102]})
+        )
+        assert service.online_users() == {101, 102}
+
+        await service._on_presence_event(
+            "", json.dumps({"node": "other", "up": [103], "down": [101]})
+        )
+        assert service.online_users() == {102, 103}
+
+        # Рассылает только воркер с наименьшим node_id
+        assert service.is_leader() == (service.node_id <= "other")
+
+    asyncio.run(run())
+
+
+def _link(source: ConnectionManager, target: ConnectionManager) -> None:
+    """Доставлять публикации source еще и воркеру target"""
+    publish = source.bus.publish
+
+    async def linked_publish(channel: str, data: str) -> None:
+        await publish(channel, data)
+        await target.bus._deliver(channel, data)
+
+    source.bus.publish = linked_publish  # type: ignore[method-assign]
+
+
+def test_last_seen_is_served_by_every_worker(db: Session) -> None:
+    user = create_random_user(db)
+
+    async def run() -> PresenceService:
+        leader_manager = ConnectionManager(MemoryBackend())
+        other_manager = ConnectionManager(MemoryBackend())
+        leader_manager.bus.node_id, other_manager.bus.node_id = "a", "b"
+        _link(leader_manager, other_manager)
+        _link(other_manager, leader_manager)
+        leader = PresenceService(leader_manager)
+        other = PresenceService(other_manager)
+
+        # Пользователь заходит и уходит через воркер лидера
+        connection = await leader_manager.connect(FakeWebSocket(), user.id, [])  # type: ignore[arg-type]
+        await leader.tick(full_sync=True)
+        await other.tick(full_sync=True)
+        leader_manager.disconnect(connection)
+        await leader.tick()
+        await other.tick()
+        return other
+
+    other = asyncio.run(run())
+    assert not other.is_leader()
+    # Второй воркер ничего не пишет в базу, но уже знает время визита
+    assert other._last_seen == {}
+    assert other.last_seen(user.id) is not None
+    assert not other.is_online(user.id)
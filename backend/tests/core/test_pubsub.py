@@ -0,0 +1,47 @@
+import asyncio
+
+from app.core.db import engine
+from app.core.pubsub import MemoryBackend, SQLiteBackend
+
+
+def test_memory_backend_delivers_locally() -> None:
+    received: list[tuple[str, str]] = []
+
+    async def handler(channel: str, event: str) -> None:
+        received.append((channel, event))
+
+    async def run() -> None:
+        bus = MemoryBackend()
+        bus.set_handler(handler)
+        await bus.publish("chat:1", '{"type":"ping"}')
+
+    asyncio.run(run())
+    assert received == [("chat:1", '{"type":"ping"}')]
+
+
+def test_sqlite_backend_fans_out_between_workers() -> None:
+    """Событие, опубликованное одним воркером, доставляется каждому воркеру один раз"""
+    received_a: list[str] = []
+    received_b: list[str] = []
+
+    async def handler_a(_channel: str, event: str) -> None:
+        received_a.append(event)
+
+    async def handler_b(_channel: str, event: str) -> None:
+        received_b.append(event)
+
+    async def run() -> None:
+        worker_a = SQLiteBackend(engine)
+        worker_b = SQLiteBackend(engine)
+        worker_a.set_handler(handler_a)
+        worker_b.set_handler(handler_b)
+        worker_a._last_id = worker_a._get_last_id()
+        worker_b._last_id = worker_b._get_last_id()
+
+        await worker_a.publish("chat:42", '{"type":"new_message","id":1}')
+        await worker_a.poll_once()
+        await worker_b.poll_once()
+
+    asyncio.run(run())
+    assert received_a == ['{"type":"new_message","id":1}']
+    assert received_b == ['{"type":"new_message","id":1}']
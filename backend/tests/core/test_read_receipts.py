@@ -0,0 +1,118 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlmodel import Session, select
+
+from app import crud
+from app.core.config import settings
+from app.core.pubsub import MemoryBackend
+from app.core.read_receipts import ReadReceiptBuffer
+from app.core.realtime import ConnectionManager, encode_event
+from app.models import ChatMember
+from tests.utils.realtime import FakeWebSocket
+from tests.utils.user import create_random_user
+
+
+def _last_read(db: Session, chat_id: int, user_id: int) -> datetime | None:
+    db.expire_all()
+    member = db.exec(
+        select(ChatMember).where(
+            ChatMember.chat_id == chat_id, ChatMember.user_id == user_id
+        )
+    ).one()
+    return member.last_read_at
+
+
+def test_read_receipts_are_batched(db: Session) -> None:
+    reader = create_random_user(db)
+    other = create_random_user(db)
+    chat = crud.get_or_create_private_chat(
+        session=db, user1_id=reader.id, user2_id=other.id
+    )
+    start = datetime(2026, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+
+    async def run() -> tuple[ReadReceiptBuffer, FakeWebSocket, FakeWebSocket]:
+        manager = ConnectionManager(MemoryBackend())
+        buffer = ReadReceiptBuffer(manager)
+        other_ws = FakeWebSocket()
+        await manager.connect(other_ws, other.id, [chat.id])  # type: ignore[arg-type]
+        # Другое устройство читателя со списком чатов
+        reader_ws = FakeWebSocket()
+        await manager.connect(reader_ws, reader.id, all_chats=True)  # type: ignore[arg-type]
+
+        # Прокрутка: много отметок, в том числе пришедших не по порядку
+        for seconds in (1, 5, 3, 10, 7):
+            buffer.mark(chat.id, reader.id, start + timedelta(seconds=seconds))
+        assert buffer.last_read(chat.id, reader.id) == start + timedelta(seconds=10)
+
+        await buffer.tick()
+        await asyncio.sleep(0.01)
+        await buffer.flush()
+        return buffer, other_ws, reader_ws
+
+    buffer, other_ws, reader_ws = asyncio.run(run())
+    receipts = [e for e in other_ws.sent if e["type"] == "read_receipts"]
+    assert len(receipts) == 1
+    assert receipts[0]["users"] == [
+        {
+            "user_id": reader.id,
+            "last_read_at": (start + timedelta(seconds=10)).isoformat(),
+        }
+    ]
+    updates = [e for e in reader_ws.sent if e["type"] == "chat_updated"]
+    assert updates == [{"type": "chat_updated", "chat_id": chat.id, "unread_count": 0}]
+    assert buffer.flushes_total == 1
+    assert buffer.last_read(chat.id, reader.id) is None
+    assert _last_read(db, chat.id, reader.id) == datetime(2026, 1, 1, 12, 0, 10)
+
+
+def test_read_marks_from_other_workers_are_overlaid(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    read_at = datetime(2026, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+
+    async def run() -> ReadReceiptBuffer:
+        buffer = ReadReceiptBuffer(ConnectionManager(MemoryBackend()))
+        # Отметка, сделанная на другом воркере и еще не записанная им в базу
+        await buffer._on_read_event(
+            "7",
+            encode_event(
+                {
+                    "type": "read_receipts",
+                    "chat_id": 7,
+                    "users": [{"user_id": 42, "last_read_at": read_at.isoformat()}],
+                }
+            ),
+        )
+        buffer.mark(7, 43, read_at)
+        return buffer
+
+    buffer = asyncio.run(run())
+    assert buffer.last_read(7, 42) == read_at
+    assert buffer.pending_for_chat(7) == {42: read_at, 43: read_at}
+    assert buffer.pending_for_user(42) == {7: read_at}
+    assert buffer.pending_for_user(43) == {7: read_at}
+    assert buffer.pending_for_chat(8) == {}
+    # Воркер-источник уже записал отметку в базу - услышанное истекает
+    monkeypatch.setattr(settings, "READ_RECEIPT_FLUSH_INTERVAL", 0)
+    asyncio.run(buffer.tick())
+    assert buffer.last_read(7, 42) is None
+    assert buffer.pending_for_user(42) == {}
+    assert buffer.pending_for_chat(7) == {43: read_at}
+
+
+def test_read_receipt_flush_never_moves_back(db: Session) -> None:
+    reader = create_random_user(db)
+    other = create_random_user(db)
+    chat = crud.get_or_create_private_chat(
+        session=db, user1_id=reader.id, user2_id=other.id
+    )
+    later = datetime(2026, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+    earlier = later - timedelta(minutes=5)
+
+    crud.update_last_read(session=db, last_read={(chat.id, reader.id): later})
+    # Другой воркер сбрасывает более старую позицию
+    crud.update_last_read(session=db, last_read={(chat.id, reader.id): earlier})
+
+    assert _last_read(db, chat.id, reader.id) == datetime(2026, 1, 1, 12, 0, 0)
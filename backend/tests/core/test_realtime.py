@@ -0,0 +1,260 @@
+import asyncio
+import json
+import time
+from datetime import datetime
+
+import pytest
+
+from app.core.config import settings
+from app.core.pubsub import MemoryBackend
+from app.core.realtime import ConnectionManager, encode_event
+from app.models import ChatMessagePublic
+from tests.utils.realtime import FakeWebSocket
+
+
+def test_slow_consumer_does_not_block_others() -> None:
+    async def run() -> None:
+        manager = ConnectionManager(MemoryBackend())
+        slow = FakeWebSocket(blocked=True)
+        fast = FakeWebSocket()
+        await manager.connect(slow, 1, [1])  # type: ignore[arg-type]
+        await manager.connect(fast, 2, [1])  # type: ignore[arg-type]
+
+        for i in range(3):
+            await manager.broadcast_to_chat({"n": i}, 1)
+        await asyncio.sleep(0.01)
+
+        assert fast.sent == [{"n": 0}, {"n": 1}, {"n": 2}]
+        assert slow.sent == []
+
+    asyncio.run(run())
+
+
+def test_drop_oldest_policy_keeps_latest_events(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "REALTIME_SEND_QUEUE_SIZE", 2)
+    monkeypatch.setattr(settings, "REALTIME_SLOW_CONSUMER_POLICY", "drop_oldest")
+
+    async def run() -> None:
+        manager = ConnectionManager(MemoryBackend())
+        ws = FakeWebSocket(blocked=True)
+        connection = await manager.connect(ws, 1, [1])  # type: ignore[arg-type]
+        await asyncio.sleep(0)  # писатель забирает первое событие и ждет
+
+        for i in range(5):
+            await manager.broadcast_to_chat({"n": i}, 1)
+        ws.unblocked.set()
+        await asyncio.sleep(0.01)
+
+        assert connection.dropped > 0
+        assert ws.sent[-2:] == [{"n": 3}, {"n": 4}]
+
+    asyncio.run(run())
+
+
+def test_disconnect_policy_unregisters_slow_consumer(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "REALTIME_SEND_QUEUE_SIZE", 1)
+    monkeypatch.setattr(settings, "REALTIME_SLOW_CONSUMER_POLICY", "disconnect")
+
+    async def run() -> None:
+        manager = ConnectionManager(MemoryBackend())
+        ws = FakeWebSocket(blocked=True)
+        connection = await manager.connect(ws, 1, [1])  # type: ignore[arg-type]
+
+        for i in range(3):
+            await manager.broadcast_to_chat({"n": i}, 1)
+        await asyncio.sleep(0.01)
+
+        assert connection.closed
+        assert ws.closed_with == 1013
+        assert manager.active_connections == {}
+        assert manager.user_connections == {}
+
+    asyncio.run(run())
+
+
+def test_encode_event_matches_model_dump() -> None:
+    message = ChatMessagePublic(
+        id=1,
+        chat_id=2,
+        sender_id=3,
+        content="hi",
+        created_at=datetime(2024, 1, 1, 12, 0),
+    )
+    data = encode_event({"type": "new_message", "message": message})
+    assert json.loads(data) == {
+        "type": "new_message",
+        "message": message.model_dump(mode="json"),
+    }
+
+
+def test_broadcast_encodes_once_for_all_recipients() -> None:
+    async def run() -> None:
+        manager = ConnectionManager(MemoryBackend())
+        sockets = [FakeWebSocket() for _ in range(3)]
+        for user_id, ws in enumerate(sockets):
+            await manager.connect(ws, user_id, [1])  # type: ignore[arg-type]
+
+        await manager.broadcast_to_chat({"type": "typing", "user_id": 1}, 1)
+        await asyncio.sleep(0.01)
+
+        # Всем получателям ушла одна и та же строка
+        payloads = {id(ws.raw[0]) for ws in sockets}
+        assert len(payloads) == 1
+
+    asyncio.run(run())
+
+
+def test_reaper_pings_then_closes_idle_connections() -> None:
+    async def run() -> None:
+        manager = ConnectionManager(MemoryBackend())
+        ws = FakeWebSocket()
+        connection = await manager.connect(ws, 1, [1])  # type: ignore[arg-type]
+
+        # Клиент молчит дольше интервала пинга
+        connection.last_activity -= settings.REALTIME_PING_INTERVAL
+        assert manager.reap() == 0
+        await asyncio.sleep(0.01)
+        assert ws.sent == [{"type": "ping"}]
+        assert manager.stats()["stale"] == 1
+
+        # ... и дольше таймаута бездействия
+        connection.last_activity -= settings.REALTIME_IDLE_TIMEOUT
+        assert manager.reap() == 1
+        await asyncio.sleep(0.01)
+        assert ws.closed_with == 1001
+        assert manager.active_connections == {}
+        assert manager.user_connections == {}
+        assert manager.stats()["reaped_total"] == 1
+
+    asyncio.run(run())
+
+
+def test_active_connection_is_not_reaped() -> None:
+    async def run() -> None:
+        manager = ConnectionManager(MemoryBackend())
+        connection = await manager.connect(FakeWebSocket(), 1, [1])  # type: ignore[arg-type]
+        connection.touch()
+
+        assert manager.reap() == 0
+        assert manager.stats()["live"] == 1
+
+    asyncio.run(run())
+
+
+def test_msgpack_connection_shares_encoded_frame() -> None:
+    async def run() -> None:
+        manager = ConnectionManager(MemoryBackend())
+        binary = [FakeWebSocket() for _ in range(2)]
+        text = FakeWebSocket()
+        for i, websocket in enumerate(binary):
+            await manager.connect(websocket, i, [1], protocol="msgpack")  # type: ignore[arg-type]
+        await manager.connect(text, 9, [1])  # type: ignore[arg-type]
+
+        await manager.broadcast_to_chat(
+            {"type": "typing", "chat_id": 1, "user_id": 9}, 1
+        )
+        await asyncio.sleep(0.01)
+
+        assert binary[0].sent == binary[1].sent == text.sent
+        assert isinstance(binary[0].raw[0], bytes)
+        # MessagePack закодирован один раз на всех бинарных клиентов
+        assert binary[0].raw[0] is binary[1].raw[0]
+        assert len(binary[0].raw[0]) < len(text.raw[0])
+
+    asyncio.run(run())
+
+
+def test_drain_closes_connections_in_waves(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "REALTIME_DRAIN_SECONDS", 0.2)
+    monkeypatch.setattr(settings, "REALTIME_DRAIN_WAVES", 4)
+    monkeypatch.setattr(settings, "REALTIME_RECONNECT_JITTER", 10)
+
+    async def run() -> None:
+        manager = ConnectionManager(MemoryBackend())
+        sockets = [FakeWebSocket() for _ in range(20)]
+        for i, websocket in enumerate(sockets):
+            await manager.connect(websocket, i, [1])  # type: ignore[arg-type]
+
+        drain = manager.start_drain()
+        await asyncio.sleep(0.01)
+        assert manager.draining
+        # Первая волна закрыта, остальные ждут своей очереди
+        assert sum(ws.closed_with is not None for ws in sockets) == 5
+
+        await drain
+        await asyncio.sleep(0.01)
+        assert all(ws.closed_with == 1012 for ws in sockets)
+        delays = [json.loads(ws.close_reason)["retry_after_ms"] for ws in sockets]
+        assert all(1000 <= delay <= 10000 for delay in delays)
+        # Задержки случайные, а не одна на всех
+        assert len(set(delays)) > 1
+        assert manager.active_connections == {}
+
+    asyncio.run(run())
+
+
+def test_frame_rate_limit_refills_over_time(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "REALTIME_FRAME_RATE", 10)
+    monkeypatch.setattr(settings, "REALTIME_FRAME_BURST", 3)
+
+    async def run() -> None:
+        manager = ConnectionManager(MemoryBackend())
+        connection = await manager.connect(FakeWebSocket(), 1, [1])  # type: ignore[arg-type]
+        now = connection.last_activity
+
+        assert [connection.allow_frame(now) for _ in range(5)] == [
+            True,
+            True,
+            True,
+            False,
+            False,
+        ]
+        assert connection.rate_limited == 2
+        # За 0.15 с набегает один кадр
+        assert connection.allow_frame(now + 0.15)
+        assert connection.rate_limited == 0
+        assert not connection.allow_frame(now + 0.15)
+
+    asyncio.run(run())
+
+
+def test_admission_limits(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "REALTIME_MAX_CONNECTIONS", 3)
+    monkeypatch.setattr(settings, "REALTIME_MAX_CONNECTIONS_PER_USER", 2)
+    monkeypatch.setattr(settings, "REALTIME_MAX_QUEUED_FRAMES", 5)
+
+    async def run() -> None:
+        manager = ConnectionManager(MemoryBackend())
+        assert manager.check_admission(1) is None
+        for _ in range(2):
+            await manager.connect(FakeWebSocket(), 1, [1])  # type: ignore[arg-type]
+
+        # Лимит пользователя
+        assert manager.check_admission(1) == (1008, "Too many connections")
+        assert manager.check_admission(2) is None
+
+        # Лимит воркера
+        blocked = FakeWebSocket(blocked=True)
+        connection = await manager.connect(blocked, 2, [2])  # type: ignore[arg-type]
+        code, reason = manager.check_admission()  # type: ignore[misc]
+        assert code == 1013
+        assert "retry_after_ms" in json.loads(reason)
+
+        # Сброс по глубине очередей: медленный клиент копит кадры
+        manager.disconnect(connection)
+        assert manager.connection_count == 2
+        await manager.connect(blocked, 2, [2])  # type: ignore[arg-type]
+        manager.disconnect(next(iter(manager.user_connections[1])))
+        for i in range(6):
+            await manager.broadcast_to_chat({"n": i}, 2)
+        await asyncio.sleep(0.01)
+        assert manager.queued_frames(now=time.monotonic() + 1) == 5
+        code, _ = manager.check_admission(3)  # type: ignore[misc]
+        assert code == 1013
+        assert manager.stats()["rejected_total"] == 3
+
+    asyncio.run(run())
@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+from app.core.pubsub import MemoryBackend
+from app.core.realtime import PING_FRAME_DATA, ConnectionManager, Frame
+from app.core.sse import SSEConnection, format_last_ids, retry_after_ms
+
+
+async def _read(connection: SSEConnection, count: int) -> list[str]:
+    chunks = []
+    async for chunk in connection.stream():
+        chunks.append(chunk)
+        if len(chunks) == count:
+            break
+    return chunks
+
+
+def test_sse_event_ids_track_last_message_per_chat() -> None:
+    async def run() -> None:
+        manager = ConnectionManager(MemoryBackend())
+        connection = SSEConnection(1, manager.disconnect, last_ids={1: 5})
+        manager.register(connection, [1, 2])
+
+        for chat_id, message_id in ((1, 6), (2, 3)):
+            await manager.broadcast_to_chat(
+                {
+                    "type": "new_message",
+                    "message": {"id": message_id, "chat_id": chat_id},
+                },
+                chat_id,
+            )
+        await manager.broadcast_to_chat({"type": "typing", "chat_id": 2}, 2)
+
+        chunks = await asyncio.wait_for(_read(connection, 3), 1)
+        assert chunks[0].startswith("id: 1:6\ndata: ")
+        assert chunks[1].startswith("id: 1:6,2:3\ndata: ")
+        # Без id: Last-Event-ID остается на последнем сообщении
+        assert chunks[2] == 'data: {"type":"typing","chat_id":2}\n\n'
+        manager.disconnect(connection)
+
+    asyncio.run(run())
+
+
+def test_sse_ping_is_a_comment_and_keeps_connection_alive() -> None:
+    async def run() -> None:
+        manager = ConnectionManager(MemoryBackend())
+        connection = SSEConnection(1, manager.disconnect)
+        manager.register(connection)
+        connection.last_activity -= 100
+
+        connection.enqueue(Frame(PING_FRAME_DATA))
+        assert await asyncio.wait_for(_read(connection, 1), 1) == [": ping\n\n"]
+        await asyncio.sleep(0)
+        assert connection.idle_for() < 1
+        manager.disconnect(connection)
+
+    asyncio.run(run())
+
+
+def test_sse_close_sends_retry_and_ends_stream() -> None:
+    async def run() -> None:
+        manager = ConnectionManager(MemoryBackend())
+        connection = SSEConnection(1, manager.disconnect)
+        manager.register(connection, [1])
+
+        connection.close(1012, json.dumps({"retry_after_ms": 2500}))
+        chunks = await asyncio.wait_for(_read(connection, 10), 1)
+        assert chunks == ["retry: 2500\n\n"]
+        assert manager.user_connections == {}
+
+    asyncio.run(run())
+
+
+def test_last_ids_helpers() -> None:
+    assert format_last_ids({7: 15, 1: 42}) == "1:42,7:15"
+    assert retry_after_ms('{"retry_after_ms": 1200}') == 1200
+    assert retry_after_ms("Slow consumer") is None
@@ -0,0 +1,74 @@
+import asyncio
+
+from app.core.config import settings
+from app.core.pubsub import MemoryBackend
+from app.core.realtime import ConnectionManager
+from app.core.typing_indicators import TypingIndicators
+from tests.utils.realtime import FakeWebSocket
+
+
+def test_typing_is_throttled_batched_and_expires() -> None:
+    async def run() -> None:
+        manager = ConnectionManager(MemoryBackend())
+        indicators = TypingIndicators(manager)
+        sockets = [FakeWebSocket() for _ in range(3)]
+        for user_id, websocket in enumerate(sockets, start=1):
+            await manager.connect(websocket, user_id, [10])  # type: ignore[arg-type]
+
+        # Поток нажатий от двух пользователей - одно изменение на каждого
+        for _ in range(20):
+            indicators.typing(10, 1, "alice", now=0)
+            indicators.typing(10, 2, "bob", now=0)
+        assert indicators.throttled_total == 38
+        await indicators.tick(now=1)
+        await asyncio.sleep(0.01)
+
+        alice, bob, carol = (ws.sent for ws in sockets)
+        assert carol == [
+            {
+                "type": "typing",
+                "chat_id": 10,
+                "started": [
+                    {"user_id": 1, "user_name": "alice"},
+                    {"user_id": 2, "user_name": "bob"},
+                ],
+                "stopped": [],
+            }
+        ]
+        # Печатающие не получают себя
+        assert [u["user_id"] for u in alice[0]["started"]] == [2]
+        assert [u["user_id"] for u in bob[0]["started"]] == [1]
+
+        # Пока typing продолжаются, новых кадров нет
+        indicators.typing(10, 1, "alice", now=2)
+        await indicators.tick(now=3)
+        await asyncio.sleep(0.01)
+        assert len(carol) == 1
+
+        # bob отправил сообщение, alice замолчала
+        indicators.stopped_typing(10, 2)
+        await indicators.tick(now=4)
+        await indicators.tick(now=2 + settings.TYPING_TIMEOUT)
+        await asyncio.sleep(0.01)
+        assert [event["stopped"] for event in carol[1:]] == [[2], [1]]
+        assert bob[1:] == [
+            {"type": "typing", "chat_id": 10, "started": [], "stopped": [1]}
+        ]
+
+    asyncio.run(run())
+
+
+def test_typing_started_and_stopped_within_tick_is_not_sent() -> None:
+    async def run() -> None:
+        manager = ConnectionManager(MemoryBackend())
+        indicators = TypingIndicators(manager)
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, 2, [10])  # type: ignore[arg-type]
+
+        indicators.typing(10, 1, "alice", now=0)
+        indicators.stopped_typing(10, 1)
+        await indicators.tick(now=0.1)
+        await asyncio.sleep(0.01)
+        assert websocket.sent == []
+
+    asyncio.run(run())
@@ -0,0 +1,106 @@
+from sqlalchemy import create_engine, text
+from sqlmodel import Session, SQLModel, select
+
+from app import crud
+from app.core.db import upgrade_schema
+from app.models import Chat, ChatMember
+from tests.utils.user import create_random_user
+
+
+def test_message_writes_maintain_chat_summary(db: Session) -> None:
+    user1 = create_random_user(db)
+    user2 = create_random_user(db)
+    chat = crud.get_or_create_private_chat(
+        session=db, user1_id=user1.id, user2_id=user2.id
+    )
+
+    first = crud.create_message(
+        session=db, chat_id=chat.id, sender_id=user1.id, content="first"
+    )
+    second = crud.create_message(
+        session=db, chat_id=chat.id, sender_id=user2.id, content="second"
+    )
+    db.refresh(chat)
+    assert (chat.last_message_id, chat.last_message_sender_id, chat.message_count) == (
+        second.id,
+        user2.id,
+        2,
+    )
+    assert chat.updated_at == second.created_at
+
+    crud.update_message(
+        session=db, message_id=second.id, sender_id=user2.id, content="edited"
+    )
+    db.refresh(chat)
+    assert chat.last_message_preview == "edited"
+    # Правка не поднимает чат в списке
+    assert chat.updated_at == second.created_at
+
+    crud.delete_message(session=db, message_id=second.id, user_id=user2.id)
+    db.refresh(chat)
+    assert (chat.last_message_id, chat.last_message_preview, chat.message_count) == (
+        first.id,
+        "first",
+        1,
+    )
+
+
+def test_upgrade_schema_backfills_chat_summary_and_unread_counts() -> None:
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for user_id in (1, 2):
+            conn.execute(
+                text(
+                    "INSERT INTO user (id, email, is_active, is_superuser, hashed_password) "
+                    f"VALUES ({user_id}, 'u{user_id}@example.com', 1, 0, 'x')"
+                )
+            )
+        conn.execute(
+            text(
+                "INSERT INTO chat (id, chat_type, created_at, updated_at) "
+                "VALUES (1, 'group', '2024-01-01', '2024-01-01')"
+            )
+        )
+        # Участник 2 прочитал первое сообщение, участник 1 - отправитель
+        conn.execute(
+            text(
+                "INSERT INTO chatmember (chat_id, user_id, joined_at, last_read_at) "
+                "VALUES (1, 1, '2024-01-01', NULL), (1, 2, '2024-01-01', '2024-01-01 12:00')"
+            )
+        )
+        for message_id, content in ((1, "old"), (2, "y" * 150)):
+            conn.execute(
+                text(
+                    "INSERT INTO chatmessage (id, chat_id, sender_id, content, created_at) "
+                    f"VALUES ({message_id}, 1, 1, :content, '2024-01-0{message_id}')"
+                ),
+                {"content": content},
+            )
+        # База, созданная до появления сводки
+        for column in (
+            "last_message_id",
+            "last_message_preview",
+            "last_message_sender_id",
+            "last_message_at",
+            "message_count",
+        ):
+            conn.execute(text(f"ALTER TABLE chat DROP COLUMN {column}"))
+        conn.execute(text("ALTER TABLE chatmember DROP COLUMN unread_count"))
+
+    upgrade_schema(engine)
+
+    with Session(engine) as session:
+        chat = session.get(Chat, 1)
+        assert chat is not None
+        assert (
+            chat.last_message_id,
+            chat.last_message_sender_id,
+            chat.message_count,
+        ) == (2, 1, 2)
+        assert chat.last_message_preview == "y" * 100
+        assert chat.last_message_at is not None
+        unread = dict(
+            session.exec(select(ChatMember.user_id, ChatMember.unread_count)).all()
+        )
+        assert unread == {1: 0, 2: 1}
@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import crud, crud_async
+from app.core.db import async_engine
+from app.models import CHAT_PREVIEW_LENGTH, Chat
+from tests.utils.user import create_random_user
+
+
+def test_async_create_and_get_messages(db: Session) -> None:
+    user1 = create_random_user(db)
+    user2 = create_random_user(db)
+    chat = crud.get_or_create_private_chat(
+        session=db, user1_id=user1.id, user2_id=user2.id
+    )
+
+    async def run() -> list[str]:
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            await crud_async.create_message(
+                session=session, chat_id=chat.id, sender_id=user1.id, content="first"
+            )
+            await crud_async.create_message(
+                session=session, chat_id=chat.id, sender_id=user2.id, content="second"
+            )
+            messages = await crud_async.get_chat_messages(
+                session=session, chat_id=chat.id, user_id=user1.id
+            )
+            return [message.content for message in messages]
+
+    assert asyncio.run(run()) == ["first", "second"]
+
+
+def test_async_create_message_requires_membership(db: Session) -> None:
+    user1 = create_random_user(db)
+    user2 = create_random_user(db)
+    outsider = create_random_user(db)
+    chat = crud.get_or_create_private_chat(
+        session=db, user1_id=user1.id, user2_id=user2.id
+    )
+
+    async def run() -> None:
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            await crud_async.create_message(
+                session=session, chat_id=chat.id, sender_id=outsider.id, content="hi"
+            )
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+
+
+def test_async_message_writes_maintain_chat_summary(db: Session) -> None:
+    user1 = create_random_user(db)
+    user2 = create_random_user(db)
+    chat = crud.get_or_create_private_chat(
+        session=db, user1_id=user1.id, user2_id=user2.id
+    )
+
+    async def run() -> tuple[int, int, list[tuple[int | None, str | None, int]]]:
+        summaries = []
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+
+            async def snapshot() -> None:
+                loaded = await session.get(Chat, chat.id, populate_existing=True)
+                assert loaded is not None
+                summaries.append(
+                    (
+                        loaded.last_message_id,
+                        loaded.last_message_preview,
+                        loaded.message_count,
+                    )
+                )
+
+            first = await crud_async.create_message(
+                session=session, chat_id=chat.id, sender_id=user1.id, content="first"
+            )
+            second = await crud_async.create_message(
+                session=session, chat_id=chat.id, sender_id=user2.id, content="x" * 300
+            )
+            await snapshot()
+            await crud_async.update_message(
+                session=session,
+                message_id=second.id,
+                sender_id=user2.id,
+                content="edited",
+            )
+            await snapshot()
+            # Редактирование не последнего сообщения сводку не трогает
+            await crud_async.update_message(
+                session=session,
+                message_id=first.id,
+                sender_id=user1.id,
+                content="changed",
+            )
+            await snapshot()
+            await crud_async.delete_message(
+                session=session, message_id=second.id, user_id=user2.id
+            )
+            await snapshot()
+            await crud_async.delete_message(
+                session=session, message_id=first.id, user_id=user1.id
+            )
+            await snapshot()
+            return first.id, second.id, summaries
+
+    first_id, second_id, summaries = asyncio.run(run())
+    assert summaries == [
+        (second_id, "x" * CHAT_PREVIEW_LENGTH, 2),
+        (second_id, "edited", 2),
+        (second_id, "edited", 2),
+        (first_id, "changed", 1),
+        (None, None, 0),
+    ]
+
+
+def test_async_message_pages_and_window(db: Session) -> None:
+    user1 = create_random_user(db)
+    user2 = create_random_user(db)
+    chat = crud.get_or_create_private_chat(
+        session=db, user1_id=user1.id, user2_id=user2.id
+    )
+    ids = [
+        crud.create_message(
+            session=db, chat_id=chat.id, sender_id=user1.id, content=str(i)
+        ).id
+        for i in range(5)
+    ]
+
+    async def run() -> tuple[list[int], list[int], list[int]]:
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            before = await crud_async.get_chat_messages(
+                session=session,
+                chat_id=chat.id,
+                user_id=user1.id,
+                limit=2,
+                before_id=ids[3],
+            )
+            after = await crud_async.get_chat_messages(
+                session=session,
+                chat_id=chat.id,
+                user_id=user1.id,
+                limit=2,
+                after_id=ids[3],
+            )
+            window = await crud_async.get_messages_around(
+                session=session,
+                chat_id=chat.id,
+                user_id=user1.id,
+                limit=2,
+                around_id=ids[2],
+            )
+            assert window is not None
+            return [m.id for m in before], [m.id for m in after], [m.id for m in window]
+
+    assert asyncio.run(run()) == (ids[1:3], ids[4:], ids[1:3])
@@ -0,0 +1,146 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from sqlalchemy import text, update
+from sqlmodel import Session
+
+from app import crud
+from app.models import ChatMessage
+from tests.utils.user import create_random_user
+
+
+def _chat_with_messages(db: Session, count: int) -> tuple[int, int, list[int]]:
+    user1 = create_random_user(db)
+    user2 = create_random_user(db)
+    chat = crud.get_or_create_private_chat(
+        session=db, user1_id=user1.id, user2_id=user2.id
+    )
+    ids = [
+        crud.create_message(
+            session=db, chat_id=chat.id, sender_id=user1.id, content=str(i)
+        ).id
+        for i in range(count)
+    ]
+    return chat.id, user1.id, ids
+
+
+def test_pages_before_cursor_cover_history_without_gaps(db: Session) -> None:
+    chat_id, user_id, ids = _chat_with_messages(db, 7)
+    # Одинаковое время у нескольких сообщений - порядок решает id
+    for message_id, day in zip(ids, (1, 1, 2, 2, 2, 3, 3), strict=True):
+        db.execute(
+            update(ChatMessage)
+            .where(ChatMessage.id == message_id)
+            .values(created_at=datetime(2020, 1, day))
+        )
+    db.commit()
+
+    page = crud.get_chat_messages(session=db, chat_id=chat_id, user_id=user_id, limit=3)
+    assert [m.id for m in page] == ids[4:]
+    # Новое сообщение во время листания не сдвигает следующую страницу
+    crud.create_message(session=db, chat_id=chat_id, sender_id=user_id, content="new")
+
+    seen = [m.id for m in page]
+    while page:
+        page = crud.get_chat_messages(
+            session=db, chat_id=chat_id, user_id=user_id, limit=3, before_id=page[0].id
+        )
+        seen = [m.id for m in page] + seen
+    assert seen == ids
+
+
+def test_page_after_cursor(db: Session) -> None:
+    chat_id, user_id, ids = _chat_with_messages(db, 5)
+
+    page = crud.get_chat_messages(
+        session=db, chat_id=chat_id, user_id=user_id, limit=2, after_id=ids[1]
+    )
+    assert [m.id for m in page] == ids[2:4]
+    assert (
+        crud.get_chat_messages(
+            session=db, chat_id=chat_id, user_id=user_id, after_id=ids[-1]
+        )
+        == []
+    )
+
+
+def test_deleted_cursor_falls_back_to_id(db: Session) -> None:
+    chat_id, user_id, ids = _chat_with_messages(db, 4)
+    crud.delete_message(session=db, message_id=ids[2], user_id=user_id)
+
+    page = crud.get_chat_messages(
+        session=db, chat_id=chat_id, user_id=user_id, before_id=ids[2]
+    )
+    assert [m.id for m in page] == ids[:2]
+
+
+def test_window_around_message(db: Session) -> None:
+    chat_id, user_id, ids = _chat_with_messages(db, 9)
+
+    window = crud.get_messages_around(
+        session=db, chat_id=chat_id, user_id=user_id, limit=4, around_id=ids[4]
+    )
+    assert [m.id for m in window] == ids[2:6]
+    # У начала истории окно короче
+    window = crud.get_messages_around(
+        session=db, chat_id=chat_id, user_id=user_id, limit=4, around_id=ids[0]
+    )
+    assert [m.id for m in window] == ids[:2]
+
+    _, _, other_ids = _chat_with_messages(db, 1)
+    assert (
+        crud.get_messages_around(
+            session=db, chat_id=chat_id, user_id=user_id, around_id=other_ids[0]
+        )
+        is None
+    )
+
+
+def test_window_at_first_unread(db: Session) -> None:
+    chat_id, user_id, ids = _chat_with_messages(db, 6)
+    for message_id, day in zip(ids, range(1, 7), strict=True):
+        db.execute(
+            update(ChatMessage)
+            .where(ChatMessage.id == message_id)
+            .values(created_at=datetime(2020, 1, day))
+        )
+    db.commit()
+
+    # Прочитано все по 3 января включительно; то же время с поясом +03:00
+    for last_read_at in (
+        datetime(2020, 1, 3),
+        datetime(2020, 1, 3, 3, tzinfo=timezone(timedelta(hours=3))),
+    ):
+        window = crud.get_messages_around(
+            session=db,
+            chat_id=chat_id,
+            user_id=user_id,
+            limit=4,
+            around_at=last_read_at,
+        )
+        assert [m.id for m in window] == ids[1:5]
+
+
+def _plan(db: Session, statement: Any) -> str:
+    compiled = statement.compile(db.get_bind(), compile_kwargs={"literal_binds": True})
+    rows = db.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+    return " ".join(row[-1] for row in rows)
+
+
+def test_page_queries_seek_composite_index(db: Session) -> None:
+    chat_id, _, ids = _chat_with_messages(db, 2)
+    cursor = db.get(ChatMessage, ids[1])
+    statements = [
+        crud.page_statement(
+            chat_id=chat_id, limit=50, before_id=cursor.id, cursor=cursor
+        ),
+        crud.page_statement(
+            chat_id=chat_id, limit=50, after_id=cursor.id, cursor=cursor
+        ),
+        *crud.around_statements(chat_id=chat_id, limit=50, anchor=cursor),
+        *crud.around_statements(chat_id=chat_id, limit=50, around_at=cursor.created_at),
+    ]
+    for statement in statements:
+        plan = _plan(db, statement)
+        assert "ix_chatmessage_chat_id_created_at_id" in plan
+        assert "TEMP B-TREE" not in plan
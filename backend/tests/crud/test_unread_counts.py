@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlmodel import Session, select
+
+from app import crud
+from app.models import ChatMember
+from tests.utils.user import create_random_user
+
+
+def _unread(db: Session, chat_id: int) -> dict[int, int]:
+    db.expire_all()
+    members = db.exec(select(ChatMember).where(ChatMember.chat_id == chat_id)).all()
+    return {member.user_id: member.unread_count for member in members}
+
+
+def test_unread_counters_follow_messages_and_reads(db: Session) -> None:
+    sender = create_random_user(db)
+    reader = create_random_user(db)
+    other = create_random_user(db)
+    chat = crud.create_group_chat(
+        session=db,
+        creator_id=sender.id,
+        name="unread",
+        member_ids=[reader.id, other.id],
+    )
+
+    messages = [
+        crud.create_message(
+            session=db, chat_id=chat.id, sender_id=sender.id, content=str(i)
+        )
+        for i in range(3)
+    ]
+    assert _unread(db, chat.id) == {sender.id: 0, reader.id: 3, other.id: 3}
+
+    # Отметка о прочтении между вторым и третьим сообщением
+    read_at = messages[1].created_at.replace(tzinfo=timezone.utc) + timedelta(
+        microseconds=1
+    )
+    crud.update_last_read(session=db, last_read={(chat.id, reader.id): read_at})
+    assert _unread(db, chat.id)[reader.id] == 1
+
+    # Удаление прочитанного сообщения счетчик читателя не меняет
+    crud.delete_message(session=db, message_id=messages[0].id, user_id=sender.id)
+    assert _unread(db, chat.id) == {sender.id: 0, reader.id: 1, other.id: 2}
+
+    crud.delete_message(session=db, message_id=messages[2].id, user_id=sender.id)
+    assert _unread(db, chat.id) == {sender.id: 0, reader.id: 0, other.id: 1}
+
+    crud.mark_chat_as_read(session=db, chat_id=chat.id, user_id=other.id)
+    assert _unread(db, chat.id)[other.id] == 0
+
+
+def test_unread_summary_applies_pending_reads(db: Session) -> None:
+    sender = create_random_user(db)
+    reader = create_random_user(db)
+    chats = [
+        crud.get_or_create_private_chat(
+            session=db, user1_id=reader.id, user2_id=sender.id
+        ),
+        crud.create_group_chat(
+            session=db, creator_id=sender.id, name="summary", member_ids=[reader.id]
+        ),
+    ]
+    for chat in chats:
+        for _ in range(2):
+            crud.create_message(
+                session=db, chat_id=chat.id, sender_id=sender.id, content="hi"
+            )
+
+    summary = crud.get_unread_summary(session=db, user_id=reader.id)
+    assert summary == {chats[0].id: 2, chats[1].id: 2}
+
+    summary = crud.get_unread_summary(
+        session=db,
+        user_id=reader.id,
+        read_overrides={chats[0].id: datetime.now(timezone.utc) + timedelta(seconds=1)},
+    )
+    assert summary == {chats[0].id: 0, chats[1].id: 2}
+
+
+def test_unread_counts_apply_pending_reads_per_member(db: Session) -> None:
+    sender = create_random_user(db)
+    reader = create_random_user(db)
+    other = create_random_user(db)
+    chat = crud.create_group_chat(
+        session=db,
+        creator_id=sender.id,
+        name="pending",
+        member_ids=[reader.id, other.id],
+    )
+    messages = [
+        crud.create_message(
+            session=db, chat_id=chat.id, sender_id=sender.id, content=str(i)
+        )
+        for i in range(3)
+    ]
+
+    # У каждого участника своя еще не записанная позиция - считаются одним запросом
+    def after(index: int) -> datetime:
+        created_at = messages[index].created_at.replace(tzinfo=timezone.utc)
+        return created_at + timedelta(microseconds=1)
+
+    counts = crud.get_unread_counts(
+        session=db,
+        chat_id=chat.id,
+        read_overrides={reader.id: after(0), other.id: after(1)},
+    )
+    assert counts == {sender.id: 0, reader.id: 2, other.id: 1}
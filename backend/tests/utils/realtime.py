@@ -0,0 +1,35 @@
+import asyncio
+import json
+from typing import Any
+
+import msgpack
+
+
+class FakeWebSocket:
+    """Минимальная замена WebSocket: запоминает отправленное, может 'тормозить'"""
+
+    def __init__(self, blocked: bool = False) -> None:
+        self.sent: list[Any] = []
+        self.raw: list[str] = []
+        self.closed_with: int | None = None
+        self.close_reason = ""
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    async def accept(self, subprotocol: str | None = None) -> None:
+        pass
+
+    async def send_text(self, data: str) -> None:
+        await self.unblocked.wait()
+        self.raw.append(data)
+        self.sent.append(json.loads(data))
+
+    async def send_bytes(self, data: bytes) -> None:
+        await self.unblocked.wait()
+        self.raw.append(data)  # type: ignore[arg-type]
+        self.sent.append(msgpack.unpackb(data))
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        self.closed_with = code
+        self.close_reason = reason
@@ -107,9 +107,11 @@ export const chatsAPI = {
     return response.data
   },
   
-  getMessages: async (chatId, skip = 0, limit = 50) => {
+  // Листание истории: { before_id } - предыдущая страница, { after_id } - следующая,
+  // { around_id } или { around_at } - окно вокруг сообщения или момента (last_read_at)
+  getMessages: async (chatId, { limit = 50, before_id, after_id, around_id, around_at } = {}) => {
     const response = await api.get(`/chats/${chatId}/messages`, {
-      params: { skip, limit },
+      params: { limit, before_id, after_id, around_id, around_at },
     })
     return response.data
   },
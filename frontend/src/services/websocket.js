@@ -8,12 +8,24 @@ export class ChatWebSocket {
     this.ws = null
     this.reconnectAttempts = 0
     this.maxReconnectAttempts = 5
+    // Последнее полученное сообщение: при переподключении сервер
+    // дошлет все, что пришло после него (параметр last_id)
+    this.lastMessageId = null
+  }
+
+  trackMessageId(id) {
+    if (Number.isInteger(id) && (this.lastMessageId === null || id > this.lastMessageId)) {
+      this.lastMessageId = id
+    }
   }
 
   connect() {
     // Всегда используем относительный путь через nginx прокси
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:'
-    const wsUrl = `${protocol}//${window.location.host}/api/v1/ws/${this.chatId}?token=${this.token}`
+    let wsUrl = `${protocol}//${window.location.host}/api/v1/ws/${this.chatId}?token=${this.token}`
+    if (this.lastMessageId !== null) {
+      wsUrl += `&last_id=${this.lastMessageId}`
+    }
     
     console.log('Connecting to WebSocket:', wsUrl)
     
@@ -28,7 +40,15 @@ export class ChatWebSocket {
       this.ws.onmessage = (event) => {
         try {
           const data = JSON.parse(event.data)
+          // Сервер пингует молчащее соединение и закрывает его, если нет ответа
+          if (data.type === 'ping') {
+            this.ws.send(JSON.stringify({ type: 'pong' }))
+            return
+          }
           console.log('WebSocket message received:', data)
+          if (data.type === 'new_message') {
+            this.trackMessageId(data.message?.id)
+          }
           if (this.onMessage) {
             this.onMessage(data)
           }
@@ -44,7 +64,7 @@ export class ChatWebSocket {
         }
       }
 
-      this.ws.onclose = () => {
+      this.ws.onclose = (event) => {
         console.log('WebSocket disconnected')
         // Попытка переподключения
         if (this.reconnectAttempts < this.maxReconnectAttempts) {
@@ -52,7 +72,7 @@ export class ChatWebSocket {
           setTimeout(() => {
             console.log(`Reconnecting... Attempt ${this.reconnectAttempts}`)
             this.connect()
-          }, 1000 * this.reconnectAttempts)
+          }, this.reconnectDelay(event))
         }
       }
     } catch (error) {
@@ -63,6 +83,22 @@ export class ChatWebSocket {
     }
   }
 
+  reconnectDelay(event) {
+    // 1012 - сервер перезапускается, 1013 - перегружен; задержку
+    // переподключения он назначает сам в reason
+    if ((event.code === 1012 || event.code === 1013) && event.reason.startsWith('{')) {
+      try {
+        const { retry_after_ms: retryAfterMs } = JSON.parse(event.reason)
+        if (retryAfterMs) {
+          return retryAfterMs
+        }
+      } catch (error) {
+        console.error('Error parsing close reason:', error)
+      }
+    }
+    return 1000 * this.reconnectAttempts
+  }
+
   sendMessage(content) {
     if (this.ws && this.ws.readyState === WebSocket.OPEN) {
       this.ws.send(JSON.stringify({